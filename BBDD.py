@@ -1,22 +1,158 @@
+import functools
+import itertools
+import json
 import sqlite3
-from datetime import datetime, timedelta
-from threading import local
-import re
+import weakref
+from concurrent.futures import Future
+from contextlib import contextmanager
+from threading import current_thread, local
 
-class DatabaseManager:
-    def __init__(self, db_name="database.db"):
-        self._local = local()  # Almacenamiento local por hilo
+import metrics
+from db_pool import ConnectionPool
+from group_commit import ConexionAgrupada, GroupCommitWriter
+from repository import (DOSIS_ENVIADA, DOSIS_OMITIDA, DOSIS_POR_RECORDATORIO, FilaDatosDosis, FilaDosis,
+                        FilaVencida, ReglaDosis, ReminderRepository, con_conexion, separar_dosis_id)
+
+# Migraciones del esquema. La versión aplicada se guarda en PRAGMA user_version:
+# la migración i de la lista lleva la base de datos a la versión i + 1.
+MIGRACIONES = [
+    # 1: índices para las consultas de dosis pendientes y recordatorios activos
+    [
+        '''CREATE INDEX IF NOT EXISTS idx_dosis_recordatorio_pendiente
+           ON DosisProgramada (recordatorio_id, tomada, hora_programada)''',
+        '''CREATE INDEX IF NOT EXISTS idx_recordatorio_usuario_activo
+           ON Recordatorio (usuario_id, activo)''',
+        '''CREATE INDEX IF NOT EXISTS idx_cuenta_usuario_activa
+           ON CuentaBancaria (usuario_id, activa, fecha_registro)''',
+    ],
+    # 2: instante absoluto (epoch) de cada dosis para recuperar las vencidas tras un reinicio.
+    # Las dosis anteriores a esta migración quedan con instante NULL (solo tienen "HH:MM")
+    [
+        'ALTER TABLE DosisProgramada ADD COLUMN instante INTEGER',
+        '''CREATE INDEX IF NOT EXISTS idx_dosis_pendiente_instante
+           ON DosisProgramada (tomada, instante)''',
+    ],
+    # 3: las dosis dejan de guardarse una a una. Cada recordatorio guarda su regla
+    # (minuto del día y primer instante de la dosis 0, intervalo en segundos y
+    # dosis_totales) y un cursor con la siguiente dosis pendiente; ExcepcionDosis
+    # solo anota las omitidas y las enviadas fuera de orden (ver ReglaDosis)
+    [
+        'ALTER TABLE Recordatorio ADD COLUMN minuto_inicio INTEGER',
+        'ALTER TABLE Recordatorio ADD COLUMN primer_instante INTEGER',
+        'ALTER TABLE Recordatorio ADD COLUMN intervalo INTEGER',
+        'ALTER TABLE Recordatorio ADD COLUMN siguiente_indice INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE Recordatorio ADD COLUMN siguiente_instante INTEGER',
+        'ALTER TABLE Recordatorio ADD COLUMN adelantadas INTEGER NOT NULL DEFAULT 0',
+        '''CREATE TABLE IF NOT EXISTS ExcepcionDosis (
+            recordatorio_id INTEGER NOT NULL,
+            indice INTEGER NOT NULL,
+            estado INTEGER NOT NULL,
+            PRIMARY KEY (recordatorio_id, indice)
+        ) WITHOUT ROWID''',
+        # Posición de cada dosis existente dentro de su recordatorio
+        '''CREATE TEMP TABLE DosisMigradas AS
+           SELECT recordatorio_id, tomada, instante, hora_programada,
+                  ROW_NUMBER() OVER (PARTITION BY recordatorio_id ORDER BY dosis_id) - 1 AS indice,
+                  COUNT(*) OVER (PARTITION BY recordatorio_id) AS total
+           FROM DosisProgramada''',
+        'CREATE INDEX temp.idx_dosis_migradas ON DosisMigradas (recordatorio_id, indice)',
+        '''UPDATE Recordatorio SET
+               intervalo = frecuencia_horas * 3600,
+               dosis_totales = d.total,
+               minuto_inicio = CAST(substr(d.hora_programada, 1, 2) AS INTEGER) * 60
+                               + CAST(substr(d.hora_programada, 4, 2) AS INTEGER)
+           FROM DosisMigradas d
+           WHERE d.recordatorio_id = Recordatorio.recordatorio_id AND d.indice = 0''',
+        # El cursor queda en la primera dosis pendiente y la regla se fecha con la primera pendiente que tenga instante
+        '''UPDATE Recordatorio SET
+               siguiente_indice = COALESCE((SELECT MIN(d.indice) FROM DosisMigradas d
+                                            WHERE d.recordatorio_id = Recordatorio.recordatorio_id
+                                              AND d.tomada = 0), dosis_totales),
+               primer_instante = (SELECT d.instante - d.indice * Recordatorio.intervalo FROM DosisMigradas d
+                                  WHERE d.recordatorio_id = Recordatorio.recordatorio_id
+                                    AND d.instante IS NOT NULL
+                                  ORDER BY d.tomada != 0, d.indice LIMIT 1)
+           WHERE intervalo IS NOT NULL''',
+        f'''INSERT INTO ExcepcionDosis (recordatorio_id, indice, estado)
+           SELECT d.recordatorio_id, d.indice, d.tomada FROM DosisMigradas d
+           JOIN Recordatorio r ON r.recordatorio_id = d.recordatorio_id
+           WHERE (d.indice < r.siguiente_indice AND d.tomada = {DOSIS_OMITIDA})
+              OR (d.indice > r.siguiente_indice AND d.tomada != 0)''',
+        '''UPDATE Recordatorio SET
+               adelantadas = (SELECT COUNT(*) FROM ExcepcionDosis e
+                              WHERE e.recordatorio_id = Recordatorio.recordatorio_id
+                                AND e.indice >= Recordatorio.siguiente_indice),
+               siguiente_instante = CASE WHEN siguiente_indice < dosis_totales
+                                         THEN primer_instante + siguiente_indice * intervalo END
+           WHERE intervalo IS NOT NULL''',
+        'DROP TABLE DosisMigradas',
+        'DROP TABLE DosisProgramada',
+        # El barredor busca los recordatorios cuya siguiente dosis ya venció
+        '''CREATE INDEX IF NOT EXISTS idx_recordatorio_siguiente_instante
+           ON Recordatorio (siguiente_instante) WHERE siguiente_instante IS NOT NULL''',
+    ],
+    # 4: token del bot por el que se creó cada recordatorio, para enviar sus dosis con el mismo bot.
+    # Los anteriores quedan sin token y solo se envían si hay TELEGRAM_TOKEN
+    [
+        'ALTER TABLE Recordatorio ADD COLUMN token TEXT',
+    ],
+]
+
+# Columnas de Recordatorio r con las que se construye una ReglaDosis
+COLUMNAS_REGLA = '''r.recordatorio_id, r.primer_instante, r.intervalo, r.minuto_inicio,
+       r.dosis_totales, r.siguiente_indice, r.adelantadas'''
+# Expresiones sobre la regla de r: todo sale de la fila del recordatorio, sin contar dosis
+HAY_PENDIENTES = 'r.intervalo IS NOT NULL AND r.siguiente_indice < r.dosis_totales'
+DOSIS_RESTANTES = f'CASE WHEN {HAY_PENDIENTES} THEN r.dosis_totales - r.siguiente_indice - r.adelantadas ELSE 0 END'
+_MINUTO_SIGUIENTE = '((r.minuto_inicio + r.siguiente_indice * (r.intervalo / 60)) % 1440)'
+PROXIMA_HORA = (f"CASE WHEN {HAY_PENDIENTES} THEN "
+                f"printf('%02d:%02d', {_MINUTO_SIGUIENTE} / 60, {_MINUTO_SIGUIENTE} % 60) END")
+SIGUIENTE_DOSIS_ID = (f'CASE WHEN {HAY_PENDIENTES} '
+                      f'THEN r.recordatorio_id * {DOSIS_POR_RECORDATORIO} + r.siguiente_indice END')
+
+# Usuarios por sentencia en las altas masivas: 3 parámetros por fila, lejos del límite de variables de SQLite
+USUARIOS_POR_UPSERT = 300
+# Hashes por consulta a la memoria de traducción (un parámetro por hash)
+HASHES_POR_CONSULTA = 500
+
+
+def _escritura(metodo):
+    """Como con_conexion, pero con group commit la escritura la hace el escritor agrupado"""
+    @functools.wraps(metodo)
+    def envoltura(self, *args, **kwargs):
+        if self.writer is None or self.writer.en_hilo_escritor():
+            with self.conexion():
+                return metodo(self, *args, **kwargs)
+        return self.writer.submit(metodo, self, *args, **kwargs).result()
+    return metrics.DB.cronometrar(envoltura)
+
+
+class DatabaseManager(ReminderRepository):
+    """ReminderRepository sobre un fichero SQLite local"""
+
+    def __init__(self, db_name="database.db", max_conexiones=16, timeout=30, group_commit=False):
+        self._local = local()  # Conexión prestada al hilo actual
         self.db_name = db_name
-        
-        
-        # Inicializa la conexión para el hilo principal
+        self.pool = ConnectionPool(db_name, max_conexiones=max_conexiones, timeout=timeout)
+        self.writer = None
+
+        # Crea las tablas y aplica las migraciones pendientes
         self._init_connection()
 
+        if group_commit:
+            # Un único hilo escribe en nombre de todos y confirma las escrituras por lotes
+            self.writer = GroupCommitWriter(
+                lambda: self.pool.conectar(ConexionAgrupada),
+                al_iniciar=lambda conn: setattr(self._local, 'conn', conn),
+            )
+
     def _init_connection(self):
-        """Inicializa la conexión y crea tablas si no existen"""
-        conn = sqlite3.connect(self.db_name)
+        """Crea las tablas si no existen (el pool ya aplica los PRAGMAs, incluido WAL)"""
+        with self.pool.checkout() as conn:
+            self._crear_tablas(conn)
+
+    def _crear_tablas(self, conn):
         cursor = conn.cursor()
-        cursor.execute('PRAGMA journal_mode=WAL;')
 
         # Crear tablas si no existen
         cursor.execute('''
@@ -41,14 +177,16 @@ class DatabaseManager:
             FOREIGN KEY (usuario_id) REFERENCES Usuario(usuario_id)
         )''')
         
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS DosisProgramada (
-            dosis_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            recordatorio_id INTEGER,
-            hora_programada TEXT,
-            tomada BOOLEAN DEFAULT 0,
-            FOREIGN KEY (recordatorio_id) REFERENCES Recordatorio(recordatorio_id)
-        )''')
+        # Solo hace falta hasta la migración 3, que la sustituye por las reglas de Recordatorio
+        if conn.execute('PRAGMA user_version').fetchone()[0] < 3:
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS DosisProgramada (
+                dosis_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recordatorio_id INTEGER,
+                hora_programada TEXT,
+                tomada BOOLEAN DEFAULT 0,
+                FOREIGN KEY (recordatorio_id) REFERENCES Recordatorio(recordatorio_id)
+            )''')
 
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS CuentaBancaria (
@@ -63,17 +201,93 @@ class DatabaseManager:
             FOREIGN KEY (usuario_id) REFERENCES Usuario(usuario_id),
             UNIQUE(usuario_id, numero_tarjeta)
         )''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS CacheMedicamento (
+            clave TEXT PRIMARY KEY,
+            encontrado BOOLEAN NOT NULL,
+            campos TEXT,
+            texto_es TEXT,
+            caduca REAL NOT NULL
+        )''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS MemoriaTraduccion (
+            hash TEXT PRIMARY KEY,
+            origen TEXT NOT NULL,
+            traduccion TEXT NOT NULL
+        ) WITHOUT ROWID''')
         
         conn.commit()
-        conn.close()
+        self._migrar(conn)
+
+    def _migrar(self, conn):
+        """Aplica en orden las migraciones pendientes según PRAGMA user_version.
+
+        La versión se lee dentro de una transacción BEGIN IMMEDIATE: si varios
+        procesos abren a la vez una base de datos nueva, solo uno aplica cada
+        migración y los demás ven la versión ya actualizada.
+        """
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version >= len(MIGRACIONES):
+                conn.rollback()
+                return
+            numero, sentencias = version + 1, MIGRACIONES[version]
+            try:
+                for sentencia in sentencias:
+                    conn.execute(sentencia)
+                conn.execute(f'PRAGMA user_version = {numero}')
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise RuntimeError(f"Error al aplicar la migración {numero}: {str(e)}")
+
+    @contextmanager
+    def conexion(self):
+        """Presta una conexión del pool al hilo actual durante el bloque `with`.
+
+        Es reentrante: los métodos llamados dentro del bloque usan la misma
+        conexión, y con ella la misma transacción.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+        conn = self._local.conn = self.pool.acquire()
+        try:
+            yield conn
+        finally:
+            del self._local.conn
+            self.pool.release(conn)
+
+    def escribir(self, metodo, *args, **kwargs):
+        """Encola una escritura (p. ej. db.escribir(db.marcar_dosis_tomada, dosis_id)) y devuelve un Future.
+
+        Sin group commit la escritura se hace en el acto y el Future ya está resuelto.
+        """
+        if self.writer is None:
+            future = Future()
+            try:
+                future.set_result(metodo(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self.writer.submit(metodo, *args, **kwargs)
 
     @property
     def conn(self):
-        """Obtiene o crea una conexión para el hilo actual"""
-        if not hasattr(self._local, 'conn'):
-            self._local.conn = sqlite3.connect(self.db_name)
-            self._local.conn.row_factory = sqlite3.Row  # Para acceder a las columnas por nombre
-        return self._local.conn
+        """Conexión del hilo actual.
+
+        Fuera de `conexion()` (scripts y pruebas que usan db.conn directamente)
+        la conexión queda fijada al hilo hasta close() o hasta que el hilo termina.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self.pool.acquire()
+            self._local.liberar = weakref.finalize(current_thread(), self.pool.release, conn)
+        return conn
 
     @property
     def cursor(self):
@@ -81,117 +295,370 @@ class DatabaseManager:
         return self.conn.cursor()
 
     # CRUD para Usuarios
+    @_escritura
     def add_usuario(self, chat_id, nombre=None, telefono=None):
         cursor = self.conn.cursor()
-        # Verificar si el chat_id ya existe
-        cursor.execute('SELECT COUNT(*) FROM Usuario WHERE chat_id = ?', (chat_id,))
-        if cursor.fetchone()[0] > 0:
-            # Si ya existe, podrías devolver un mensaje o actualizarlo
-            return "Usuario ya registrado"
-    
-        # Si no existe, proceder a insertar el nuevo usuario
+        # Un único UPSERT: sin carrera entre la comprobación y el INSERT, y con el id en la misma consulta
         cursor.execute('''
-        INSERT INTO Usuario (chat_id, nombre, telefono) 
-        VALUES (?, ?, ?)
+        INSERT INTO Usuario (chat_id, nombre, telefono) VALUES (?, ?, ?)
+        ON CONFLICT(chat_id) DO UPDATE SET
+            nombre = COALESCE(Usuario.nombre, excluded.nombre),
+            telefono = COALESCE(Usuario.telefono, excluded.telefono)
+        RETURNING usuario_id
         ''', (chat_id, nombre, telefono))
+        usuario_id = cursor.fetchone()[0]
         self.conn.commit()
-        return cursor.lastrowid
+        return usuario_id
+
+    @_escritura
+    def add_usuarios(self, usuarios):
+        """Da de alta una lista de usuarios en una sola transacción (ver add_usuario)"""
+        try:
+            ids = self._upsert_usuarios(self.conn.cursor(), usuarios)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return [ids[str(u["chat_id"])] for u in usuarios]
 
+    def _upsert_usuarios(self, cursor, usuarios):
+        """UPSERT de varias filas por sentencia; devuelve {chat_id: usuario_id} sin confirmar"""
+        filas = self._filas_usuarios(usuarios)
+        ids = {}
+        for i in range(0, len(filas), USUARIOS_POR_UPSERT):
+            lote = filas[i:i + USUARIOS_POR_UPSERT]
+            cursor.execute(f'''
+            INSERT INTO Usuario (chat_id, nombre, telefono) VALUES {", ".join(["(?, ?, ?)"] * len(lote))}
+            ON CONFLICT(chat_id) DO UPDATE SET
+                nombre = COALESCE(Usuario.nombre, excluded.nombre),
+                telefono = COALESCE(Usuario.telefono, excluded.telefono)
+            RETURNING chat_id, usuario_id
+            ''', [valor for fila in lote for valor in fila])
+            ids.update((fila["chat_id"], fila["usuario_id"]) for fila in cursor.fetchall())
+        return ids
 
     # CRUD para Recordatorios
-    def add_recordatorio(self, chat_id, medicamento, dosis, frecuencia, hora_inicio, total_dosis):
+    @_escritura
+    def add_recordatorio(self, chat_id, medicamento, dosis, frecuencia, hora_inicio, total_dosis, token=None):
         """Versión simplificada que asume validación previa"""
-        usuario_id = self.get_usuario_id(chat_id)
         cursor = self.conn.cursor()
     
+        # El usuario_id se resuelve en el mismo INSERT, sin una lectura previa
         cursor.execute('''
         INSERT INTO Recordatorio (
             usuario_id, nombre_medicamento, dosis, frecuencia_horas,
-            hora_inicio, dosis_totales
-        ) VALUES (?, ?, ?, ?, ?, ?)
-        ''', (usuario_id, medicamento, dosis, frecuencia, hora_inicio, total_dosis))
+            hora_inicio, dosis_totales, token
+        ) VALUES ((SELECT usuario_id FROM Usuario WHERE chat_id = ?), ?, ?, ?, ?, ?, ?)
+        ''', (chat_id, medicamento, dosis, frecuencia, hora_inicio, total_dosis, token))
     
         recordatorio_id = cursor.lastrowid
         self.conn.commit()
         return recordatorio_id
 
-    def programar_dosis(self, recordatorio_id, hora_inicio, frecuencia, total_dosis):
+    @_escritura
+    def programar_dosis(self, recordatorio_id, hora_inicio, frecuencia, total_dosis, desde=None):
+        """Guarda la regla de las dosis del recordatorio: una sola fila, sea cual sea total_dosis"""
         cursor = self.conn.cursor()
     
         try:
-            # Validar que frecuencia sea un número
-            try:
-                frecuencia_num = int(frecuencia)
-            except (ValueError, TypeError):
-                raise ValueError("La frecuencia debe ser un número entero de horas")
-        
-            # Validar formato de hora
-            if not re.match(r"^([01]?[0-9]|2[0-3]):([0-5][0-9])$", str(hora_inicio)):
-                raise ValueError("Formato de hora inválido. Debe ser HH:MM")
-            
-            hora = datetime.strptime(str(hora_inicio), "%H:%M")
-        
-            for i in range(total_dosis):
-                hora_dosis = hora.strftime("%H:%M")
-                cursor.execute('''
-                INSERT INTO DosisProgramada (recordatorio_id, hora_programada)
-                VALUES (?, ?)
-                ''', (recordatorio_id, hora_dosis))
-                hora += timedelta(hours=frecuencia_num)  # Usar frecuencia_num que es integer
-            
+            minuto_inicio, primer_instante, intervalo = self._regla_dosis(hora_inicio, frecuencia, total_dosis, desde)
+            cursor.execute('DELETE FROM ExcepcionDosis WHERE recordatorio_id = ?', (recordatorio_id,))
+            cursor.execute('''
+            UPDATE Recordatorio SET
+                dosis_totales = ?, minuto_inicio = ?, primer_instante = ?, intervalo = ?,
+                siguiente_indice = 0, adelantadas = 0, siguiente_instante = ?
+            WHERE recordatorio_id = ?
+            ''', (total_dosis, minuto_inicio, primer_instante, intervalo,
+                  primer_instante if total_dosis else None, recordatorio_id))
             self.conn.commit()
         except Exception as e:
             self.conn.rollback()
             raise ValueError(f"Error al programar dosis: {str(e)}")
 
-    def delete_dosis(self, dosis_id):
+    @_escritura
+    def importar_tratamientos(self, tratamientos, desde=None):
+        """Crea en una sola transacción muchos recordatorios con la regla de sus dosis.
+
+        Cada tratamiento es un diccionario con chat_id, medicamento, dosis,
+        frecuencia, hora_inicio, total_dosis y opcionalmente nombre, telefono y
+        el token del bot.
+        Los usuarios que no existan se crean. Devuelve los recordatorio_id en
+        el mismo orden; si algún tratamiento es inválido no se importa ninguno.
+        Las dosis se fechan a partir de `desde` (por defecto, ahora).
+        """
         cursor = self.conn.cursor()
-        cursor.execute('DELETE FROM DosisProgramada WHERE dosis_id = ?', (dosis_id,))
-        self.conn.commit()
+        try:
+            usuarios = self._upsert_usuarios(cursor, tratamientos)
 
-    def marcar_dosis_tomada(self, recordatorio_id):
+            recordatorio_ids = []
+            for t in tratamientos:
+                minuto_inicio, primer_instante, intervalo = self._regla_dosis(
+                    t["hora_inicio"], t["frecuencia"], t["total_dosis"], desde)
+                cursor.execute('''
+                INSERT INTO Recordatorio (
+                    usuario_id, nombre_medicamento, dosis, frecuencia_horas, hora_inicio, dosis_totales,
+                    minuto_inicio, primer_instante, intervalo, siguiente_instante, token
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (usuarios[str(t["chat_id"])], t["medicamento"], t["dosis"], int(t["frecuencia"]),
+                      t["hora_inicio"], t["total_dosis"], minuto_inicio, primer_instante, intervalo,
+                      primer_instante if t["total_dosis"] else None, t.get("token")))
+                recordatorio_ids.append(cursor.lastrowid)
+            self.conn.commit()
+            return recordatorio_ids
+        except Exception as e:
+            self.conn.rollback()
+            raise ValueError(f"Error al importar tratamientos: {str(e)}")
+
+    @_escritura
+    def delete_dosis(self, dosis_id):
+        self._marcar_y_guardar(self.conn, [dosis_id], DOSIS_OMITIDA)
+
+    @_escritura
+    def marcar_dosis_tomada(self, dosis_id):
+        """Marca como enviada la dosis indicada; devuelve False si ya lo estaba o no existe"""
+        recordatorio_id, indice = separar_dosis_id(dosis_id)
         cursor = self.conn.cursor()
-        # Obtener la siguiente dosis para este recordatorio
+        # Lo habitual es marcar la dosis del cursor: basta un UPDATE por clave primaria que lo avance
         cursor.execute('''
-        SELECT dosis_id FROM DosisProgramada WHERE recordatorio_id = ? AND tomada = 0 LIMIT 1
-        ''', (recordatorio_id,))
-        dosis = cursor.fetchone()
-
-        if dosis:
-            dosis_id = dosis["dosis_id"]
-            cursor.execute('''
-            UPDATE DosisProgramada SET tomada = 1 WHERE dosis_id = ?
-            ''', (dosis_id,))
+        UPDATE Recordatorio SET
+            siguiente_indice = siguiente_indice + 1,
+            siguiente_instante = CASE WHEN siguiente_indice + 1 < dosis_totales
+                                      THEN primer_instante + (siguiente_indice + 1) * intervalo END
+        WHERE recordatorio_id = ? AND siguiente_indice = ? AND adelantadas = 0
+          AND intervalo IS NOT NULL AND siguiente_indice < dosis_totales
+        RETURNING recordatorio_id
+        ''', (recordatorio_id, indice))
+        if cursor.fetchall():
             self.conn.commit()
             return True
-        else:
-            return False
+        # Fuera de orden: se anota como excepción (o no estaba pendiente)
+        return bool(self._marcar_y_guardar(self.conn, [dosis_id], DOSIS_ENVIADA))
 
+    @_escritura
+    def marcar_dosis_tomadas(self, dosis_ids):
+        """Marca como enviadas muchas dosis en una sola transacción; devuelve las que estaban pendientes"""
+        return self._marcar_y_guardar(self.conn, dosis_ids, DOSIS_ENVIADA)
 
+    def _marcar_y_guardar(self, conn, dosis_ids, estado):
+        # BEGIN IMMEDIATE: la regla se lee y se reescribe sin que otro proceso la cambie entre medias
+        # (dentro del escritor agrupado ya hay una transacción abierta)
+        if not conn.in_transaction:
+            conn.execute('BEGIN IMMEDIATE')
+        try:
+            dosis_ids = [int(dosis_id) for dosis_id in dosis_ids]
+            filas, reglas = self._reglas(conn, f'''
+            SELECT {COLUMNAS_REGLA} FROM Recordatorio r
+            WHERE r.recordatorio_id IN (SELECT value FROM json_each(?)) AND r.intervalo IS NOT NULL
+            ''', (json.dumps(list(self._agrupar_dosis(dosis_ids))),))
+            marcadas = self._marcar_reglas(reglas, dosis_ids, estado)
+            self._guardar_reglas(conn, reglas)
+            conn.commit()
+            return marcadas
+        except Exception:
+            conn.rollback()
+            raise
+
+    @staticmethod
+    def _reglas(conn, consulta, params=()):
+        """Ejecuta una consulta que devuelve COLUMNAS_REGLA (y otras) y carga las reglas con sus excepciones.
+
+        Devuelve (filas, reglas) en el mismo orden. Las excepciones solo se
+        leen de los recordatorios que tienen alguna por delante del cursor.
+        """
+        filas = conn.execute(consulta, params).fetchall()
+        excepciones = {}
+        con_excepciones = [fila["recordatorio_id"] for fila in filas if fila["adelantadas"]]
+        if con_excepciones:
+            for recordatorio_id, indice, estado in conn.execute('''
+            SELECT e.recordatorio_id, e.indice, e.estado
+            FROM ExcepcionDosis e JOIN Recordatorio r ON r.recordatorio_id = e.recordatorio_id
+            WHERE e.recordatorio_id IN (SELECT value FROM json_each(?)) AND e.indice >= r.siguiente_indice
+            ''', (json.dumps(con_excepciones),)):
+                excepciones.setdefault(recordatorio_id, {})[indice] = estado
+        return filas, [ReglaDosis.desde_fila(fila, excepciones.get(fila["recordatorio_id"])) for fila in filas]
+
+    @staticmethod
+    def _guardar_reglas(conn, reglas):
+        """Escribe el cursor y las excepciones de las reglas que `marcar` cambió, sin confirmar"""
+        reglas = [regla for regla in reglas if regla.modificada]
+        conn.executemany('''
+        UPDATE Recordatorio SET siguiente_indice = ?, siguiente_instante = ?, adelantadas = ?
+        WHERE recordatorio_id = ?
+        ''', [(regla.cursor, regla.siguiente_instante, len(regla.excepciones), regla.recordatorio_id)
+              for regla in reglas])
+        conn.executemany('INSERT OR REPLACE INTO ExcepcionDosis (recordatorio_id, indice, estado) VALUES (?, ?, ?)',
+                         [(regla.recordatorio_id, indice, estado) for regla in reglas for indice, estado in regla.nuevas])
+        conn.executemany('DELETE FROM ExcepcionDosis WHERE recordatorio_id = ? AND indice = ?',
+                         [(regla.recordatorio_id, indice) for regla in reglas for indice in regla.borradas])
+
+    @con_conexion
     def get_dosis_restantes(self, recordatorio_id):
         cursor = self.conn.cursor()
-        cursor.execute('''
-        SELECT COUNT(*) 
-        FROM DosisProgramada 
-        WHERE recordatorio_id = ? AND tomada = 0
-        ''', (recordatorio_id,))
+        cursor.execute(f'SELECT {DOSIS_RESTANTES} FROM Recordatorio r WHERE r.recordatorio_id = ?', (recordatorio_id,))
         result = cursor.fetchone()
         return result[0] if result else 0
 
+    @con_conexion
     def get_siguiente_dosis(self, recordatorio_id):
         cursor = self.conn.cursor()
-        cursor.execute('''
-        SELECT hora_programada 
-        FROM DosisProgramada 
-        WHERE recordatorio_id = ? AND tomada = 0
-        ORDER BY hora_programada 
-        LIMIT 1
-        ''', (recordatorio_id,))
+        cursor.execute(f'SELECT {PROXIMA_HORA} FROM Recordatorio r WHERE r.recordatorio_id = ?', (recordatorio_id,))
         result = cursor.fetchone()
         return result[0] if result else None
 
+    @con_conexion
+    def get_dosis_pendientes(self, recordatorio_id=None, despues_de=None):
+        """Dosis sin enviar de recordatorios activos, en orden de programación.
+
+        Con `despues_de` (epoch) se excluyen las que vencieron antes de ese
+        instante; las dosis sin instante (anteriores a la migración 2) se incluyen siempre.
+        """
+        query = f'''
+        SELECT {COLUMNAS_REGLA} FROM Recordatorio r
+        WHERE {HAY_PENDIENTES} AND r.activo = 1
+        '''
+        params = ()
+        if recordatorio_id is not None:
+            query += ' AND r.recordatorio_id = ?'
+            params += (recordatorio_id,)
+        query += ' ORDER BY r.recordatorio_id'
+        _, reglas = self._reglas(self.conn, query, params)
+        return [FilaDosis((regla.dosis_id(i), regla.recordatorio_id, regla.hora(i), regla.instante(i)))
+                for regla in reglas for i in regla.pendientes_despues_de(despues_de)]
+
+    @con_conexion
+    def get_dosis_vencidas(self, hasta):
+        """Dosis pendientes de recordatorios activos con instante <= `hasta` (epoch)"""
+        _, reglas = self._reglas(self.conn, f'''
+        SELECT {COLUMNAS_REGLA} FROM Recordatorio r
+        WHERE r.siguiente_instante <= ? AND r.activo = 1
+        ''', (hasta,))
+        return [FilaVencida((dosis_id, reglas[posicion].recordatorio_id, instante))
+                for instante, dosis_id, _, posicion in self._dosis_vencidas(reglas, hasta)]
+
+    @_escritura
+    def omitir_dosis_vencidas(self, hasta, conservar_ultima=False):
+        """Marca como omitidas las dosis pendientes con instante <= `hasta`.
+
+        Con `conservar_ultima` se deja pendiente la más reciente de cada
+        recordatorio. Devuelve el número de dosis omitidas.
+        """
+        conn = self.conn
+        if not conn.in_transaction:
+            conn.execute('BEGIN IMMEDIATE')
+        try:
+            _, reglas = self._reglas(conn, f'''
+            SELECT {COLUMNAS_REGLA} FROM Recordatorio r WHERE r.siguiente_instante <= ?
+            ''', (hasta,))
+            omitidas = 0
+            for regla in reglas:
+                indices = list(regla.vencidas(hasta))
+                if conservar_ultima:
+                    indices = indices[:-1]
+                omitidas += len(regla.marcar(indices, DOSIS_OMITIDA))
+            self._guardar_reglas(conn, reglas)
+            conn.commit()
+            return omitidas
+        except Exception:
+            conn.rollback()
+            raise
+
+    @_escritura
+    def reclamar_dosis_vencidas(self, hasta, limite=5000, sin_token=True):
+        """Marca como enviadas, en una sola transacción, hasta `limite` dosis vencidas.
 
+        Devuelve las filas con lo necesario para el recordatorio (chat_id,
+        medicamento, dosis, dosis restantes tras esta, hora de la siguiente y
+        token del bot). Con sin_token=False las de recordatorios sin token se
+        quedan pendientes: no hay con qué enviarlas.
+        Basta leer los `limite` recordatorios cuya siguiente dosis vence antes:
+        sus dosis vencidas se generan en orden y se toman las primeras.
+        BEGIN IMMEDIATE reserva la escritura antes de leer, así que dos
+        procesos que barren a la vez nunca reclaman la misma dosis. Con group
+        commit la reclamación es una escritura más del escritor agrupado (ya
+        dentro de su transacción) y las filas se devuelven tras el commit.
+        """
+        conn = self.conn
+        try:
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+            filas, reglas = self._reglas(conn, f'''
+            SELECT {COLUMNAS_REGLA}, u.chat_id, r.nombre_medicamento, r.dosis, r.token
+            FROM Recordatorio r
+            JOIN Usuario u ON r.usuario_id = u.usuario_id
+            WHERE r.siguiente_instante <= ? AND r.activo = 1 {'' if sin_token else 'AND r.token IS NOT NULL'}
+            ORDER BY r.siguiente_instante, r.recordatorio_id
+            LIMIT ?
+            ''', (hasta, limite))
+            dosis = list(itertools.islice(self._dosis_vencidas(reglas, hasta), limite))
+            reclamadas = self._filas_reclamadas(filas, reglas, dosis)
+            self._marcar_reglas(reglas, [fila["dosis_id"] for fila in reclamadas], DOSIS_ENVIADA)
+            self._guardar_reglas(conn, reglas)
+            conn.commit()
+            return reclamadas
+        except Exception:
+            conn.rollback()
+            raise
+
+    @con_conexion
+    def get_siguiente_instante(self, despues_de):
+        """Instante (epoch) de la primera dosis pendiente posterior a `despues_de`, o None.
+
+        Solo mira la dosis del cursor de cada recordatorio: las que ya vencieron
+        las reclama el barredor antes de preguntar por la siguiente.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        SELECT MIN(siguiente_instante) FROM Recordatorio WHERE siguiente_instante > ?
+        ''', (despues_de,))
+        return cursor.fetchone()[0]
+
+    @con_conexion
+    def get_dosis_sin_instante(self):
+        """Siguiente dosis de los recordatorios creados antes de la migración 2, que solo tienen "HH:MM\""""
+        _, reglas = self._reglas(self.conn, f'''
+        SELECT {COLUMNAS_REGLA} FROM Recordatorio r
+        WHERE {HAY_PENDIENTES} AND r.primer_instante IS NULL
+        ORDER BY r.recordatorio_id
+        ''')
+        return [FilaDosis((regla.dosis_id(regla.cursor), regla.recordatorio_id, regla.hora(regla.cursor), None))
+                for regla in reglas]
 
+    @_escritura
+    def guardar_instantes(self, instantes):
+        """Fija el instante de dosis concretas a partir de pares (instante, dosis_id).
+
+        Las dosis de un recordatorio están a intervalos fijos: fechar una
+        desplaza igual todas las demás.
+        """
+        cursor = self.conn.cursor()
+        cursor.executemany('''
+        UPDATE Recordatorio SET
+            primer_instante = :instante - :indice * intervalo,
+            siguiente_instante = CASE WHEN siguiente_indice < dosis_totales
+                                      THEN :instante + (siguiente_indice - :indice) * intervalo END
+        WHERE recordatorio_id = :recordatorio_id AND intervalo IS NOT NULL
+        ''', [dict(zip(("recordatorio_id", "indice"), separar_dosis_id(dosis_id)), instante=int(instante))
+              for instante, dosis_id in instantes])
+        self.conn.commit()
+
+    @con_conexion
+    def get_datos_dosis(self, dosis_id):
+        """Datos necesarios para enviar el recordatorio de una dosis concreta"""
+        recordatorio_id, indice = separar_dosis_id(dosis_id)
+        filas, reglas = self._reglas(self.conn, f'''
+        SELECT {COLUMNAS_REGLA}, u.chat_id, r.nombre_medicamento, r.dosis
+        FROM Recordatorio r
+        JOIN Usuario u ON r.usuario_id = u.usuario_id
+        WHERE r.recordatorio_id = ? AND r.activo = 1 AND r.intervalo IS NOT NULL
+        ''', (recordatorio_id,))
+        if not reglas or not reglas[0].pendiente(indice):
+            return None
+        fila, regla = filas[0], reglas[0]
+        siguiente = regla.siguiente(indice)
+        return FilaDatosDosis((fila["chat_id"], recordatorio_id, fila["nombre_medicamento"], fila["dosis"],
+                               regla.restantes - 1, regla.hora(siguiente) if siguiente is not None else None))
+
+    @con_conexion
     def get_recordatorios_activos(self, chat_id):
         cursor = self.conn.cursor()
         cursor.execute('''
@@ -203,54 +670,102 @@ class DatabaseManager:
         ''', (chat_id,))
         return cursor.fetchall()
 
+    @con_conexion
+    def get_resumen_recordatorios(self, chat_id):
+        """Recordatorios activos con sus dosis restantes y la próxima dosis en una sola consulta"""
+        cursor = self.conn.cursor()
+        # Las dosis restantes y la próxima salen de la regla de cada recordatorio, sin leer sus dosis
+        cursor.execute(f'''
+        SELECT r.recordatorio_id, r.nombre_medicamento, r.dosis,
+               r.frecuencia_horas, r.hora_inicio, r.dosis_totales,
+               {DOSIS_RESTANTES} AS dosis_restantes,
+               {SIGUIENTE_DOSIS_ID} AS siguiente_dosis_id,
+               {PROXIMA_HORA} AS proxima_dosis
+        FROM Recordatorio r
+        JOIN Usuario u ON r.usuario_id = u.usuario_id
+        WHERE u.chat_id = ? AND r.activo = 1
+        ORDER BY r.recordatorio_id
+        ''', (chat_id,))
+        return cursor.fetchall()
+
+    @_escritura
     def delete_recordatorio(self, recordatorio_id):
         cursor = self.conn.cursor()
-        cursor.execute('DELETE FROM DosisProgramada WHERE recordatorio_id = ?', (recordatorio_id,))
+        cursor.execute('DELETE FROM ExcepcionDosis WHERE recordatorio_id = ?', (recordatorio_id,))
         cursor.execute('DELETE FROM Recordatorio WHERE recordatorio_id = ?', (recordatorio_id,))
         self.conn.commit()
 
     def close(self):
-        if hasattr(self._local, 'conn'):
-            self._local.conn.close()
-            del self._local.conn
+        """Termina las escrituras pendientes, devuelve la conexión fijada al hilo actual y cierra las conexiones libres del pool"""
+        if self.writer is not None:
+            self.writer.stop()
+        liberar = getattr(self._local, 'liberar', None)
+        if liberar is not None:
+            del self._local.conn, self._local.liberar
+            liberar()
+        self.pool.close()
 
     # Helper methods
+    @con_conexion
     def get_usuario_id(self, chat_id):
         cursor = self.conn.cursor()
         cursor.execute('SELECT usuario_id FROM Usuario WHERE chat_id = ?', (chat_id,))
         result = cursor.fetchone()
         return result[0] if result else None
 
+    @_escritura
     def marcar_como_premium(self, chat_id):
         """Marca a un usuario como premium"""
         self.cursor.execute('''UPDATE Usuario SET es_premium = 1 WHERE chat_id = ?''', (chat_id,))
         self.conn.commit()
 
+    # Caché de consultas a OpenFDA
+    @con_conexion
+    def get_cache_medicamento(self, clave):
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        SELECT encontrado, campos, texto_es, caduca FROM CacheMedicamento WHERE clave = ?
+        ''', (clave,))
+        return cursor.fetchone()
+
+    @_escritura
+    def guardar_cache_medicamento(self, clave, encontrado, campos, texto_es, caduca):
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        INSERT OR REPLACE INTO CacheMedicamento (clave, encontrado, campos, texto_es, caduca)
+        VALUES (?, ?, ?, ?, ?)
+        ''', (clave, encontrado, campos, texto_es, caduca))
+        self.conn.commit()
+
+    # Memoria de traducción: segmentos ya traducidos, por hash del texto original
+    @con_conexion
+    def get_traducciones(self, hashes):
+        traducciones = {}
+        hashes = list(hashes)
+        for i in range(0, len(hashes), HASHES_POR_CONSULTA):
+            lote = hashes[i:i + HASHES_POR_CONSULTA]
+            cursor = self.conn.execute(f'''
+            SELECT hash, traduccion FROM MemoriaTraduccion WHERE hash IN ({", ".join("?" * len(lote))})
+            ''', lote)
+            traducciones.update(cursor.fetchall())
+        return traducciones
+
+    @_escritura
+    def guardar_traducciones(self, filas):
+        self.conn.executemany('''
+        INSERT OR REPLACE INTO MemoriaTraduccion (hash, origen, traduccion) VALUES (?, ?, ?)
+        ''', filas)
+        self.conn.commit()
+
     # Métodos para Cuentas Bancarias
+    @_escritura
     def agregar_cuenta_bancaria(self, chat_id, numero_tarjeta, titular, fecha_vencimiento, cvv):
         """Añade una nueva cuenta bancaria para un usuario"""
         cursor = self.conn.cursor()
         usuario_id = self.get_usuario_id(chat_id)
         try:
-            # Primero validamos los datos básicos
-            if not all([numero_tarjeta, titular, fecha_vencimiento, cvv]):
-                raise ValueError("Todos los campos son obligatorios")
-        
-            # Validar formato de fecha (MM/YY)
-            if not re.match(r'^(0[1-9]|1[0-2])\/?([0-9]{2})$', fecha_vencimiento):
-                raise ValueError("Formato de fecha inválido. Use MM/AA")
-        
-            # Validar CVV (3 o 4 dígitos)
-            if not re.match(r'^[0-9]{3,4}$', cvv):
-                raise ValueError("CVV debe tener 3 o 4 dígitos")
-        
-            # Limpiar número de tarjeta (eliminar espacios)
-            numero_tarjeta_limpio = numero_tarjeta.replace(" ", "")
-        
-            # Validar número de tarjeta (solo dígitos, longitud válida)
-            if not numero_tarjeta_limpio.isdigit() or len(numero_tarjeta_limpio) not in (15, 16):
-                raise ValueError("Número de tarjeta inválido")
-        
+            numero_tarjeta_limpio = self._validar_cuenta(numero_tarjeta, titular, fecha_vencimiento, cvv)
+
             cursor.execute('''
             INSERT INTO CuentaBancaria 
             (usuario_id, numero_tarjeta, titular, fecha_vencimiento, cvv)
@@ -267,6 +782,7 @@ class DatabaseManager:
             self.conn.rollback()
             raise ValueError(f"Error al agregar cuenta bancaria: {str(e)}")
 
+    @con_conexion
     def obtener_cuentas_activas(self, usuario_id):
         """Obtiene todas las cuentas bancarias activas de un usuario"""
         cursor = self.conn.cursor()
@@ -279,6 +795,7 @@ class DatabaseManager:
     
         return cursor.fetchall()
 
+    @_escritura
     def desactivar_cuenta(self, cuenta_id, usuario_id=None):
         """Desactiva una cuenta bancaria (borrado lógico)"""
         cursor = self.conn.cursor()
@@ -308,6 +825,7 @@ class DatabaseManager:
             self.conn.rollback()
             raise ValueError(f"Error al desactivar cuenta: {str(e)}")
 
+    @con_conexion
     def obtener_ultima_cuenta_activa(self, usuario_id):
         """Obtiene la última cuenta activa de un usuario"""
         cursor = self.conn.cursor()
@@ -323,6 +841,7 @@ class DatabaseManager:
     
         return cursor.fetchone()
         
+    @con_conexion
     def es_usuario_premium(self, chat_id):
         """Verifica si un usuario tiene suscripción premium"""
         cursor = self.conn.cursor()
@@ -332,3 +851,16 @@ class DatabaseManager:
         )
         result = cursor.fetchone()
         return result is not None and result['es_premium'] == 1
+
+    @con_conexion
+    def get_datos_usuario(self, chat_id):
+        """usuario_id, es_premium y número de recordatorios activos en una sola consulta"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        SELECT u.usuario_id, u.es_premium,
+               (SELECT COUNT(*) FROM Recordatorio r
+                WHERE r.usuario_id = u.usuario_id AND r.activo = 1) AS recordatorios_activos
+        FROM Usuario u
+        WHERE u.chat_id = ?
+        ''', (chat_id,))
+        return cursor.fetchone()
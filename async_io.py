@@ -0,0 +1,186 @@
+import asyncio
+import threading
+import time
+
+import httpcore
+import httpx
+
+from telegram_client import CHAT_INTERVAL, GLOBAL_RATE, ClienteTelegramBase
+
+# httpx se fija a 0.13.3 en tests/requirements.txt: PoolLimits y pool_limits solo existen en esa versión.
+# httpx 0.13 deja pasar las excepciones de red de httpcore sin envolverlas
+ERRORES_RED = (httpx.HTTPError, httpcore.NetworkError, httpcore.TimeoutException,
+               httpcore.ProtocolError, httpcore.ProxyError, OSError)
+
+
+def crear_cliente_http(max_conexiones=100, timeout=10):
+    """Cliente httpx asíncrono con conexiones persistentes"""
+    limites = httpx.PoolLimits(max_keepalive=max_conexiones, max_connections=max_conexiones)
+    return httpx.AsyncClient(pool_limits=limites, timeout=timeout)
+
+
+class EventLoopThread:
+    """Bucle de asyncio en un hilo propio.
+
+    El código síncrono (rutas de Flask, hilos del despachador y del
+    planificador) ejecuta corrutinas en él con `run`, de modo que todas las
+    peticiones salientes del proceso se multiplexan en un solo hilo en lugar
+    de ocupar un hilo por petición en curso. El hilo arranca al primer uso.
+    """
+
+    def __init__(self, name="async-io"):
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        self.start()
+        return self._loop
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            if self._thread is None:
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = self._thread = None
+
+    def submit(self, coro):
+        """Programa la corrutina en el bucle y devuelve un concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Ejecuta la corrutina en el bucle y espera su resultado"""
+        if threading.current_thread() is self._thread:
+            # Esperar aquí bloquearía el propio bucle: desde corrutinas se usa await
+            coro.close()
+            raise RuntimeError("EventLoopThread.run() no puede llamarse desde su propio bucle")
+        return self.submit(coro).result(timeout)
+
+    def call_soon(self, callback, *args):
+        self.loop.call_soon_threadsafe(callback, *args)
+
+
+class AsyncTelegramClient(ClienteTelegramBase):
+    """Cliente de Telegram sobre asyncio con la misma interfaz que TelegramClient.
+
+    `send`, `enqueue` y `enqueue_many` sirven desde código síncrono y
+    `send_async` desde corrutinas que corren en el bucle `loop`. La cola la
+    vacían `max_concurrentes` tareas del bucle, no hilos, con los mismos
+    límites de Telegram y la misma política de reintentos.
+    """
+
+    def __init__(self, base_url="https://api.telegram.org", loop=None, max_concurrentes=100,
+                 global_rate=GLOBAL_RATE, chat_interval=CHAT_INTERVAL, max_retries=5, timeout=10):
+        super().__init__(base_url, global_rate, chat_interval, max_retries, timeout)
+        self.loop = loop or EventLoopThread("telegram-async")
+        self.max_concurrentes = max_concurrentes
+        self.http = crear_cliente_http(max_concurrentes, timeout)
+
+        # La cola y las tareas se crean dentro del bucle al encolar el primer mensaje
+        self._cola = None
+        self._tareas = []
+        self._vacia = threading.Condition(self._lock)
+        self._pendientes = 0
+
+    # API síncrona
+    def send(self, token, chat_id, text, reply_markup=None, parse_mode="Markdown", max_retries=2):
+        """Envía un mensaje y devuelve True si Telegram lo aceptó"""
+        return self.loop.run(self.send_async(token, chat_id, text, reply_markup, parse_mode, max_retries))
+
+    def enqueue(self, token, chat_id, text, reply_markup=None, parse_mode="Markdown"):
+        """Encola un mensaje para enviarlo en segundo plano"""
+        self._encolar([(token, chat_id, text, reply_markup, parse_mode)])
+
+    def enqueue_many(self, mensajes):
+        """Encola una lista de tuplas (token, chat_id, text)"""
+        self._encolar([(token, chat_id, text, None, "Markdown") for token, chat_id, text in mensajes])
+
+    def join(self):
+        """Espera a que la cola de envíos se vacíe"""
+        with self._vacia:
+            while self._pendientes:
+                self._vacia.wait()
+
+    def stop(self):
+        self.loop.run(self._detener())
+
+    # API asíncrona
+    async def send_async(self, token, chat_id, text, reply_markup=None, parse_mode="Markdown", max_retries=2):
+        # Las respuestas interactivas solo respetan el límite global
+        espera = self.limiter.reservar()
+        if espera > 0:
+            await asyncio.sleep(espera)
+        payload = self._payload(chat_id, text, reply_markup, parse_mode)
+        return await self._post(token, "sendMessage", payload, max_retries)
+
+    # Internos
+    def _pendientes_en_cola(self):
+        with self._lock:
+            return self._pendientes
+
+    def _encolar(self, items):
+        if not items:
+            return
+        with self._lock:
+            self._pendientes += len(items)
+        self.loop.call_soon(self._poner, items)
+
+    def _poner(self, items):
+        if self._cola is None:
+            self._cola = asyncio.Queue()
+            self._tareas = [asyncio.ensure_future(self._consumidor()) for _ in range(self.max_concurrentes)]
+        for item in items:
+            self._cola.put_nowait(item)
+
+    async def _consumidor(self):
+        while True:
+            token, chat_id, text, reply_markup, parse_mode = await self._cola.get()
+            try:
+                espera = self.limiter.reservar(chat_id)
+                if espera > 0:
+                    await asyncio.sleep(espera)
+                payload = self._payload(chat_id, text, reply_markup, parse_mode)
+                if not await self._post(token, "sendMessage", payload, self.max_retries):
+                    self._avisar_fallo(chat_id)
+            except Exception as e:
+                self._avisar_fallo(chat_id, e)
+            finally:
+                with self._vacia:
+                    self._pendientes -= 1
+                    if not self._pendientes:
+                        self._vacia.notify_all()
+
+    async def _detener(self):
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._cola = None
+        self._tareas = []
+        await self.http.aclose()
+        # Un cliente nuevo por si se vuelve a usar tras stop()
+        self.http = crear_cliente_http(self.max_concurrentes, self.timeout)
+
+    async def _post(self, token, method, payload, max_retries):
+        url = self._url(token, method)
+        for intento in range(max_retries + 1):
+            inicio = time.monotonic()
+            try:
+                response = await self.http.post(url, data=payload)
+            except ERRORES_RED:
+                response = None
+            resultado, espera = self._procesar_respuesta(response, inicio, intento, max_retries)
+            if resultado is not None:
+                return resultado
+            await asyncio.sleep(espera)
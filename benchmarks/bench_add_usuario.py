@@ -0,0 +1,93 @@
+"""Benchmark: altas de usuario por segundo.
+
+Compara la versión anterior de add_usuario (SELECT COUNT(*) y luego INSERT),
+la actual (un INSERT ... ON CONFLICT DO UPDATE ... RETURNING) y add_usuarios
+con lotes de --lote usuarios. Cada variante da de alta --usuarios chats nuevos
+y después repite las mismas altas (usuarios ya registrados, el caso de cada
+mensaje de un chat que el proceso no conoce). Con --hilos > 1 las altas
+individuales se reparten entre hilos que comparten la base de datos.
+
+Con un chat ya registrado el UPSERT toma el bloqueo de escritura y confirma,
+mientras que la comprobación anterior solo leía; en el webhook esas llamadas
+no llegan a la base de datos porque UserCache ya conoce al usuario.
+
+    python benchmarks/bench_add_usuario.py --usuarios 20000 --hilos 8
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from BBDD import DatabaseManager
+
+
+def add_usuario_anterior(db, chat_id, nombre=None, telefono=None):
+    """Implementación anterior: comprobación e INSERT en dos sentencias"""
+    with db.conexion():
+        cursor = db.conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM Usuario WHERE chat_id = ?', (chat_id,))
+        if cursor.fetchone()[0] > 0:
+            return "Usuario ya registrado"
+        try:
+            cursor.execute('INSERT INTO Usuario (chat_id, nombre, telefono) VALUES (?, ?, ?)', (chat_id, nombre, telefono))
+        except sqlite3.IntegrityError:
+            db.conn.rollback()
+            return "Usuario ya registrado"
+        db.conn.commit()
+        return cursor.lastrowid
+
+
+def en_hilos(hilos, chats, funcion):
+    errores = []
+
+    def trabajador(parte):
+        try:
+            for chat_id in parte:
+                funcion(chat_id)
+        except Exception as e:
+            errores.append(e)
+
+    trabajadores = [threading.Thread(target=trabajador, args=(chats[i::hilos],)) for i in range(hilos)]
+    for t in trabajadores:
+        t.start()
+    for t in trabajadores:
+        t.join()
+    return errores
+
+
+def medir(nombre, usuarios, funcion):
+    chats = [str(i) for i in range(usuarios)]
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, "bench.db"))
+        tiempos = []
+        errores = []
+        for _ in range(2):  # chats nuevos y después ya registrados
+            inicio = time.perf_counter()
+            errores += funcion(db, chats) or []
+            tiempos.append(time.perf_counter() - inicio)
+        total = db.conn.execute("SELECT COUNT(*) FROM Usuario").fetchone()[0]
+        db.close()
+    assert total == usuarios, total
+    print(f"{nombre:42s} nuevos {usuarios / tiempos[0]:9.0f}/s   registrados {usuarios / tiempos[1]:9.0f}/s"
+          f"   errores={len(errores)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--usuarios", type=int, default=20000)
+    parser.add_argument("--hilos", type=int, default=1)
+    parser.add_argument("--lote", type=int, default=1000)
+    args = parser.parse_args()
+
+    medir("SELECT COUNT + INSERT (anterior)", args.usuarios,
+          lambda db, chats: en_hilos(args.hilos, chats, lambda c: add_usuario_anterior(db, c, "Ana")))
+    medir("add_usuario (UPSERT ... RETURNING)", args.usuarios,
+          lambda db, chats: en_hilos(args.hilos, chats, lambda c: db.add_usuario(c, "Ana")))
+    medir(f"add_usuarios (lotes de {args.lote})", args.usuarios,
+          lambda db, chats: [db.add_usuarios([{"chat_id": c, "nombre": "Ana"} for c in chats[i:i + args.lote]])
+                             for i in range(0, len(chats), args.lote)] and None)
@@ -0,0 +1,104 @@
+"""Benchmark: envíos a Telegram y consultas a OpenFDA con hilos frente a asyncio.
+
+Usa un servidor local que imita Telegram y OpenFDA con --latencia segundos por
+petición (como el RTT real de la API). La versión con hilos necesita un hilo
+por petición en curso; la asíncrona mantiene --concurrencia peticiones en
+curso desde un único hilo de E/S.
+
+    python benchmarks/bench_async_io.py --mensajes 5000 --concurrencia 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from async_io import AsyncTelegramClient, EventLoopThread, crear_cliente_http
+from telegram_client import TelegramClient
+from stubs import StubServer
+
+
+def informe(nombre, peticiones, duracion, extra=""):
+    print(f"[{nombre}] {peticiones / duracion:8.0f} pet/s en {duracion:.2f}s{extra}")
+
+
+def bench_telegram_hilos(stub, mensajes, workers):
+    cliente = TelegramClient(stub.url, workers=workers, global_rate=0, chat_interval=0)
+    inicio = time.perf_counter()
+    cliente.enqueue_many(("TOKEN", i, "hola") for i in range(mensajes))
+    cliente.join()
+    duracion = time.perf_counter() - inicio
+    cliente.stop()
+    informe(f"Telegram, TelegramClient x{workers} hilos", mensajes, duracion,
+            f", fallidos={cliente.stats()['fallidos']}")
+
+
+def bench_telegram_async(stub, mensajes, concurrencia):
+    loop = EventLoopThread()
+    cliente = AsyncTelegramClient(stub.url, loop=loop, max_concurrentes=concurrencia, global_rate=0, chat_interval=0)
+    inicio = time.perf_counter()
+    cliente.enqueue_many(("TOKEN", i, "hola") for i in range(mensajes))
+    cliente.join()
+    duracion = time.perf_counter() - inicio
+    cliente.stop()
+    loop.stop()
+    informe(f"Telegram, AsyncTelegramClient x{concurrencia} tareas", mensajes, duracion,
+            f", fallidos={cliente.stats()['fallidos']}")
+
+
+def bench_fda_hilos(stub, consultas, workers):
+    sesion = requests.Session()
+    sesion.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=workers))
+    url = f"{stub.url}/drug/label.json?search=openfda.substance_name:ibuprofeno&limit=1"
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        futuros = [pool.submit(sesion.get, url) for _ in range(consultas)]
+        ok = sum(f.result().status_code == 200 for f in futuros)
+    informe(f"OpenFDA, requests x{workers} hilos", consultas, time.perf_counter() - inicio, f", ok={ok}")
+
+
+def bench_fda_async(stub, consultas, concurrencia):
+    url = f"{stub.url}/drug/label.json?search=openfda.substance_name:ibuprofeno&limit=1"
+
+    async def consultar_todas():
+        http = crear_cliente_http(concurrencia)
+        limite = asyncio.Semaphore(concurrencia)
+
+        async def consultar():
+            async with limite:
+                return (await http.get(url)).status_code
+
+        try:
+            return await asyncio.gather(*(consultar() for _ in range(consultas)))
+        finally:
+            await http.aclose()
+
+    loop = EventLoopThread()
+    inicio = time.perf_counter()
+    futuro = loop.submit(consultar_todas())
+    ok = sum(status == 200 for status in futuro.result())
+    informe(f"OpenFDA, httpx x{concurrencia} tareas", consultas, time.perf_counter() - inicio, f", ok={ok}")
+    loop.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mensajes", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=8, help="hilos de la versión con hilos")
+    parser.add_argument("--concurrencia", type=int, default=200, help="peticiones en curso de la versión asíncrona")
+    parser.add_argument("--latencia", type=float, default=0.05, help="latencia simulada del servidor (s)")
+    args = parser.parse_args()
+
+    with StubServer(args.latencia) as stub:
+        # La versión con hilos se mide también con tantos hilos como peticiones en curso tiene la asíncrona
+        for workers in (args.workers, args.concurrencia):
+            bench_telegram_hilos(stub, args.mensajes, workers)
+        bench_telegram_async(stub, args.mensajes, args.concurrencia)
+        for workers in (args.workers, args.concurrencia):
+            bench_fda_hilos(stub, args.mensajes, workers)
+        bench_fda_async(stub, args.mensajes, args.concurrencia)
@@ -0,0 +1,79 @@
+"""Benchmark: escrituras por segundo con un commit por escritura frente a group commit.
+
+--hilos hilos escriben a la vez (altas de usuario y dosis marcadas como
+enviadas). Sin group commit cada escritura es una transacción que compite por
+el único bloqueo de escritura de SQLite; con group commit un único hilo
+escritor las confirma por lotes. Con --synchronous FULL cada commit hace
+fsync, como en un despliegue que no acepta perder las últimas escrituras.
+
+    python benchmarks/bench_group_commit.py --hilos 50 --escrituras 200 --synchronous FULL
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from BBDD import DatabaseManager
+from db_pool import PRAGMAS
+
+
+def medir(nombre, ruta, hilos, escrituras, group_commit, synchronous):
+    db = DatabaseManager(ruta, group_commit=group_commit)
+    # Las conexiones que se abran a partir de aquí (pool y escritor) usan el nivel pedido
+    db.pool.pragmas = tuple(p for p in PRAGMAS if not p.startswith("synchronous")) + (f"synchronous={synchronous}",)
+    db.pool.close()
+    db.importar_tratamientos([
+        {"chat_id": f"h{i}", "medicamento": "ibuprofeno", "dosis": "1 tableta", "frecuencia": 8,
+         "hora_inicio": "08:00", "total_dosis": escrituras}
+        for i in range(hilos)
+    ])
+    dosis = {}
+    for fila in db.get_dosis_pendientes():
+        dosis.setdefault(fila["recordatorio_id"], []).append(fila["dosis_id"])
+    por_hilo = list(dosis.values())
+    errores = []
+    salida = threading.Barrier(hilos + 1)
+
+    def escritor(i):
+        salida.wait()
+        try:
+            for n in range(escrituras):
+                if n % 2:
+                    db.marcar_dosis_tomada(por_hilo[i][n])
+                else:
+                    db.add_usuario(f"{i}-{n}")
+        except Exception as e:
+            errores.append(e)
+
+    trabajadores = [threading.Thread(target=escritor, args=(i,)) for i in range(hilos)]
+    for t in trabajadores:
+        t.start()
+    inicio = time.perf_counter()
+    salida.wait()
+    for t in trabajadores:
+        t.join()
+    duracion = time.perf_counter() - inicio
+    lotes = db.writer.stats() if db.writer else None
+    db.close()
+
+    total = hilos * escrituras
+    detalle = f", lotes={lotes['lotes']} (medio {lotes['lote_medio']:.1f}, máx {lotes['lote_max']})" if lotes else ""
+    print(f"[{nombre}, synchronous={synchronous}] {total / duracion:8.0f} escrituras/s ({duracion:.2f}s), errores={len(errores)}{detalle}")
+    if errores:
+        print(f"    primer error: {errores[0]!r}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hilos", type=int, default=50)
+    parser.add_argument("--escrituras", type=int, default=200, help="escrituras por hilo")
+    parser.add_argument("--synchronous", default="NORMAL", choices=["OFF", "NORMAL", "FULL"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        medir("commit por escritura", os.path.join(tmp, "inmediato.db"), args.hilos, args.escrituras, False, args.synchronous)
+        medir("group commit", os.path.join(tmp, "agrupado.db"), args.hilos, args.escrituras, True, args.synchronous)
@@ -0,0 +1,122 @@
+"""Benchmark: importación de la descarga masiva de etiquetas de OpenFDA al índice FTS5 local.
+
+Genera un zip como los de drug/label con --etiquetas etiquetas de tamaño
+parecido a las reales (con los campos que no se indexan) y mide:
+
+- importación completa: etiquetas/s, MB/s de JSON descomprimido y pico de
+  memoria de Python (el zip se lee en streaming, así que no crece con él);
+- refresco incremental con un --cambios % de etiquetas con versión nueva;
+- latencia de buscar() sobre el índice resultante.
+
+    python benchmarks/bench_indice_fda.py --etiquetas 50000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fda_index import FDAIndex
+
+SUSTANCIAS = ["IBUPROFEN", "ACETAMINOPHEN", "AMOXICILLIN", "NAPROXEN", "ASPIRIN", "LORATADINE", "CETIRIZINE",
+              "OMEPRAZOLE", "METFORMIN", "LISINOPRIL", "ATORVASTATIN", "SIMVASTATIN", "AMLODIPINE", "FAMOTIDINE",
+              "DIPHENHYDRAMINE", "GUAIFENESIN", "DEXTROMETHORPHAN", "PSEUDOEPHEDRINE", "LIDOCAINE", "ZINC OXIDE"]
+PALABRAS = ("take tablet daily adults children under years consult doctor if pain fever persists do not exceed "
+            "recommended dose allergy alert may cause severe reaction stomach bleeding warning").split()
+
+
+def texto(rng, palabras):
+    return " ".join(rng.choice(PALABRAS) for _ in range(palabras))
+
+
+def etiqueta(rng, i, version=1):
+    sustancias = rng.sample(SUSTANCIAS, rng.choice((1, 1, 1, 2)))
+    return {
+        "set_id": f"set-{i:08d}", "id": f"id-{i:08d}-{version}", "version": str(version),
+        "effective_time": "20240601",
+        "openfda": {"generic_name": [" AND ".join(sustancias)], "substance_name": sustancias,
+                    "brand_name": [f"MARCA {i}"], "route": ["ORAL"], "manufacturer_name": [f"Laboratorio {i % 500}"]},
+        "warnings": [texto(rng, 300)],
+        "dosage_and_administration": [texto(rng, 120)],
+        "indications_and_usage": [texto(rng, 60)],
+        # Campos que no se indexan pero ocupan buena parte de cada etiqueta
+        "description": [texto(rng, 400)],
+        "package_label_principal_display_panel": [texto(rng, 150)],
+        "spl_product_data_elements": [texto(rng, 80)],
+    }
+
+
+def escribir_zip(ruta, etiquetas, cambios=0.0, semilla=1):
+    """Escribe la partición etiqueta a etiqueta; devuelve los bytes de JSON sin comprimir"""
+    rng = random.Random(semilla)
+    cambiar = random.Random(semilla + 1)
+    tamano = 0
+    with zipfile.ZipFile(ruta, "w", zipfile.ZIP_DEFLATED) as zf:
+        with zf.open("drug-label-0001-of-0001.json", "w") as f:
+            def escribir(cadena):
+                nonlocal tamano
+                datos = cadena.encode()
+                tamano += len(datos)
+                f.write(datos)
+            escribir(json.dumps({"meta": {"results": {"skip": 0, "total": etiquetas}}})[:-1] + ', "results": [')
+            for i in range(etiquetas):
+                version = 2 if cambiar.random() < cambios else 1
+                escribir(("," if i else "") + json.dumps(etiqueta(rng, i, version)))
+            escribir("]}")
+    return tamano
+
+
+def medir_importacion(indice, ruta):
+    tracemalloc.start()
+    resultado = indice.importar_zips([ruta])
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    resultado["pico_kib"] = pico // 1024
+    return resultado
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--etiquetas", type=int, default=50000)
+    parser.add_argument("--cambios", type=float, default=0.05, help="fracción de etiquetas con versión nueva")
+    parser.add_argument("--busquedas", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta_zip = os.path.join(tmp, "drug-label.json.zip")
+        json_bytes = escribir_zip(ruta_zip, args.etiquetas)
+        zip_mb = os.path.getsize(ruta_zip) / 1e6
+        indice = FDAIndex(os.path.join(tmp, "fda_index.db"))
+
+        completa = medir_importacion(indice, ruta_zip)
+        print(f"importación completa: {args.etiquetas} etiquetas, zip {zip_mb:.1f} MB, JSON {json_bytes / 1e6:.1f} MB")
+        print(f"  {completa['etiquetas'] / completa['segundos']:10.0f} etiquetas/s "
+              f"{json_bytes / 1e6 / completa['segundos']:8.1f} MB/s ({completa['segundos']:.2f}s), "
+              f"pico de memoria {completa['pico_kib']} KiB, "
+              f"índice {os.path.getsize(indice.ruta) / 1e6:.1f} MB")
+
+        escribir_zip(ruta_zip, args.etiquetas, cambios=args.cambios)
+        incremental = medir_importacion(indice, ruta_zip)
+        print(f"refresco incremental ({args.cambios:.0%} cambiadas): {incremental['escritas']} escritas, "
+              f"{incremental['sin_cambios']} sin cambios")
+        print(f"  {incremental['etiquetas'] / incremental['segundos']:10.0f} etiquetas/s "
+              f"({incremental['segundos']:.2f}s), pico de memoria {incremental['pico_kib']} KiB")
+
+        rng = random.Random(7)
+        latencias = []
+        for _ in range(args.busquedas):
+            nombre = rng.choice(SUSTANCIAS).lower()
+            inicio = time.perf_counter()
+            assert indice.buscar(nombre) is not None
+            latencias.append((time.perf_counter() - inicio) * 1000)
+        latencias.sort()
+        print(f"buscar(): p50 {statistics.median(latencias):.3f} ms  "
+              f"p99 {latencias[int(len(latencias) * 0.99)]:.3f} ms  max {latencias[-1]:.3f} ms")
+        indice.close()
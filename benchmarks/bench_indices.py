@@ -0,0 +1,102 @@
+"""Benchmark: consultas de dosis y recordatorios en el esquema inicial y tras las migraciones.
+
+Genera una base de datos en la versión 0 del esquema, sin índices y con
+--dosis filas en DosisProgramada (10 por recordatorio), y mide las consultas
+como se hacían entonces. Después deja que DatabaseManager aplique las
+migraciones (índices, instantes y la conversión de las dosis en reglas de la
+migración 3) y mide los métodos actuales sobre la misma base de datos.
+
+    python benchmarks/bench_indices.py --dosis 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from BBDD import DatabaseManager
+
+DOSIS_POR_RECORDATORIO = 10
+RECORDATORIOS_POR_USUARIO = 5
+
+ESQUEMA_INICIAL = '''
+CREATE TABLE Usuario (usuario_id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id TEXT UNIQUE, nombre TEXT,
+                      telefono TEXT, es_premium BOOLEAN DEFAULT 0);
+CREATE TABLE Recordatorio (recordatorio_id INTEGER PRIMARY KEY AUTOINCREMENT, usuario_id INTEGER,
+                           nombre_medicamento TEXT NOT NULL, dosis TEXT NOT NULL, frecuencia_horas INTEGER,
+                           hora_inicio TEXT, dosis_totales INTEGER, activo BOOLEAN DEFAULT 1);
+CREATE TABLE DosisProgramada (dosis_id INTEGER PRIMARY KEY AUTOINCREMENT, recordatorio_id INTEGER,
+                              hora_programada TEXT, tomada BOOLEAN DEFAULT 0);
+'''
+
+# Consultas de la versión 0, sobre una fila por dosis
+CONSULTAS_INICIALES = {
+    "get_dosis_restantes": 'SELECT COUNT(*) FROM DosisProgramada WHERE recordatorio_id = ? AND tomada = 0',
+    "get_siguiente_dosis": '''SELECT hora_programada FROM DosisProgramada WHERE recordatorio_id = ? AND tomada = 0
+                              ORDER BY hora_programada LIMIT 1''',
+    "get_recordatorios_activos": '''SELECT r.recordatorio_id, r.nombre_medicamento, r.dosis, r.frecuencia_horas,
+                                           r.hora_inicio, r.dosis_totales
+                                    FROM Recordatorio r JOIN Usuario u ON r.usuario_id = u.usuario_id
+                                    WHERE u.chat_id = ? AND r.activo = 1''',
+}
+
+
+def poblar(conn, total_dosis):
+    recordatorios = total_dosis // DOSIS_POR_RECORDATORIO
+    usuarios = max(1, recordatorios // RECORDATORIOS_POR_USUARIO)
+    conn.executescript(ESQUEMA_INICIAL)
+    conn.executemany('INSERT INTO Usuario (chat_id, nombre) VALUES (?, ?)',
+                     ((str(i), f"usuario {i}") for i in range(usuarios)))
+    conn.executemany('''
+        INSERT INTO Recordatorio (usuario_id, nombre_medicamento, dosis, frecuencia_horas, hora_inicio, dosis_totales)
+        VALUES (?, 'ibuprofeno', '1 tableta', 8, '08:00', ?)''',
+        ((1 + i % usuarios, DOSIS_POR_RECORDATORIO) for i in range(recordatorios)))
+    conn.executemany('INSERT INTO DosisProgramada (recordatorio_id, hora_programada, tomada) VALUES (?, ?, ?)',
+                     ((1 + i // DOSIS_POR_RECORDATORIO, f"{(8 * i) % 24:02d}:00", int(i % DOSIS_POR_RECORDATORIO < 3))
+                      for i in range(total_dosis)))
+    conn.commit()
+    return usuarios, recordatorios
+
+
+def medir(consultas, usuarios, recordatorios, repeticiones):
+    rng = random.Random(42)
+    resultados = {}
+    for nombre, consulta in consultas.items():
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            consulta(rng.randint(1, recordatorios) if nombre != "get_recordatorios_activos"
+                     else str(rng.randrange(usuarios)))
+        resultados[nombre] = (time.perf_counter() - inicio) / repeticiones * 1000
+    return resultados
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dosis", type=int, default=1000000)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = os.path.join(tmp, "bench.db")
+        conn = sqlite3.connect(ruta)
+        usuarios, recordatorios = poblar(conn, args.dosis)
+        antes = medir({nombre: lambda param, sql=sql: conn.execute(sql, (param,)).fetchall()
+                       for nombre, sql in CONSULTAS_INICIALES.items()},
+                      usuarios, recordatorios, args.repeticiones)
+        conn.close()
+
+        inicio = time.perf_counter()
+        db = DatabaseManager(ruta)
+        migracion = time.perf_counter() - inicio
+        despues = medir({nombre: getattr(db, nombre) for nombre in CONSULTAS_INICIALES},
+                        usuarios, recordatorios, args.repeticiones * 50)
+        db.close()
+
+    print(f"{args.dosis} dosis, {recordatorios} recordatorios, {usuarios} usuarios; migración: {migracion:.2f}s")
+    for nombre in antes:
+        print(f"{nombre:28s} versión 0 {antes[nombre]:9.3f} ms  actual {despues[nombre]:7.3f} ms"
+              f"  (x{antes[nombre] / despues[nombre]:.0f})")
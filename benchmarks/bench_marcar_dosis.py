@@ -0,0 +1,53 @@
+"""Benchmark: marcar dosis como enviadas.
+
+Compara marcar_dosis_tomada en orden (un UPDATE ... RETURNING que avanza el
+cursor de la regla), en orden inverso (cada dosis se anota como excepción
+hasta que el cursor la alcanza) y marcar_dosis_tomadas con lotes de --lote dosis.
+
+    python benchmarks/bench_marcar_dosis.py --dosis 20000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from BBDD import DOSIS_RESTANTES, DatabaseManager
+
+DOSIS_POR_RECORDATORIO = 10
+
+
+def medir(nombre, dosis, funcion):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, "bench.db"))
+        db.importar_tratamientos([
+            {"chat_id": str(i), "medicamento": "ibuprofeno", "dosis": "1 tableta", "frecuencia": 8,
+             "hora_inicio": "08:00", "total_dosis": DOSIS_POR_RECORDATORIO}
+            for i in range(dosis // DOSIS_POR_RECORDATORIO)
+        ])
+        filas = db.get_dosis_pendientes()
+        inicio = time.perf_counter()
+        funcion(db, filas)
+        duracion = time.perf_counter() - inicio
+        pendientes = db.get_dosis_restantes(filas[0]["recordatorio_id"])
+        total = db.conn.execute(f"SELECT SUM({DOSIS_RESTANTES}) FROM Recordatorio r").fetchone()[0]
+        db.close()
+    assert total == 0 and pendientes == 0, total
+    print(f"{nombre:38s} {len(filas) / duracion:10.0f} dosis/s ({duracion:.2f}s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dosis", type=int, default=20000)
+    parser.add_argument("--lote", type=int, default=1000)
+    args = parser.parse_args()
+
+    medir("marcar_dosis_tomada (en orden)", args.dosis,
+          lambda db, filas: [db.marcar_dosis_tomada(f["dosis_id"]) for f in filas])
+    medir("marcar_dosis_tomada (orden inverso)", args.dosis,
+          lambda db, filas: [db.marcar_dosis_tomada(f["dosis_id"]) for f in reversed(filas)])
+    medir(f"marcar_dosis_tomadas (lotes de {args.lote})", args.dosis,
+          lambda db, filas: [db.marcar_dosis_tomadas([f["dosis_id"] for f in filas[i:i + args.lote]])
+                             for i in range(0, len(filas), args.lote)])
@@ -0,0 +1,120 @@
+"""Benchmark: conexión por hilo frente al pool acotado de DatabaseManager.
+
+Lanza --workers hilos a la vez (como los antiguos threading.Timer, uno por
+dosis) que consultan resúmenes y marcan dosis, y mide operaciones por segundo,
+errores y el máximo de descriptores de fichero abiertos por el proceso.
+"Por hilo" reproduce el comportamiento anterior: cada hilo abría su propia
+conexión, sin los PRAGMAs del pool, y no la cerraba hasta terminar.
+
+    python benchmarks/bench_pool.py --workers 200 --operaciones 50
+"""
+import argparse
+import gc
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from BBDD import DatabaseManager
+
+
+class DatabaseManagerPorHilo(DatabaseManager):
+    """Una conexión por hilo abierta bajo demanda y nunca devuelta"""
+
+    @contextmanager
+    def conexion(self):
+        if getattr(self._local, "conn", None) is None:
+            self._local.conn = sqlite3.connect(self.db_name)
+            self._local.conn.row_factory = sqlite3.Row
+        yield self._local.conn
+
+
+def descriptores():
+    return len(os.listdir("/proc/self/fd"))
+
+
+def preparar(ruta, workers):
+    db = DatabaseManager(ruta)
+    db.importar_tratamientos([
+        {"chat_id": str(i), "medicamento": "ibuprofeno", "dosis": "1 tableta", "frecuencia": 8,
+         "hora_inicio": "08:00", "total_dosis": 100}
+        for i in range(workers)
+    ])
+    db.close()
+
+
+def medir(nombre, db, workers, operaciones):
+    dosis = {}
+    for fila in db.get_dosis_pendientes():
+        dosis.setdefault(fila["recordatorio_id"], []).append(fila["dosis_id"])
+    por_hilo = list(dosis.values())
+    errores = []
+    inicio_juntos = threading.Barrier(workers + 1)
+    fin_juntos = threading.Barrier(workers + 1)
+    maximo = [descriptores()]
+    base = maximo[0]
+    midiendo = threading.Event()
+
+    def muestrear():
+        while not midiendo.is_set():
+            maximo[0] = max(maximo[0], descriptores())
+            time.sleep(0.005)
+
+    def trabajador(i):
+        inicio_juntos.wait()
+        try:
+            for n in range(operaciones):
+                if n % 2:
+                    db.marcar_dosis_tomada(por_hilo[i][n])
+                else:
+                    db.get_resumen_recordatorios(str(i))
+        except Exception as e:
+            errores.append(e)
+        # Los hilos siguen vivos hasta que terminan todos, como un Timer esperando su dosis
+        fin_juntos.wait()
+
+    hilos = [threading.Thread(target=trabajador, args=(i,)) for i in range(workers)]
+    for h in hilos:
+        h.start()
+    muestreador = threading.Thread(target=muestrear)
+    muestreador.start()
+    inicio = time.perf_counter()
+    inicio_juntos.wait()
+    fin_juntos.wait()
+    duracion = time.perf_counter() - inicio
+    maximo[0] = max(maximo[0], descriptores())
+    midiendo.set()
+    muestreador.join()
+    for h in hilos:
+        h.join()
+
+    total = workers * operaciones
+    extra = f", pool={db.pool.stats()}" if not isinstance(db, DatabaseManagerPorHilo) else ""
+    print(f"[{nombre}] {total / duracion:8.0f} op/s ({duracion:.2f}s), errores={len(errores)}, "
+          f"descriptores máx={maximo[0]} (+{maximo[0] - base}){extra}")
+    if errores:
+        print(f"    primer error: {errores[0]!r}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=200)
+    parser.add_argument("--operaciones", type=int, default=50)
+    parser.add_argument("--pool", type=int, default=16, help="conexiones máximas del pool")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for nombre, clase, kwargs in (("por hilo", DatabaseManagerPorHilo, {}),
+                                      ("pool", DatabaseManager, {"max_conexiones": args.pool})):
+            ruta = os.path.join(tmp, f"{nombre}.db")
+            preparar(ruta, args.workers)
+            db = clase(ruta, **kwargs)
+            medir(nombre, db, args.workers, args.operaciones)
+            db.close()
+            del db
+            gc.collect()
@@ -0,0 +1,80 @@
+"""Benchmark: una fila por dosis frente a guardar la regla de cada recordatorio.
+
+La versión fila a fila se mide sobre la tabla DosisProgramada anterior a la
+migración 3; programar_dosis e importar_tratamientos escriben una sola fila
+por recordatorio sea cual sea el número de dosis.
+
+    python benchmarks/bench_programar_dosis.py --dosis 100000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from BBDD import DatabaseManager
+
+DOSIS_POR_RECORDATORIO = 100
+
+
+def programar_dosis_fila_a_fila(db, recordatorio_id, hora_inicio, frecuencia, total_dosis):
+    """Implementación anterior: un INSERT y un strftime por dosis"""
+    cursor = db.conn.cursor()
+    cursor.execute('CREATE TABLE IF NOT EXISTS DosisProgramada ('
+                   'dosis_id INTEGER PRIMARY KEY AUTOINCREMENT, recordatorio_id INTEGER, hora_programada TEXT)')
+    hora = datetime.strptime(str(hora_inicio), "%H:%M")
+    for i in range(total_dosis):
+        cursor.execute('INSERT INTO DosisProgramada (recordatorio_id, hora_programada) VALUES (?, ?)',
+                       (recordatorio_id, hora.strftime("%H:%M")))
+        hora += timedelta(hours=int(frecuencia))
+    db.conn.commit()
+
+
+def tratamientos(n):
+    return [{"chat_id": str(i % 500), "medicamento": "ibuprofeno", "dosis": "1 tableta", "frecuencia": 8,
+             "hora_inicio": "08:00", "total_dosis": DOSIS_POR_RECORDATORIO} for i in range(n)]
+
+
+def medir(nombre, total_dosis, funcion):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, "bench.db"))
+        inicio = time.perf_counter()
+        funcion(db)
+        duracion = time.perf_counter() - inicio
+        dosis, filas = contar(db)
+        db.close()
+    assert dosis == total_dosis, dosis
+    print(f"{nombre:32s} {dosis / duracion:10.0f} dosis/s ({duracion:.2f}s, {filas} filas de dosis)")
+
+
+def contar(db):
+    """(dosis programadas, filas escritas para guardarlas)"""
+    if db.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'DosisProgramada'").fetchone():
+        filas = db.conn.execute("SELECT COUNT(*) FROM DosisProgramada").fetchone()[0]
+        return filas, filas
+    return tuple(db.conn.execute('SELECT SUM(dosis_totales), COUNT(*) FROM Recordatorio').fetchone())
+
+
+def por_recordatorio(programar):
+    def funcion(db):
+        for t in TRATAMIENTOS:
+            db.add_usuario(t["chat_id"])
+            recordatorio_id = db.add_recordatorio(t["chat_id"], t["medicamento"], t["dosis"], t["frecuencia"],
+                                                  t["hora_inicio"], t["total_dosis"])
+            programar(db, recordatorio_id, t["hora_inicio"], t["frecuencia"], t["total_dosis"])
+    return funcion
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dosis", type=int, default=100000)
+    args = parser.parse_args()
+
+    TRATAMIENTOS = tratamientos(args.dosis // DOSIS_POR_RECORDATORIO)
+    total = len(TRATAMIENTOS) * DOSIS_POR_RECORDATORIO
+    medir("fila a fila (anterior)", total, por_recordatorio(programar_dosis_fila_a_fila))
+    medir("programar_dosis (regla)", total, por_recordatorio(DatabaseManager.programar_dosis))
+    medir("importar_tratamientos", total, lambda db: db.importar_tratamientos(TRATAMIENTOS))
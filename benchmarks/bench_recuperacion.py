@@ -0,0 +1,61 @@
+"""Benchmark: arranque con --dosis dosis pendientes, la mitad vencidas con el bot parado.
+
+Mide restore_reminders (recuperación de las vencidas según la política) más
+la primera pasada del barredor, que reclama las que quedan por enviar, para
+cada política de RECOVERY_POLICY. Los mensajes no se envían.
+
+    python benchmarks/bench_recuperacion.py --dosis 100000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from BBDD import DatabaseManager
+from scheduler import DoseSweeper
+
+DOSIS_POR_RECORDATORIO = 10
+
+
+def crear_base(ruta, dosis):
+    """Recordatorios cada 2 h que empezaron hace 10 h: 6 dosis vencidas y 4 futuras por recordatorio"""
+    desde = datetime.now().replace(second=0, microsecond=0) - timedelta(hours=10)
+    db = DatabaseManager(ruta)
+    db.importar_tratamientos([
+        {"chat_id": str(i % 5000), "medicamento": "ibuprofeno", "dosis": "1 tableta", "frecuencia": 2,
+         "hora_inicio": desde.strftime("%H:%M"), "total_dosis": DOSIS_POR_RECORDATORIO}
+        for i in range(dosis // DOSIS_POR_RECORDATORIO)
+    ], desde=desde)
+    db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dosis", type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        plantilla = os.path.join(tmp, "plantilla.db")
+        crear_base(plantilla, args.dosis)
+        os.environ["DATABASE_PATH"] = os.path.join(tmp, "app.db")
+        # Las dosis vencidas las barre el benchmark, no el barredor de la app
+        os.environ["SWEEPER_AUTOSTART"] = "0"
+        import app
+
+        for politica in app.POLITICAS_RECUPERACION:
+            ruta = os.path.join(tmp, f"{politica}.db")
+            shutil.copy(plantilla, ruta)
+            app.db = DatabaseManager(ruta)
+            app.RECOVERY_POLICY = politica
+            inicio = time.perf_counter()
+            app.restore_reminders()
+            enviadas = DoseSweeper(app.db, lambda filas: None).sweep()
+            duracion = time.perf_counter() - inicio
+            pendientes = len(app.db.get_dosis_pendientes())
+            print(f"[{politica:8s}] {duracion:.2f}s, {enviadas} dosis enviadas, {pendientes} dosis futuras pendientes")
+            app.db.close()
@@ -0,0 +1,118 @@
+"""Benchmark: planificador con montículo frente a un threading.Timer por dosis.
+
+Mide memoria (RSS), número de hilos y jitter de disparo (retraso real sobre la
+hora programada). Los Timer se limitan por defecto a unos pocos miles porque
+cada uno es un hilo del sistema; el coste por dosis se extrapola a --doses.
+
+    python benchmarks/bench_scheduler.py --doses 100000 --timers 5000
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from dose_scheduler import DoseScheduler
+
+
+def rss_kb():
+    with open("/proc/self/status") as f:
+        for linea in f:
+            if linea.startswith("VmRSS:"):
+                return int(linea.split()[1])
+    return 0
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+
+def resumen_jitter(retrasos):
+    ms = [r * 1000 for r in retrasos]
+    return f"p50={percentil(ms, 50):.2f}ms p99={percentil(ms, 99):.2f}ms max={max(ms):.2f}ms"
+
+
+def bench_heap(doses, muestras):
+    retrasos = []
+    lock = threading.Lock()
+    objetivo = {}
+
+    def deliver(dosis_id, token):
+        ahora = time.time()
+        with lock:
+            retrasos.append(ahora - objetivo[dosis_id])
+
+    base = rss_kb()
+    hilos = threading.active_count()
+    scheduler = DoseScheduler(deliver, max_workers=8)
+    lejos = time.time() + 3600
+    scheduler.schedule_many((lejos + i % 86400, i) for i in range(doses))
+    memoria = rss_kb() - base
+
+    inicio = time.time()
+    for i in range(muestras):
+        dosis_id = doses + i
+        objetivo[dosis_id] = inicio + 0.5 + random.random()
+        scheduler.schedule(objetivo[dosis_id], dosis_id)
+    while len(retrasos) < muestras:
+        time.sleep(0.05)
+    extra_hilos = threading.active_count() - hilos
+    stats = scheduler.stats()
+    scheduler.stop(wait=False)
+
+    print(f"[heap]  {doses} dosis pendientes: RSS +{memoria / 1024:.1f} MiB, "
+          f"hilos extra={extra_hilos}, jitter {resumen_jitter(retrasos)}")
+    tramos = ", ".join(f"<={limite}s: {cuenta}" for limite, cuenta in stats["retraso_histograma"].items() if cuenta)
+    print(f"        histograma de retraso del planificador: {tramos}")
+
+
+def bench_timers(timers, doses, muestras):
+    retrasos = []
+    lock = threading.Lock()
+
+    def deliver(objetivo):
+        ahora = time.time()
+        with lock:
+            retrasos.append(ahora - objetivo)
+
+    base = rss_kb()
+    pendientes = []
+    try:
+        for i in range(timers):
+            t = threading.Timer(3600, deliver, args=(0,))
+            t.start()
+            pendientes.append(t)
+    except RuntimeError as e:
+        print(f"[timer] no se pudieron crear más hilos tras {len(pendientes)}: {e}")
+    memoria = rss_kb() - base
+    por_dosis = memoria / max(len(pendientes), 1)
+
+    inicio = time.time()
+    for i in range(muestras):
+        objetivo = inicio + 0.5 + random.random()
+        t = threading.Timer(objetivo - time.time(), deliver, args=(objetivo,))
+        t.start()
+        pendientes.append(t)
+    while len(retrasos) < muestras:
+        time.sleep(0.05)
+    for t in pendientes:
+        t.cancel()
+
+    print(f"[timer] {len(pendientes) - muestras} dosis pendientes: RSS +{memoria / 1024:.1f} MiB "
+          f"(~{por_dosis * doses / 1024:.0f} MiB extrapolado a {doses}), "
+          f"hilos extra={len(pendientes)}, jitter {resumen_jitter(retrasos)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--doses", type=int, default=100000)
+    parser.add_argument("--timers", type=int, default=5000)
+    parser.add_argument("--muestras", type=int, default=2000)
+    args = parser.parse_args()
+
+    bench_heap(args.doses, args.muestras)
+    bench_timers(args.timers, args.doses, args.muestras)
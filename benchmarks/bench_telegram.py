@@ -0,0 +1,54 @@
+"""Benchmark: envíos a Telegram con requests.post suelto frente a TelegramClient.
+
+Usa un servidor local que imita la API de Telegram, así que mide el coste de
+abrir conexiones y la concurrencia, no la red real (sin TLS, el ahorro real
+del keep-alive es mayor). Los límites de Telegram se desactivan para medir el
+rendimiento máximo; --chats reparte los mensajes entre varios chats.
+
+    python benchmarks/bench_telegram.py --mensajes 2000 --workers 8
+"""
+import argparse
+import os
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from telegram_client import TelegramClient
+from stubs import StubServer
+
+
+def bench_sin_sesion(mensajes, latencia):
+    with StubServer(latencia) as stub:
+        inicio = time.perf_counter()
+        for i in range(mensajes):
+            requests.post(f"{stub.url}/botTOKEN/sendMessage", data={"chat_id": i, "text": "hola"})
+        duracion = time.perf_counter() - inicio
+        print(f"[requests.post] {mensajes / duracion:8.0f} msg/s, conexiones abiertas={stub.conexiones}")
+
+
+def bench_cliente(mensajes, workers, chats, latencia):
+    with StubServer(latencia) as stub:
+        cliente = TelegramClient(stub.url, workers=workers, global_rate=0, chat_interval=0)
+        inicio = time.perf_counter()
+        cliente.enqueue_many(("TOKEN", i % chats, "hola") for i in range(mensajes))
+        cliente.join()
+        duracion = time.perf_counter() - inicio
+        cliente.stop()
+        stats = cliente.stats()
+        print(f"[TelegramClient x{workers}] {mensajes / duracion:8.0f} msg/s, conexiones abiertas={stub.conexiones}, "
+              f"latencia media={stats['latencia_media'] * 1000:.2f}ms, fallidos={stats['fallidos']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mensajes", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--latencia", type=float, default=0.005, help="latencia simulada del servidor (s)")
+    args = parser.parse_args()
+
+    bench_sin_sesion(args.mensajes, args.latencia)
+    bench_cliente(args.mensajes, args.workers, args.chats, args.latencia)
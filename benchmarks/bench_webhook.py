@@ -0,0 +1,78 @@
+"""Benchmark: latencia del webhook /telegram con procesamiento síncrono y en segundo plano.
+
+Levanta la app en un servidor HTTP local y envía --updates actualizaciones
+desde --clientes hilos. La consulta a OpenFDA se simula con una espera de
+--latencia-fda segundos y los envíos a Telegram no hacen nada, así que se mide
+cuánto tarda el webhook en responder a Telegram.
+
+    python benchmarks/bench_webhook.py --updates 3000
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def percentil(valores, p):
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+
+def medir(app_module, updates, clientes, workers):
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    app_module.updates = app_module.UpdateDispatcher(app_module.handle_message, workers=workers)
+    servidor = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{servidor.server_port}/telegram?token=T"
+
+    # Cada chat pide información de un medicamento: /start, opción 2 y el nombre
+    pasos = ["/start", "2. Obtener información medicamento", "ibuprofeno"]
+    sesiones = threading.local()
+
+    def enviar(i):
+        if not hasattr(sesiones, "s"):
+            sesiones.s = requests.Session()
+        chat, paso = divmod(i, len(pasos))
+        inicio = time.perf_counter()
+        sesiones.s.post(url, json={"update_id": workers * 10 ** 7 + i,
+                                   "message": {"chat": {"id": chat}, "text": pasos[paso]}})
+        return time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(clientes) as pool:
+        latencias = sorted(pool.map(enviar, range(updates)))
+    respondido = time.perf_counter() - inicio
+    app_module.updates.wait_idle()
+    total = time.perf_counter() - inicio
+    servidor.shutdown()
+
+    modo = "síncrono" if not workers else f"en segundo plano x{workers}"
+    print(f"[{modo}] p50={percentil(latencias, 50) * 1000:.1f}ms p99={percentil(latencias, 99) * 1000:.1f}ms "
+          f"max={latencias[-1] * 1000:.1f}ms; respuestas en {respondido:.1f}s, procesado completo en {total:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=3000)
+    parser.add_argument("--clientes", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latencia-fda", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_PATH"] = os.path.join(tmp, "bench.db")
+        import app
+
+        app.send_telegram_message = lambda *a, **k: True
+        app.fetch_medication_info = lambda nombre: time.sleep(args.latencia_fda) or "info"
+        medir(app, args.updates, args.clientes, 0)
+        medir(app, args.updates, args.clientes, args.workers)
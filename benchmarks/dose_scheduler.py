@@ -0,0 +1,149 @@
+"""Planificador en memoria con un montículo y un callback por dosis.
+
+Era el planificador del bot antes del barredor por lotes (scheduler.DoseSweeper);
+se conserva solo como referencia para comparar con él en los benchmarks.
+"""
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from scheduler import HistogramaRetraso
+
+
+class DoseScheduler:
+    """Planificador único de dosis.
+
+    Mantiene un montículo (heap) ordenado por la hora de envío de cada dosis
+    pendiente y un único hilo despachador que duerme exactamente hasta la
+    siguiente dosis; programar o cancelar una dosis que cambia la primera del
+    montículo lo despierta mediante la variable de condición. Las dosis
+    vencidas se entregan a un pool acotado de trabajadores.
+    """
+
+    def __init__(self, deliver, max_workers=8):
+        self._deliver = deliver
+        self._heap = []
+        # dosis_id -> entrada del montículo; las canceladas se marcan y se descartan al llegar a la cima
+        self._entradas = {}
+        self._canceladas = 0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dosis")
+        self._thread = None
+        self._running = False
+        self._retrasos = HistogramaRetraso()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._entradas)
+
+    def schedule(self, when, dosis_id, token=None):
+        """Programa una dosis para el instante `when` (segundos epoch); si ya estaba, se reprograma"""
+        with self._cond:
+            entrada = self._nueva_entrada(when, dosis_id, token)
+            heapq.heappush(self._heap, entrada)
+            # Solo hace falta despertar al despachador si la nueva dosis es la primera
+            if self._heap[0] is entrada:
+                self._cond.notify()
+        self.start()
+
+    def schedule_many(self, entradas, token=None):
+        """Programa en bloque una secuencia de (when, dosis_id)"""
+        with self._cond:
+            for when, dosis_id in entradas:
+                self._heap.append(self._nueva_entrada(when, dosis_id, token))
+            heapq.heapify(self._heap)
+            self._cond.notify()
+        self.start()
+
+    def cancel(self, dosis_ids):
+        """Cancela las dosis indicadas; devuelve cuántas estaban programadas"""
+        with self._cond:
+            canceladas = 0
+            for dosis_id in dosis_ids:
+                entrada = self._entradas.pop(dosis_id, None)
+                if entrada is not None:
+                    entrada[2] = None
+                    canceladas += 1
+            self._canceladas += canceladas
+            if self._canceladas > len(self._heap) // 2:
+                # Demasiadas entradas muertas: reconstruir el montículo con las vivas
+                self._heap = [entrada for entrada in self._heap if entrada[2] is not None]
+                heapq.heapify(self._heap)
+                self._canceladas = 0
+            if canceladas:
+                # Si era la primera dosis, el despachador debe recalcular cuánto dormir
+                self._cond.notify()
+            return canceladas
+
+    def stats(self):
+        """Dosis programadas y retraso de disparo (hora real de entrega - hora programada)"""
+        return {"programadas": len(self), **self._retrasos.stats()}
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="despachador-dosis", daemon=True)
+            self._thread.start()
+
+    def stop(self, wait=True):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None and wait:
+            self._thread.join()
+        self._pool.shutdown(wait=wait)
+
+    def _nueva_entrada(self, when, dosis_id, token):
+        anterior = self._entradas.get(dosis_id)
+        if anterior is not None:
+            anterior[2] = None
+            self._canceladas += 1
+        entrada = [when, next(self._seq), dosis_id, token]
+        self._entradas[dosis_id] = entrada
+        return entrada
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    # Descartar las dosis canceladas que hayan llegado a la cima
+                    while self._heap and self._heap[0][2] is None:
+                        heapq.heappop(self._heap)
+                        self._canceladas -= 1
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    retraso = self._heap[0][0] - time.time()
+                    if retraso <= 0:
+                        break
+                    self._cond.wait(retraso)
+                if not self._running:
+                    return
+                vencidas = []
+                ahora = time.time()
+                while self._heap and self._heap[0][0] <= ahora:
+                    when, _, dosis_id, token = heapq.heappop(self._heap)
+                    if dosis_id is None:
+                        self._canceladas -= 1
+                        continue
+                    del self._entradas[dosis_id]
+                    vencidas.append((when, dosis_id, token))
+
+            for when, dosis_id, token in vencidas:
+                self._pool.submit(self._entregar, when, dosis_id, token)
+
+    def _entregar(self, when, dosis_id, token):
+        self._retrasos.registrar(time.time() - when)
+        try:
+            self._deliver(dosis_id, token)
+        except Exception as e:
+            print(f"Error al entregar la dosis {dosis_id}: {e}")
@@ -0,0 +1,73 @@
+"""Prueba de carga multiproceso del diálogo completo de creación de recordatorios.
+
+Lanza --procesos procesos con la app (como varios workers de gunicorn) sobre
+la misma base de datos y el almacén de estados SQLite. Cada mensaje de un chat
+lo atiende un proceso distinto al anterior, así que el diálogo solo termina
+bien si el estado se comparte entre procesos.
+
+    python benchmarks/load_dialogo.py --procesos 4 --chats 500
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DIALOGO = ["/start", "1. Establecer recordatorio", "ibuprofeno", "1 tableta", "8", "3", "08:00", "No"]
+
+
+def proceso(indice, procesos, chats, barrera, latencias):
+    sys.path.insert(0, RAIZ)
+    import app
+    app.send_telegram_message = lambda *args, **kwargs: True
+    cliente = app.app.test_client()
+    propias = []
+    for paso, texto in enumerate(DIALOGO):
+        for chat in range(chats):
+            if (chat + paso) % procesos == indice:
+                inicio = time.perf_counter()
+                respuesta = cliente.post("/telegram", query_string={"token": "T"},
+                                         json={"message": {"chat": {"id": 1000 + chat}, "text": texto}})
+                propias.append(time.perf_counter() - inicio)
+                assert respuesta.status_code == 200, respuesta.data
+        app.updates.wait_idle()
+        barrera.wait()
+    latencias.extend(propias)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--procesos", type=int, default=4)
+    parser.add_argument("--chats", type=int, default=500)
+    parser.add_argument("--state-store", default="sqlite", choices=["sqlite", "memory"])
+    args = parser.parse_args()
+
+    contexto = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp, contexto.Manager() as manager:
+        ruta = os.path.join(tmp, "carga.db")
+        os.environ.update({"DATABASE_PATH": ruta, "STATE_STORE": args.state_store})
+        barrera = contexto.Barrier(args.procesos)
+        latencias = manager.list()
+        trabajadores = [contexto.Process(target=proceso, args=(i, args.procesos, args.chats, barrera, latencias))
+                        for i in range(args.procesos)]
+        inicio = time.perf_counter()
+        for p in trabajadores:
+            p.start()
+        for p in trabajadores:
+            p.join()
+        duracion = time.perf_counter() - inicio
+
+        conn = sqlite3.connect(ruta)
+        completos = conn.execute("SELECT COUNT(DISTINCT usuario_id) FROM Recordatorio").fetchone()[0]
+        conn.close()
+        latencias = sorted(latencias)
+
+    print(f"{args.procesos} procesos, {args.chats} diálogos ({len(latencias)} mensajes) en {duracion:.1f}s "
+          f"(incluye el arranque de los procesos)")
+    print(f"diálogos completos: {completos}/{args.chats}")
+    if latencias:
+        print(f"latencia por mensaje: p50={latencias[len(latencias) // 2] * 1000:.2f}ms "
+              f"p99={latencias[int(len(latencias) * 0.99)] * 1000:.2f}ms")
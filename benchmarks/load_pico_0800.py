@@ -0,0 +1,112 @@
+"""Prueba de carga: pico de las 08:00 con --dosis dosis que vencen en el mismo minuto.
+
+Compara el barredor por lotes (una consulta y una transacción por lote y
+enqueue_many) con el camino anterior de un callback por dosis (SELECT, UPDATE y
+commit por dosis desde el pool del DoseScheduler). Los mensajes van a un
+servidor local que imita Telegram, sin los límites de la API real, así que se
+mide el coste propio del bot: con los límites de Telegram (30 msg/s por bot)
+el envío real de un pico así dura bastante más.
+
+    python benchmarks/load_pico_0800.py --dosis 50000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from async_io import AsyncTelegramClient, EventLoopThread
+from BBDD import DOSIS_RESTANTES, DatabaseManager
+from dose_scheduler import DoseScheduler
+from scheduler import DoseSweeper
+from stubs import StubServer
+
+
+def crear_base(ruta, dosis):
+    """Un recordatorio por usuario con su primera dosis en el minuto actual (ya vencida)"""
+    minuto = datetime.now().replace(second=0, microsecond=0)
+    db = DatabaseManager(ruta)
+    db.importar_tratamientos([
+        {"chat_id": str(i), "medicamento": "ibuprofeno", "dosis": "1 tableta", "frecuencia": 8,
+         "hora_inicio": minuto.strftime("%H:%M"), "total_dosis": 3}
+        for i in range(dosis)
+    ], desde=minuto)
+    db.close()
+
+
+def mensaje(fila):
+    return f"💊 {fila['nombre_medicamento']} {fila['dosis']} ({fila['dosis_restantes']} restantes)"
+
+
+def por_lotes(db, telegram, max_lote):
+    sweeper = DoseSweeper(db, lambda filas: telegram.enqueue_many(
+        ("TOKEN", fila["chat_id"], mensaje(fila)) for fila in filas), max_lote=max_lote)
+    sweeper.sweep()
+    return sweeper.stats()["lotes"]
+
+
+def por_dosis(db, telegram, workers):
+    """Camino anterior: el planificador llama a un callback por dosis"""
+    ids = [fila["dosis_id"] for fila in db.get_dosis_vencidas(time.time())]
+    entregadas = threading.Semaphore(0)
+
+    def deliver(dosis_id, token):
+        try:
+            datos = db.get_datos_dosis(dosis_id)
+            db.marcar_dosis_tomada(dosis_id)
+            telegram.enqueue("TOKEN", datos["chat_id"], mensaje(datos))
+        finally:
+            entregadas.release()
+
+    scheduler = DoseScheduler(deliver, max_workers=workers)
+    ahora = time.time()
+    scheduler.schedule_many((ahora, dosis_id) for dosis_id in ids)
+    for _ in ids:
+        entregadas.acquire()
+    scheduler.stop()
+    return len(ids)
+
+
+def medir(nombre, plantilla, tmp, dosis, stub, funcion):
+    ruta = os.path.join(tmp, f"{nombre}.db")
+    shutil.copy(plantilla, ruta)
+    db = DatabaseManager(ruta)
+    loop = EventLoopThread()
+    telegram = AsyncTelegramClient(stub.url, loop=loop, max_concurrentes=200, global_rate=0, chat_interval=0)
+    peticiones = stub.peticiones
+
+    inicio = time.perf_counter()
+    detalle = funcion(db, telegram)
+    encolado = time.perf_counter() - inicio
+    telegram.join()
+    total = time.perf_counter() - inicio
+    telegram.stop()
+    loop.stop()
+
+    enviados = stub.peticiones - peticiones
+    pendientes = db.conn.execute(f"SELECT SUM({DOSIS_RESTANTES}) FROM Recordatorio r").fetchone()[0]
+    db.close()
+    print(f"[{nombre}] {dosis} dosis reclamadas y encoladas en {encolado:.2f}s "
+          f"({dosis / encolado * 60:,.0f}/min), enviadas en {total:.2f}s ({enviados / total * 60:,.0f}/min); "
+          f"mensajes={enviados}, pendientes tras el pico={pendientes}, {detalle}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dosis", type=int, default=50000)
+    parser.add_argument("--lote", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=8, help="hilos del camino por dosis")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, StubServer() as stub:
+        plantilla = os.path.join(tmp, "plantilla.db")
+        crear_base(plantilla, args.dosis)
+        medir("por lotes", plantilla, tmp, args.dosis, stub,
+              lambda db, telegram: f"lotes={por_lotes(db, telegram, args.lote)}")
+        medir("por dosis", plantilla, tmp, args.dosis, stub,
+              lambda db, telegram: f"hilos={args.workers} ({por_dosis(db, telegram, args.workers)} callbacks)")
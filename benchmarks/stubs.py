@@ -0,0 +1,104 @@
+"""Servidores HTTP locales que imitan a Telegram y OpenFDA para los benchmarks."""
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ETIQUETA_FDA = {
+    "openfda": {"generic_name": ["IBUPROFEN"], "route": ["ORAL"], "substance_name": ["IBUPROFEN"]},
+    "warnings": ["Allergy alert: ibuprofen may cause a severe allergic reaction."],
+    "dosage_and_administration": ["Adults: take 1 tablet every 4 to 6 hours while symptoms persist."],
+    "indications_and_usage": ["Temporarily relieves minor aches and pains."],
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, para poder medir la reutilización
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.conexiones += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, status, cuerpo):
+        datos = json.dumps(cuerpo).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def do_POST(self):
+        longitud = int(self.headers.get("Content-Length", 0))
+        cuerpo = self.rfile.read(longitud)
+        with self.server.lock:
+            self.server.peticiones += 1
+        if self.server.recibidos is not None:
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                datos = json.loads(cuerpo or b"{}")
+            else:
+                datos = {clave: valores[0] for clave, valores in parse_qs(cuerpo.decode()).items()}
+            with self.server.lock:
+                self.server.recibidos.append((time.time(), self.path, datos))
+        if self.server.latencia:
+            time.sleep(self.server.latencia)
+        self._responder(200, {"ok": True, "result": {}})
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.peticiones += 1
+        if self.server.latencia:
+            time.sleep(self.server.latencia)
+        ruta = urlparse(self.path)
+        if ruta.path.startswith("/drug/label.json"):
+            if "desconocido" in ruta.query:
+                self._responder(404, {"error": {"code": "NOT_FOUND"}})
+            else:
+                self._responder(200, {"results": [ETIQUETA_FDA]})
+        else:
+            self._responder(404, {})
+
+
+class StubServer:
+    """Servidor en un hilo; `url` apunta a http://127.0.0.1:<puerto>.
+
+    Con guardar=True, `recibidos` anota cada POST como (hora de llegada, ruta, datos).
+    """
+
+    def __init__(self, latencia=0.0, guardar=False):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.lock = threading.Lock()
+        self.httpd.latencia = latencia
+        self.httpd.conexiones = 0
+        self.httpd.peticiones = 0
+        self.httpd.recibidos = [] if guardar else None
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def conexiones(self):
+        return self.httpd.conexiones
+
+    @property
+    def peticiones(self):
+        return self.httpd.peticiones
+
+    @property
+    def recibidos(self):
+        with self.httpd.lock:
+            return list(self.httpd.recibidos or [])
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
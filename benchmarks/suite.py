@@ -0,0 +1,293 @@
+"""Suite de rendimiento del webhook y de la entrega de recordatorios, con resultados en JSON.
+
+Levanta la app sobre una base de datos temporal, con Telegram y OpenFDA
+imitados por servidores locales (stubs.py) y un traductor local, y mide:
+
+- webhook: --chats chats recorren el diálogo completo de creación de un
+  recordatorio (pidiendo al final la información del medicamento) enviando
+  las actualizaciones a POST /telegram desde --clientes hilos. Latencia de
+  las respuestas, actualizaciones por segundo, tiempo hasta procesarlas todas
+  y sentencias SQL ejecutadas por actualización.
+- disparo: la primera dosis de cada recordatorio creado vence en el mismo
+  segundo; retraso desde su instante hasta que el stub de Telegram recibe el
+  mensaje, con el barredor de la app.
+- memoria: RSS máximo del proceso y memoria asignada por Python.
+
+Cada escenario se repite --rondas veces con chats nuevos; las latencias se
+acumulan y los rendimientos se resumen con la mediana. Con --salida se guarda
+el JSON (incluye el commit de git) y con --comparar se muestra la variación
+de cada métrica respecto a un JSON anterior, para seguir la evolución entre
+commits:
+
+    python benchmarks/suite.py --chats 200 --salida actual.json --comparar base.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+import requests
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, RAIZ)
+
+from stubs import StubServer
+
+DIALOGO = ["/start", "1. Establecer recordatorio", "ibuprofeno", "1 tableta", "8", "3", "08:00", "Sí"]
+TOKEN = "TOKEN"
+
+
+class ContadorSQL:
+    """Cuenta las sentencias que ejecutan todas las conexiones SQLite del proceso"""
+
+    def __init__(self):
+        self.total = 0
+        self._lock = threading.Lock()
+        self._connect = sqlite3.connect
+
+    def instalar(self):
+        def conectar(*args, **kwargs):
+            conn = self._connect(*args, **kwargs)
+            conn.set_trace_callback(self._contar)
+            return conn
+        sqlite3.connect = conectar
+
+    def _contar(self, sentencia):
+        with self._lock:
+            self.total += 1
+
+
+class TraductorLocal:
+    """Sustituye a googletrans: devuelve el texto sin traducir y sin salir a la red"""
+
+    class Resultado:
+        def __init__(self, text):
+            self.text = text
+
+    def translate(self, texto, src="en", dest="es"):
+        return self.Resultado(texto)
+
+
+def percentiles(valores):
+    valores = sorted(valores)
+    if not valores:
+        return {}
+
+    def p(n):
+        return valores[min(len(valores) - 1, int(len(valores) * n / 100))]
+    return {"p50": p(50), "p95": p(95), "p99": p(99), "max": valores[-1], "media": statistics.fmean(valores)}
+
+
+def memoria():
+    # ru_maxrss está en KiB en Linux
+    datos = {"rss_max_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    if tracemalloc.is_tracing():
+        actual, pico = tracemalloc.get_traced_memory()
+        datos.update(python_actual_kib=actual // 1024, python_pico_kib=pico // 1024)
+    return datos
+
+
+def commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def preparar_app(telegram_stub, fda_stub, workers):
+    """Importa la app apuntando a los stubs, sin límites de envío y con un servidor HTTP local"""
+    import app
+    from async_io import AsyncTelegramClient
+    from update_queue import UpdateDispatcher
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    # Sin los límites de la API real, para medir el coste propio del bot
+    app.telegram = AsyncTelegramClient(telegram_stub.url, loop=app.aio, max_concurrentes=200,
+                                       global_rate=0, chat_interval=0)
+    app.OPENFDA_URL = f"{fda_stub.url}/drug/label.json?search=openfda.substance_name:"
+    app.translator = TraductorLocal()
+    app.updates = UpdateDispatcher(app.handle_message, workers=workers)
+    servidor = make_server("127.0.0.1", 0, app.app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return app, servidor, f"http://127.0.0.1:{servidor.server_port}/telegram?token={TOKEN}"
+
+
+def escenario_webhook(app, url, contador, chats, clientes, primer_chat):
+    """Diálogo completo de `chats` chats repartidos entre `clientes` hilos, paso a paso"""
+    latencias = []
+    errores = []
+    lock = threading.Lock()
+    salida = threading.Barrier(clientes + 1)
+
+    def cliente(indice):
+        sesion = requests.Session()
+        propios = range(primer_chat + indice, primer_chat + chats, clientes)
+        salida.wait()
+        for paso, texto in enumerate(DIALOGO):
+            for chat in propios:
+                inicio = time.perf_counter()
+                respuesta = sesion.post(url, json={"update_id": chat * len(DIALOGO) + paso,
+                                                   "message": {"chat": {"id": chat, "first_name": "Bench"},
+                                                               "text": texto}})
+                duracion = time.perf_counter() - inicio
+                with lock:
+                    latencias.append(duracion)
+                    if respuesta.status_code != 200:
+                        errores.append(respuesta.status_code)
+
+    hilos = [threading.Thread(target=cliente, args=(i,)) for i in range(clientes)]
+    for h in hilos:
+        h.start()
+    consultas = contador.total
+    salida.wait()
+    inicio = time.perf_counter()
+    for h in hilos:
+        h.join()
+    respondido = time.perf_counter() - inicio
+    app.updates.wait_idle()
+    app.telegram.join()
+    procesado = time.perf_counter() - inicio
+    updates = chats * len(DIALOGO)
+    return {
+        "latencias": latencias,
+        "updates": updates,
+        "errores_http": len(errores),
+        "updates_por_segundo": updates / respondido,
+        "procesado_s": procesado,
+        "sql_por_update": (contador.total - consultas) / updates,
+    }
+
+
+def escenario_disparo(app, telegram_stub, chats, primer_chat, timeout=60):
+    """Adelanta la primera dosis de cada chat al mismo segundo y mide cuándo llega a Telegram"""
+    destinos = {str(c) for c in range(primer_chat, primer_chat + chats)}
+    primeras = [r["siguiente_dosis_id"] for chat in destinos for r in app.db.get_resumen_recordatorios(chat)]
+    instante = int(time.time()) + 2
+    app.db.guardar_instantes([(instante, dosis_id) for dosis_id in primeras])
+    ya_recibidos = len(telegram_stub.recibidos)
+
+    app.sweeper.wake()
+    llegadas = []
+    limite = time.time() + timeout
+    while time.time() < limite:
+        llegadas = [(hora, datos) for hora, ruta, datos in telegram_stub.recibidos[ya_recibidos:]
+                    if datos.get("chat_id") in destinos and "Recordatorio de Medicamento" in datos.get("text", "")]
+        if len(llegadas) >= len(primeras):
+            break
+        time.sleep(0.05)
+    return {
+        "retrasos": [hora - instante for hora, _ in llegadas],
+        "dosis": len(primeras),
+        "entregadas": len(llegadas),
+    }
+
+
+def ejecutar(chats=100, clientes=8, workers=8, rondas=1, trazar_memoria=False):
+    """Ejecuta la suite completa y devuelve el diccionario de resultados"""
+    if trazar_memoria:
+        tracemalloc.start()
+    contador = ContadorSQL()
+    contador.instalar()
+    with tempfile.TemporaryDirectory() as tmp, \
+            StubServer(guardar=True) as telegram_stub, StubServer() as fda_stub:
+        os.environ["DATABASE_PATH"] = os.path.join(tmp, "suite.db")
+        os.environ["TELEGRAM_API_URL"] = telegram_stub.url
+        app, servidor, url = preparar_app(telegram_stub, fda_stub, workers)
+        app.sweeper.start()
+
+        webhook = []
+        disparo = []
+        try:
+            for ronda in range(rondas):
+                primer_chat = 1 + ronda * chats
+                webhook.append(escenario_webhook(app, url, contador, chats, clientes, primer_chat))
+                disparo.append(escenario_disparo(app, telegram_stub, chats, primer_chat))
+        finally:
+            app.sweeper.stop()
+            servidor.shutdown()
+
+        return {
+            "commit": commit_actual(),
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "parametros": {"chats": chats, "clientes": clientes, "workers": workers, "rondas": rondas},
+            "webhook": {
+                "updates": sum(r["updates"] for r in webhook),
+                "errores_http": sum(r["errores_http"] for r in webhook),
+                "latencia_ms": {k: v * 1000 for k, v in
+                                percentiles([l for r in webhook for l in r["latencias"]]).items()},
+                "updates_por_segundo": statistics.median(r["updates_por_segundo"] for r in webhook),
+                "procesado_s": statistics.median(r["procesado_s"] for r in webhook),
+                "sql_por_update": statistics.median(r["sql_por_update"] for r in webhook),
+                "mensajes_telegram": app.telegram.stats()["enviados"],
+                "peticiones_openfda": fda_stub.peticiones,
+            },
+            "disparo": {
+                "dosis": sum(r["dosis"] for r in disparo),
+                "entregadas": sum(r["entregadas"] for r in disparo),
+                "retraso_ms": {k: v * 1000 for k, v in
+                               percentiles([x for r in disparo for x in r["retrasos"]]).items()},
+            },
+            "memoria": memoria(),
+        }
+
+
+def aplanar(resultados, prefijo=""):
+    """{"a": {"b": 1}} -> {"a.b": 1}, solo con los valores numéricos"""
+    planos = {}
+    for clave, valor in resultados.items():
+        if isinstance(valor, dict):
+            planos.update(aplanar(valor, f"{prefijo}{clave}."))
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            planos[f"{prefijo}{clave}"] = valor
+    return planos
+
+
+def comparar(anterior, actual):
+    """Líneas con la variación de cada métrica numérica común a los dos resultados"""
+    base, nuevo = aplanar(anterior), aplanar(actual)
+    lineas = [f"{'métrica':36s} {anterior.get('commit') or '-':>12s} {actual.get('commit') or '-':>12s}  variación"]
+    if anterior.get("parametros") != actual.get("parametros"):
+        lineas.insert(0, f"aviso: parámetros distintos {anterior.get('parametros')} -> {actual.get('parametros')}")
+    for clave in sorted(base.keys() & nuevo.keys()):
+        if clave.startswith("parametros."):
+            continue
+        variacion = (nuevo[clave] - base[clave]) / base[clave] * 100 if base[clave] else 0.0
+        lineas.append(f"{clave:36s} {base[clave]:12.2f} {nuevo[clave]:12.2f}  {variacion:+7.1f}%")
+    return lineas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--clientes", type=int, default=8, help="hilos que envían actualizaciones")
+    parser.add_argument("--workers", type=int, default=8, help="WEBHOOK_WORKERS de la app (0 = síncrono)")
+    parser.add_argument("--rondas", type=int, default=1)
+    parser.add_argument("--tracemalloc", action="store_true", help="mide también la memoria de Python (más lento)")
+    parser.add_argument("--salida", help="fichero JSON donde guardar los resultados")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior")
+    args = parser.parse_args()
+
+    resultados = ejecutar(args.chats, args.clientes, args.workers, args.rondas, args.tracemalloc)
+    texto = json.dumps(resultados, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    print(texto)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            print("\n".join(comparar(json.load(f), resultados)))
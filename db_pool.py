@@ -0,0 +1,131 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# PRAGMAs que se aplican a cada conexión nueva del pool. journal_mode es
+# persistente en el fichero; el resto son por conexión y se perdían en las
+# conexiones abiertas fuera del hilo principal.
+PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",  # en WAL solo se pierde durabilidad ante un corte de luz, no consistencia
+    "busy_timeout=5000",
+    "cache_size=-16000",  # 16 MiB de caché de páginas por conexión
+    "mmap_size=268435456",  # 256 MiB de lecturas mapeadas en memoria
+)
+
+
+class ConnectionPool:
+    """Pool acotado de conexiones SQLite compartidas entre hilos.
+
+    Como mucho `max_conexiones` conexiones abiertas a la vez; se crean bajo
+    demanda con los PRAGMAs de `pragmas` y se reutilizan en orden LIFO para
+    que la más reciente (con la caché caliente) sea la siguiente en salir. Si
+    no hay ninguna libre, `acquire` espera hasta `timeout` segundos y lanza
+    TimeoutError. Una conexión que se devuelve con una transacción abierta se
+    deshace antes de volver al pool.
+    """
+
+    def __init__(self, db_name, max_conexiones=16, timeout=30, pragmas=PRAGMAS):
+        self.db_name = db_name
+        self.max_conexiones = max_conexiones
+        self.timeout = timeout
+        self.pragmas = pragmas
+        self._libres = []
+        self._abiertas = 0
+        self._cond = threading.Condition()
+        self._metrics = {"creadas": 0, "prestamos": 0, "esperas": 0, "agotado": 0, "descartadas": 0}
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+
+    def conectar(self, factory=sqlite3.Connection):
+        """Abre una conexión con los PRAGMAs del pool (las del pool y las dedicadas, como la del escritor)"""
+        # Las conexiones pasan de un hilo a otro, pero nunca las usan dos a la vez
+        conn = sqlite3.connect(self.db_name, check_same_thread=False, factory=factory)
+        conn.row_factory = sqlite3.Row  # Para acceder a las columnas por nombre
+        for pragma in self.pragmas:
+            conn.execute(f"PRAGMA {pragma}")
+        return conn
+
+    def acquire(self, timeout=None):
+        """Saca una conexión del pool, abriendo una nueva si aún no se ha llegado al máximo"""
+        timeout = self.timeout if timeout is None else timeout
+        inicio = time.monotonic()
+        with self._cond:
+            esperado = False
+            while not self._libres and self._abiertas >= self.max_conexiones:
+                restante = inicio + timeout - time.monotonic()
+                if restante <= 0:
+                    self._metrics["agotado"] += 1
+                    raise TimeoutError(
+                        f"No hay conexiones libres tras {timeout}s ({self.max_conexiones} en uso)")
+                esperado = True
+                self._cond.wait(restante)
+            if esperado:
+                espera = time.monotonic() - inicio
+                self._metrics["esperas"] += 1
+                self._espera_total += espera
+                self._espera_max = max(self._espera_max, espera)
+            self._metrics["prestamos"] += 1
+            if self._libres:
+                return self._libres.pop()
+            self._abiertas += 1
+        try:
+            conn = self.conectar()
+        except Exception:
+            with self._cond:
+                self._abiertas -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._metrics["creadas"] += 1
+        return conn
+
+    def release(self, conn):
+        """Devuelve una conexión al pool; si no se puede deshacer su transacción, se cierra"""
+        descartar = False
+        if conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                descartar = True
+        with self._cond:
+            if descartar:
+                self._abiertas -= 1
+                self._metrics["descartadas"] += 1
+            else:
+                self._libres.append(conn)
+            self._cond.notify()
+        if descartar:
+            conn.close()
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        """Presta una conexión durante el bloque `with` y la devuelve al salir"""
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Cierra las conexiones libres; las prestadas se cierran o reutilizan al devolverse"""
+        with self._cond:
+            libres, self._libres = self._libres, []
+            self._abiertas -= len(libres)
+            self._cond.notify_all()
+        for conn in libres:
+            conn.close()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._metrics)
+            stats.update(
+                max_conexiones=self.max_conexiones,
+                abiertas=self._abiertas,
+                libres=len(self._libres),
+                en_uso=self._abiertas - len(self._libres),
+                espera_media=self._espera_total / stats["esperas"] if stats["esperas"] else 0.0,
+                espera_max=self._espera_max,
+            )
+        return stats
@@ -0,0 +1,366 @@
+import argparse
+import io
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+
+import requests
+
+from medication_cache import normalizar_nombre
+
+# Manifiesto de las descargas masivas de OpenFDA: lista las particiones de drug/label y su fecha de exportación
+MANIFIESTO_URL = "https://api.fda.gov/download.json"
+
+# Etiquetas por transacción al importar
+ETIQUETAS_POR_LOTE = 500
+
+ESQUEMA = [
+    '''CREATE TABLE IF NOT EXISTS Etiqueta (
+        etiqueta_id INTEGER PRIMARY KEY,
+        set_id TEXT NOT NULL UNIQUE,
+        version_id TEXT NOT NULL,
+        nombre TEXT,
+        ruta TEXT,
+        advertencias TEXT,
+        dosis TEXT,
+        indicaciones TEXT,
+        nombres_genericos TEXT,
+        sustancias TEXT
+    )''',
+    # Índice de contenido externo: el texto solo se guarda una vez, en Etiqueta
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS EtiquetaFTS USING fts5(
+        nombres_genericos, sustancias, ruta, advertencias, dosis, indicaciones,
+        content='Etiqueta', content_rowid='etiqueta_id', tokenize='unicode61 remove_diacritics 2'
+    )''',
+    '''CREATE TRIGGER IF NOT EXISTS etiqueta_insertada AFTER INSERT ON Etiqueta BEGIN
+        INSERT INTO EtiquetaFTS (rowid, nombres_genericos, sustancias, ruta, advertencias, dosis, indicaciones)
+        VALUES (new.etiqueta_id, new.nombres_genericos, new.sustancias, new.ruta,
+                new.advertencias, new.dosis, new.indicaciones);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS etiqueta_borrada AFTER DELETE ON Etiqueta BEGIN
+        INSERT INTO EtiquetaFTS (EtiquetaFTS, rowid, nombres_genericos, sustancias, ruta, advertencias, dosis,
+                                 indicaciones)
+        VALUES ('delete', old.etiqueta_id, old.nombres_genericos, old.sustancias, old.ruta,
+                old.advertencias, old.dosis, old.indicaciones);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS etiqueta_actualizada AFTER UPDATE ON Etiqueta BEGIN
+        INSERT INTO EtiquetaFTS (EtiquetaFTS, rowid, nombres_genericos, sustancias, ruta, advertencias, dosis,
+                                 indicaciones)
+        VALUES ('delete', old.etiqueta_id, old.nombres_genericos, old.sustancias, old.ruta,
+                old.advertencias, old.dosis, old.indicaciones);
+        INSERT INTO EtiquetaFTS (rowid, nombres_genericos, sustancias, ruta, advertencias, dosis, indicaciones)
+        VALUES (new.etiqueta_id, new.nombres_genericos, new.sustancias, new.ruta,
+                new.advertencias, new.dosis, new.indicaciones);
+    END''',
+    '''CREATE TABLE IF NOT EXISTS MetadatosIndice (
+        clave TEXT PRIMARY KEY,
+        valor TEXT
+    )''',
+]
+
+
+def campos_etiqueta(resultado):
+    """Campos de una etiqueta de OpenFDA que muestra el bot (los mismos en la API y en la descarga masiva)"""
+    warnings = resultado.get("warnings_and_cautions", resultado.get("warnings", ["No disponibles"]))
+    dosage_and_administration = resultado.get("dosage_and_administration", ["No disponible"])
+    indications = resultado.get("indications_and_usage", ["No disponibles"])
+    return {
+        "nombre": resultado.get("openfda", {}).get("generic_name", ["No disponible"])[0],
+        "ruta": resultado.get("openfda", {}).get("route", ["No disponible"])[0],
+        "advertencias": warnings[0] if warnings else "No disponibles",
+        "dosis": dosage_and_administration[0] if dosage_and_administration else "No disponible",
+        "indicaciones": indications[0] if indications else "No disponibles",
+    }
+
+
+def leer_resultados(texto, bloque=1 << 16):
+    """Genera uno a uno los objetos de la lista "results" de un JSON de OpenFDA.
+
+    `texto` es un fichero de texto (p. ej. el miembro de un zip envuelto en
+    TextIOWrapper) que se lee por bloques de `bloque` caracteres: en memoria
+    solo está el bloque actual y la etiqueta que se está decodificando, así
+    que una partición de cientos de MB no se carga entera.
+    """
+    decoder = json.JSONDecoder()
+    inicio_lista = re.compile(r'"results"\s*:\s*\[')
+    separadores = re.compile(r'[\s,]*')
+
+    buffer = ""
+    while True:
+        encontrado = inicio_lista.search(buffer)
+        if encontrado:
+            buffer = buffer[encontrado.end():]
+            break
+        datos = texto.read(bloque)
+        if not datos:
+            return
+        # Se conserva el final por si la clave quedó partida entre dos bloques
+        buffer = buffer[-32:] + datos
+
+    posicion = 0
+    while True:
+        posicion = separadores.match(buffer, posicion).end()
+        if posicion == len(buffer):
+            buffer, posicion = texto.read(bloque), 0
+            if not buffer:
+                raise ValueError("El JSON termina dentro de la lista de resultados")
+            continue
+        if buffer[posicion] == "]":
+            return
+        try:
+            objeto, posicion = decoder.raw_decode(buffer, posicion)
+        except json.JSONDecodeError:
+            # Etiqueta incompleta: se lee al menos tanto como hay pendiente para no decodificarla muchas veces
+            datos = texto.read(max(bloque, len(buffer) - posicion))
+            if not datos:
+                raise
+            buffer, posicion = buffer[posicion:] + datos, 0
+            continue
+        yield objeto
+        if posicion > bloque:
+            buffer, posicion = buffer[posicion:], 0
+
+
+def leer_zip(ruta, bloque=1 << 16):
+    """Etiquetas de un zip de la descarga masiva (drug-label-NNNN-of-NNNN.json.zip), descomprimidas al vuelo"""
+    with zipfile.ZipFile(ruta) as zf:
+        for nombre in zf.namelist():
+            if nombre.endswith(".json"):
+                with zf.open(nombre) as miembro:
+                    yield from leer_resultados(io.TextIOWrapper(miembro, encoding="utf-8"), bloque)
+
+
+class FDAIndex:
+    """Índice local (SQLite FTS5) de las etiquetas de medicamentos de OpenFDA.
+
+    Se llena con `importar` a partir de los zips de la descarga masiva, o con
+    `refrescar`, que los descarga solo si OpenFDA publicó una exportación
+    nueva y reescribe únicamente las etiquetas que cambiaron. `buscar` responde
+    como la consulta openfda.substance_name de la API, en milisegundos y sin
+    red; si el fichero del índice no existe, no encuentra nada y el bot
+    sigue usando la API.
+    """
+
+    def __init__(self, ruta="fda_index.db"):
+        self.ruta = ruta
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._contadores = {"aciertos": 0, "fallos": 0}
+        self._esquema_creado = False
+
+    @property
+    def conn(self):
+        if not hasattr(self._local, 'conn'):
+            conn = sqlite3.connect(self.ruta, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL;')
+            conn.execute('PRAGMA synchronous=NORMAL;')
+            self._local.conn = conn
+        return self._local.conn
+
+    def crear_esquema(self):
+        if not self._esquema_creado:
+            for sentencia in ESQUEMA:
+                self.conn.execute(sentencia)
+            self.conn.commit()
+            self._esquema_creado = True
+
+    def buscar(self, nombre):
+        """Campos de la etiqueta que mejor coincide con el nombre del principio activo, o None"""
+        termino = normalizar_nombre(nombre)
+        # Sin índice importado no se crea un fichero vacío: la búsqueda falla y se usa la API
+        if not termino or not os.path.exists(self.ruta):
+            self._contar("fallos")
+            return None
+        # Frase exacta en los nombres; bm25 prefiere los campos cortos ("IBUPROFEN" antes que una combinación)
+        consulta = '{nombres_genericos sustancias} : "%s"' % termino.replace('"', '""')
+        try:
+            fila = self.conn.execute('''
+            SELECT e.nombre, e.ruta, e.advertencias, e.dosis, e.indicaciones
+            FROM EtiquetaFTS JOIN Etiqueta e ON e.etiqueta_id = EtiquetaFTS.rowid
+            WHERE EtiquetaFTS MATCH ?
+            ORDER BY rank
+            LIMIT 1
+            ''', (consulta,)).fetchone()
+        except sqlite3.OperationalError:
+            # Índice a medio crear por el importador
+            fila = None
+        self._contar("aciertos" if fila else "fallos")
+        return dict(fila) if fila else None
+
+    def sustancias(self):
+        """Nombres distintos de principios activos del índice ([] si no hay índice)"""
+        if not os.path.exists(self.ruta):
+            return []
+        try:
+            filas = self.conn.execute('SELECT DISTINCT sustancias FROM Etiqueta').fetchall()
+        except sqlite3.OperationalError:
+            return []
+        return sorted({nombre for (valor,) in filas for nombre in (valor or "").split("; ") if nombre})
+
+    def importar(self, etiquetas, lote=ETIQUETAS_POR_LOTE):
+        """Inserta o actualiza etiquetas de OpenFDA; las que no cambiaron (mismo id de versión) no se tocan.
+
+        Devuelve {"etiquetas", "escritas", "sin_cambios", "segundos"}. Cada lote
+        se confirma por separado, así que las búsquedas siguen funcionando
+        mientras dura la importación.
+        """
+        self.crear_esquema()
+        conn = self.conn
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS EtiquetasVistas (set_id TEXT PRIMARY KEY)')
+        inicio = time.perf_counter()
+        total = escritas = 0
+        filas = []
+        for etiqueta in etiquetas:
+            filas.append(self._fila(etiqueta))
+            if len(filas) >= lote:
+                escritas += self._guardar(filas)
+                total += len(filas)
+                filas = []
+        if filas:
+            escritas += self._guardar(filas)
+            total += len(filas)
+        self._guardar_metadato("etiquetas", conn.execute('SELECT COUNT(*) FROM Etiqueta').fetchone()[0])
+        return {"etiquetas": total, "escritas": escritas, "sin_cambios": total - escritas,
+                "segundos": time.perf_counter() - inicio}
+
+    def importar_zips(self, rutas):
+        """Importa los zips indicados y compacta el índice al terminar"""
+        resultado = {"etiquetas": 0, "escritas": 0, "sin_cambios": 0, "segundos": 0.0}
+        for ruta in rutas:
+            for clave, valor in self.importar(leer_zip(ruta)).items():
+                resultado[clave] += valor
+        self.optimizar()
+        return resultado
+
+    def refrescar(self, manifiesto_url=MANIFIESTO_URL, forzar=False):
+        """Actualiza el índice con la última exportación de drug/label si cambió desde la anterior.
+
+        Las particiones se descargan a un fichero temporal (en streaming) y se
+        importan una a una; al terminar todas se borran las etiquetas que
+        OpenFDA ya no publica. Devuelve el resultado de la importación, o None
+        si la exportación es la misma que ya está importada.
+        """
+        self.crear_esquema()
+        manifiesto = requests.get(manifiesto_url, timeout=30)
+        manifiesto.raise_for_status()
+        etiquetas = manifiesto.json()["results"]["drug"]["label"]
+        if not forzar and etiquetas["export_date"] == self._metadato("export_date"):
+            return None
+
+        self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS EtiquetasVistas (set_id TEXT PRIMARY KEY)')
+        self.conn.execute('DELETE FROM EtiquetasVistas')
+        resultado = {"etiquetas": 0, "escritas": 0, "sin_cambios": 0, "segundos": 0.0}
+        with tempfile.TemporaryDirectory() as tmp:
+            for particion in etiquetas["partitions"]:
+                ruta = os.path.join(tmp, "particion.json.zip")
+                self._descargar(particion["file"], ruta)
+                for clave, valor in self.importar(leer_zip(ruta)).items():
+                    resultado[clave] += valor
+                os.remove(ruta)
+
+        # Solo tras importar todas las particiones: una descarga fallida no borra nada
+        borradas = self.conn.execute(
+            'DELETE FROM Etiqueta WHERE set_id NOT IN (SELECT set_id FROM EtiquetasVistas)').rowcount
+        self.conn.commit()
+        resultado["borradas"] = borradas
+        self._guardar_metadato("export_date", etiquetas["export_date"])
+        self._guardar_metadato("etiquetas", self.conn.execute('SELECT COUNT(*) FROM Etiqueta').fetchone()[0])
+        self.optimizar()
+        return resultado
+
+    def optimizar(self):
+        """Fusiona los segmentos del índice FTS5 (las búsquedas recorren menos b-trees)"""
+        self.conn.execute("INSERT INTO EtiquetaFTS (EtiquetaFTS) VALUES ('optimize')")
+        self.conn.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._contadores)
+        total = stats["aciertos"] + stats["fallos"]
+        stats["hit_rate"] = stats["aciertos"] / total if total else 0.0
+        if os.path.exists(self.ruta):
+            try:
+                stats["etiquetas"] = int(self._metadato("etiquetas") or 0)
+            except sqlite3.OperationalError:
+                pass
+        return stats
+
+    def close(self):
+        if hasattr(self._local, 'conn'):
+            self._local.conn.close()
+            del self._local.conn
+
+    # Internos
+    @staticmethod
+    def _fila(etiqueta):
+        openfda = etiqueta.get("openfda", {})
+        campos = campos_etiqueta(etiqueta)
+        set_id = etiqueta.get("set_id") or etiqueta["id"]
+        return (set_id, etiqueta.get("id") or set_id, campos["nombre"], campos["ruta"], campos["advertencias"],
+                campos["dosis"], campos["indicaciones"], "; ".join(openfda.get("generic_name", [])),
+                "; ".join(openfda.get("substance_name", [])))
+
+    def _guardar(self, filas):
+        """Escribe un lote en una transacción; devuelve cuántas etiquetas eran nuevas o cambiaron"""
+        conn = self.conn
+        # El WHERE del UPSERT deja intactas (y sin reindexar) las etiquetas con el mismo id de versión;
+        # rowcount solo cuenta las filas de Etiqueta escritas, no las que añaden los triggers al índice
+        escritas = conn.executemany('''
+        INSERT INTO Etiqueta (set_id, version_id, nombre, ruta, advertencias, dosis, indicaciones,
+                              nombres_genericos, sustancias)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (set_id) DO UPDATE SET
+            version_id = excluded.version_id, nombre = excluded.nombre, ruta = excluded.ruta,
+            advertencias = excluded.advertencias, dosis = excluded.dosis, indicaciones = excluded.indicaciones,
+            nombres_genericos = excluded.nombres_genericos, sustancias = excluded.sustancias
+        WHERE Etiqueta.version_id != excluded.version_id
+        ''', filas).rowcount
+        conn.executemany('INSERT OR IGNORE INTO EtiquetasVistas (set_id) VALUES (?)', [(f[0],) for f in filas])
+        conn.commit()
+        return escritas
+
+    def _metadato(self, clave):
+        fila = self.conn.execute('SELECT valor FROM MetadatosIndice WHERE clave = ?', (clave,)).fetchone()
+        return fila[0] if fila else None
+
+    def _guardar_metadato(self, clave, valor):
+        self.conn.execute('INSERT OR REPLACE INTO MetadatosIndice (clave, valor) VALUES (?, ?)', (clave, str(valor)))
+        self.conn.commit()
+
+    @staticmethod
+    def _descargar(url, ruta):
+        """Descarga a disco por bloques, sin tener el zip entero en memoria"""
+        with requests.get(url, stream=True, timeout=60) as respuesta:
+            respuesta.raise_for_status()
+            with open(ruta, "wb") as f:
+                for bloque in respuesta.iter_content(1 << 20):
+                    f.write(bloque)
+
+    def _contar(self, clave):
+        with self._lock:
+            self._contadores[clave] += 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importa las etiquetas de OpenFDA al índice local")
+    parser.add_argument("zips", nargs="*", help="zips de la descarga masiva (drug-label-*.json.zip)")
+    parser.add_argument("--indice", default=os.environ.get("FDA_INDEX_PATH", "fda_index.db"))
+    parser.add_argument("--refrescar", action="store_true",
+                        help="descarga la última exportación de OpenFDA si cambió desde la anterior")
+    parser.add_argument("--forzar", action="store_true", help="con --refrescar, aunque no haya cambiado")
+    args = parser.parse_args()
+
+    indice = FDAIndex(args.indice)
+    if args.refrescar:
+        resultado = indice.refrescar(forzar=args.forzar)
+        print(resultado if resultado is not None else "El índice ya tiene la última exportación")
+    elif args.zips:
+        print(indice.importar_zips(args.zips))
+    else:
+        parser.error("indica los zips a importar o --refrescar")
@@ -0,0 +1,145 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+
+class ConexionAgrupada(sqlite3.Connection):
+    """Conexión del escritor agrupado.
+
+    Los métodos de DatabaseManager confirman o deshacen cada escritura con
+    commit()/rollback(); aquí solo afectan a la operación en curso, que va en
+    su propio SAVEPOINT, y el escritor confirma el lote entero de una vez.
+    """
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.execute("ROLLBACK TO operacion")
+
+
+class GroupCommitWriter:
+    """Escritor único que agrupa las escrituras de muchos hilos en pocas transacciones.
+
+    `submit(funcion, *args)` encola la escritura y devuelve un Future. El hilo
+    escritor ejecuta las escrituras en orden de llegada, cada una en un
+    SAVEPOINT (si falla solo se deshace esa), y las confirma juntas con un
+    único commit: las que llegan mientras se escribe un lote, o en los
+    `intervalo` segundos siguientes a la primera, hasta `max_lote`. Los
+    Future se resuelven después del commit, así que un resultado siempre
+    corresponde a datos ya confirmados.
+    """
+
+    def __init__(self, conectar, intervalo=0.002, max_lote=500, al_iniciar=None):
+        self._conectar = conectar
+        self.intervalo = intervalo
+        self.max_lote = max_lote
+        self._al_iniciar = al_iniciar
+        self._cola = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._metrics = {"escrituras": 0, "lotes": 0, "errores": 0, "lote_max": 0}
+
+    def submit(self, funcion, *args, **kwargs):
+        """Encola `funcion(*args, **kwargs)` para el hilo escritor; devuelve un Future con su resultado"""
+        future = Future()
+        self._start()
+        self._cola.put((future, funcion, args, kwargs))
+        return future
+
+    def en_hilo_escritor(self):
+        return threading.current_thread() is self._thread
+
+    def stop(self):
+        """Termina de escribir lo encolado y detiene el hilo escritor"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._cola.put(None)
+            thread.join()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._metrics)
+        stats["lote_medio"] = stats["escrituras"] / stats["lotes"] if stats["lotes"] else 0.0
+        stats["pendientes"] = self._cola.qsize()
+        return stats
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="escritor-agrupado", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        conn = self._conectar()
+        if self._al_iniciar is not None:
+            self._al_iniciar(conn)
+        try:
+            while True:
+                lote, fin = self._siguiente_lote()
+                if lote:
+                    self._escribir(conn, lote)
+                if fin:
+                    return
+        finally:
+            conn.close()
+
+    def _siguiente_lote(self):
+        primera = self._cola.get()
+        if primera is None:
+            return [], True
+        lote = [primera]
+        limite = time.monotonic() + self.intervalo
+        while len(lote) < self.max_lote:
+            try:
+                siguiente = self._cola.get(timeout=max(limite - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if siguiente is None:
+                return lote, True
+            lote.append(siguiente)
+        return lote, False
+
+    def _escribir(self, conn, lote):
+        resultados = []
+        errores = 0
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error as e:
+            # Base de datos bloqueada por otro proceso más allá de busy_timeout: falla el lote entero
+            for future, _, _, _ in lote:
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(e)
+            with self._lock:
+                self._metrics["errores"] += len(lote)
+            return
+        for future, funcion, args, kwargs in lote:
+            if not future.set_running_or_notify_cancel():
+                continue
+            conn.execute("SAVEPOINT operacion")
+            try:
+                resultados.append((future, funcion(*args, **kwargs)))
+            except Exception as e:
+                conn.execute("ROLLBACK TO operacion")
+                future.set_exception(e)
+                errores += 1
+            conn.execute("RELEASE operacion")
+        try:
+            sqlite3.Connection.commit(conn)
+        except Exception as e:
+            sqlite3.Connection.rollback(conn)
+            for future, _ in resultados:
+                future.set_exception(e)
+            errores += len(resultados)
+            resultados = []
+        for future, resultado in resultados:
+            future.set_result(resultado)
+        with self._lock:
+            self._metrics["escrituras"] += len(lote)
+            self._metrics["lotes"] += 1
+            self._metrics["errores"] += errores
+            self._metrics["lote_max"] = max(self._metrics["lote_max"], len(lote))
@@ -0,0 +1,108 @@
+import json
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalizar_nombre(nombre):
+    """Clave de caché: minúsculas, sin tildes y con los espacios colapsados"""
+    texto = unicodedata.normalize("NFKD", str(nombre)).encode("ascii", "ignore").decode()
+    return " ".join(texto.lower().split())
+
+
+class LRUCache:
+    """Caché en memoria con expulsión LRU y caducidad por entrada"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            valor, caduca = entrada
+            if caduca < time.time():
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return valor
+
+    def set(self, clave, valor, ttl):
+        with self._lock:
+            self._datos[clave] = (valor, time.time() + ttl)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maxsize:
+                self._datos.popitem(last=False)
+
+    def delete(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def __len__(self):
+        return len(self._datos)
+
+
+class MedicationCache:
+    """Caché de dos niveles para las consultas a OpenFDA y su traducción.
+
+    El primer nivel es un LRU en memoria; el segundo, la tabla CacheMedicamento
+    de SQLite, que sobrevive a reinicios. Los "no encontrado" también se
+    guardan (caché negativa) con una caducidad más corta.
+    """
+
+    def __init__(self, db, maxsize=1024, ttl=7 * 24 * 3600, ttl_negativo=6 * 3600):
+        self.db = db
+        self.ttl = ttl
+        self.ttl_negativo = ttl_negativo
+        self.memoria = LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self._contadores = {"hits_memoria": 0, "hits_sqlite": 0, "misses": 0}
+
+    def get(self, nombre):
+        """Devuelve {"encontrado", "campos", "texto"} o None si no está en caché"""
+        clave = normalizar_nombre(nombre)
+        entrada = self.memoria.get(clave)
+        if entrada is not None:
+            self._contar("hits_memoria")
+            return entrada
+
+        fila = self.db.get_cache_medicamento(clave)
+        if fila is not None and fila["caduca"] >= time.time():
+            entrada = {
+                "encontrado": bool(fila["encontrado"]),
+                "campos": json.loads(fila["campos"]) if fila["campos"] else None,
+                "texto": fila["texto_es"],
+            }
+            self.memoria.set(clave, entrada, fila["caduca"] - time.time())
+            self._contar("hits_sqlite")
+            return entrada
+
+        self._contar("misses")
+        return None
+
+    def set(self, nombre, campos, texto):
+        """Guarda el resultado de una consulta; campos=None indica "no encontrado"."""
+        clave = normalizar_nombre(nombre)
+        encontrado = campos is not None
+        ttl = self.ttl if encontrado else self.ttl_negativo
+        entrada = {"encontrado": encontrado, "campos": campos, "texto": texto}
+        self.memoria.set(clave, entrada, ttl)
+        self.db.guardar_cache_medicamento(
+            clave, encontrado, json.dumps(campos) if encontrado else None, texto, time.time() + ttl
+        )
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._contadores)
+        total = sum(stats.values())
+        stats["hit_rate"] = (stats["hits_memoria"] + stats["hits_sqlite"]) / total if total else 0.0
+        stats["entradas_memoria"] = len(self.memoria)
+        return stats
+
+    def _contar(self, clave):
+        with self._lock:
+            self._contadores[clave] += 1
@@ -0,0 +1,197 @@
+import bisect
+import functools
+import re
+import threading
+import time
+from collections import deque
+
+# Límites superiores (segundos) de los tramos de los histogramas de latencia
+TRAMOS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histograma:
+    """Histograma de tramos fijos pensado para el camino caliente.
+
+    `observar` solo añade la muestra a una deque (append es atómico con el
+    GIL, sin lock); las muestras se reparten en los tramos al exportar o cuando
+    se acumulan más de `LIMITE_PENDIENTES`, así que cada muestra cuesta menos
+    de un microsegundo y la memoria está acotada.
+    """
+
+    LIMITE_PENDIENTES = 4096
+
+    __slots__ = ("tramos", "_cuentas", "_suma", "_pendientes", "_lock")
+
+    def __init__(self, tramos=TRAMOS):
+        self.tramos = tramos
+        self._cuentas = [0] * (len(tramos) + 1)  # el último tramo es +Inf
+        self._suma = 0.0
+        self._pendientes = deque()
+        self._lock = threading.Lock()
+
+    def observar(self, segundos):
+        self._pendientes.append(segundos)
+        # Reparte el hilo que supera el límite; si otro ya lo está haciendo, no espera
+        if len(self._pendientes) > self.LIMITE_PENDIENTES and self._lock.acquire(False):
+            try:
+                self._repartir()
+            finally:
+                self._lock.release()
+
+    def cronometro(self):
+        """Context manager que observa el tiempo que pasa dentro del bloque"""
+        return _Cronometro(self)
+
+    def valores(self):
+        """(cuentas por tramo, suma); las cuentas no son acumuladas"""
+        with self._lock:
+            self._repartir()
+            return list(self._cuentas), self._suma
+
+    def _repartir(self):
+        # Solo las muestras que hay ahora: las que lleguen mientras tanto esperan a la siguiente vez
+        for _ in range(len(self._pendientes)):
+            segundos = self._pendientes.popleft()
+            self._cuentas[bisect.bisect_left(self.tramos, segundos)] += 1
+            self._suma += segundos
+
+
+class _Cronometro:
+    __slots__ = ("histograma", "inicio")
+
+    def __init__(self, histograma):
+        self.histograma = histograma
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histograma.observar(time.perf_counter() - self.inicio)
+
+
+class Familia:
+    """Una métrica de latencia con un histograma por valor de su etiqueta (o uno solo sin etiqueta)"""
+
+    def __init__(self, nombre, ayuda, etiqueta=None, tramos=TRAMOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiqueta = etiqueta
+        self.tramos = tramos
+        self._hijos = {}
+        self._lock = threading.Lock()
+
+    def hijo(self, valor=None):
+        """Histograma del valor de la etiqueta; guárdalo si se usa en un camino caliente"""
+        hijo = self._hijos.get(valor)
+        if hijo is None:
+            with self._lock:
+                hijo = self._hijos.setdefault(valor, Histograma(self.tramos))
+        return hijo
+
+    def observar(self, segundos, valor=None):
+        self.hijo(valor).observar(segundos)
+
+    def cronometro(self, valor=None):
+        return _Cronometro(self.hijo(valor))
+
+    def cronometrar(self, funcion):
+        """Decorador: observa cada llamada, con el nombre de la función como etiqueta si la hay"""
+        hijo = self.hijo(funcion.__name__ if self.etiqueta else None)
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                hijo.observar(time.perf_counter() - inicio)
+        return envoltura
+
+    def exportar(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        for valor, hijo in sorted(self._hijos.items(), key=lambda par: str(par[0])):
+            cuentas, suma = hijo.valores()
+            etiquetas = f'{self.etiqueta}="{_escapar(valor)}",' if self.etiqueta else ""
+            acumulado = 0
+            for limite, cuenta in zip(self.tramos + (float("inf"),), cuentas):
+                acumulado += cuenta
+                lineas.append(f'{self.nombre}_bucket{{{etiquetas}le="{_numero(limite)}"}} {acumulado}')
+            etiquetas = f"{{{etiquetas.rstrip(',')}}}" if etiquetas else ""
+            lineas.append(f"{self.nombre}_sum{etiquetas} {_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{etiquetas} {acumulado}")
+        return lineas
+
+
+class Registro:
+    """Métricas del proceso en el formato de texto de Prometheus.
+
+    Las latencias se acumulan en histogramas al producirse; los tamaños de
+    colas, pools y cachés se leen de los `stats()` de cada componente solo
+    cuando se exportan, así que no cuestan nada entre dos lecturas de /metrics.
+    """
+
+    def __init__(self):
+        self._familias = []
+        self._estadisticas = []
+        self._lock = threading.Lock()
+
+    def histograma(self, nombre, ayuda, etiqueta=None, tramos=TRAMOS):
+        familia = Familia(nombre, ayuda, etiqueta, tramos)
+        with self._lock:
+            self._familias.append(familia)
+        return familia
+
+    def estadisticas(self, prefijo, funcion, ayuda=""):
+        """Exporta como gauges `prefijo_<clave>` los valores numéricos del dict que devuelve `funcion()`"""
+        with self._lock:
+            # Volver a registrar un prefijo sustituye la función (p. ej. al recrear un componente)
+            self._estadisticas = [e for e in self._estadisticas if e[0] != prefijo]
+            self._estadisticas.append((prefijo, funcion, ayuda))
+
+    def exportar(self):
+        with self._lock:
+            familias = list(self._familias)
+            estadisticas = list(self._estadisticas)
+        lineas = []
+        for familia in familias:
+            lineas.extend(familia.exportar())
+        for prefijo, funcion, ayuda in estadisticas:
+            try:
+                valores = funcion()
+            except Exception as e:
+                lineas.append(f"# {prefijo}: error al leer las estadísticas: {e!r}")
+                continue
+            for clave, valor in valores.items():
+                if isinstance(valor, (int, float)):
+                    nombre = f"{prefijo}_{re.sub(r'[^a-zA-Z0-9_]', '_', clave)}"
+                    if ayuda:
+                        lineas.append(f"# HELP {nombre} {ayuda}")
+                    lineas.append(f"# TYPE {nombre} gauge")
+                    lineas.append(f"{nombre} {_numero(valor)}")
+        return "\n".join(lineas) + "\n"
+
+
+def _numero(valor):
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(int(valor))
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# Registro del proceso y métricas del camino caliente
+REGISTRO = Registro()
+WEBHOOK = REGISTRO.histograma("bot_webhook_segundos", "Tiempo de respuesta de POST /telegram")
+PASO = REGISTRO.histograma("bot_paso_segundos", "Procesado de un mensaje según el paso de la conversación", "paso")
+DB = REGISTRO.histograma("bot_db_segundos", "Duración de cada método del repositorio", "metodo")
+OPENFDA = REGISTRO.histograma("bot_openfda_segundos", "Consultas a OpenFDA", "resultado")
+RESOLUCION = REGISTRO.histograma("bot_resolucion_nombre_segundos",
+                                 "Resolución local del nombre escrito al principio activo", "resultado")
+INDICE_FDA = REGISTRO.histograma("bot_indice_fda_segundos", "Búsquedas en el índice local de OpenFDA", "resultado")
+TRADUCCION = REGISTRO.histograma("bot_traduccion_segundos", "Traducciones de la información de un medicamento")
+TELEGRAM = REGISTRO.histograma("bot_telegram_segundos", "Peticiones a la API de Telegram", "resultado")
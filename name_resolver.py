@@ -0,0 +1,295 @@
+import re
+import threading
+import time
+from collections import Counter, namedtuple
+
+from medication_cache import normalizar_nombre
+
+# Nombres en español (sin tildes) -> denominación común internacional tal como aparece en
+# openfda.substance_name. Solo hace falta para los que no se escriben igual en inglés.
+SINONIMOS = {
+    "paracetamol": "ACETAMINOPHEN",
+    "acetaminofen": "ACETAMINOPHEN",
+    "ibuprofeno": "IBUPROFEN",
+    "aspirina": "ASPIRIN",
+    "acido acetilsalicilico": "ASPIRIN",
+    "naproxeno": "NAPROXEN",
+    "diclofenaco": "DICLOFENAC",
+    "dexketoprofeno": "DEXKETOPROFEN",
+    "ketoprofeno": "KETOPROFEN",
+    "metamizol": "METAMIZOLE",
+    "celecoxib": "CELECOXIB",
+    "tramadol": "TRAMADOL",
+    "codeina": "CODEINE",
+    "morfina": "MORPHINE",
+    "amoxicilina": "AMOXICILLIN",
+    "azitromicina": "AZITHROMYCIN",
+    "claritromicina": "CLARITHROMYCIN",
+    "ciprofloxacino": "CIPROFLOXACIN",
+    "levofloxacino": "LEVOFLOXACIN",
+    "doxiciclina": "DOXYCYCLINE",
+    "cefalexina": "CEPHALEXIN",
+    "penicilina": "PENICILLIN G",
+    "metronidazol": "METRONIDAZOLE",
+    "nitrofurantoina": "NITROFURANTOIN",
+    "fluconazol": "FLUCONAZOLE",
+    "aciclovir": "ACYCLOVIR",
+    "omeprazol": "OMEPRAZOLE",
+    "pantoprazol": "PANTOPRAZOLE",
+    "esomeprazol": "ESOMEPRAZOLE",
+    "lansoprazol": "LANSOPRAZOLE",
+    "ranitidina": "RANITIDINE",
+    "famotidina": "FAMOTIDINE",
+    "almagato": "ALMAGATE",
+    "loperamida": "LOPERAMIDE",
+    "metoclopramida": "METOCLOPRAMIDE",
+    "ondansetron": "ONDANSETRON",
+    "metformina": "METFORMIN",
+    "insulina": "INSULIN HUMAN",
+    "glibenclamida": "GLYBURIDE",
+    "sitagliptina": "SITAGLIPTIN",
+    "enalapril": "ENALAPRIL MALEATE",
+    "lisinopril": "LISINOPRIL",
+    "ramipril": "RAMIPRIL",
+    "losartan": "LOSARTAN POTASSIUM",
+    "valsartan": "VALSARTAN",
+    "amlodipino": "AMLODIPINE BESYLATE",
+    "nifedipino": "NIFEDIPINE",
+    "hidroclorotiazida": "HYDROCHLOROTHIAZIDE",
+    "furosemida": "FUROSEMIDE",
+    "espironolactona": "SPIRONOLACTONE",
+    "bisoprolol": "BISOPROLOL FUMARATE",
+    "atenolol": "ATENOLOL",
+    "metoprolol": "METOPROLOL TARTRATE",
+    "propranolol": "PROPRANOLOL HYDROCHLORIDE",
+    "atorvastatina": "ATORVASTATIN CALCIUM",
+    "simvastatina": "SIMVASTATIN",
+    "rosuvastatina": "ROSUVASTATIN CALCIUM",
+    "pravastatina": "PRAVASTATIN SODIUM",
+    "acenocumarol": "ACENOCOUMAROL",
+    "warfarina": "WARFARIN SODIUM",
+    "clopidogrel": "CLOPIDOGREL BISULFATE",
+    "apixaban": "APIXABAN",
+    "rivaroxaban": "RIVAROXABAN",
+    "digoxina": "DIGOXIN",
+    "levotiroxina": "LEVOTHYROXINE SODIUM",
+    "prednisona": "PREDNISONE",
+    "prednisolona": "PREDNISOLONE",
+    "dexametasona": "DEXAMETHASONE",
+    "hidrocortisona": "HYDROCORTISONE",
+    "salbutamol": "ALBUTEROL SULFATE",
+    "budesonida": "BUDESONIDE",
+    "montelukast": "MONTELUKAST SODIUM",
+    "loratadina": "LORATADINE",
+    "desloratadina": "DESLORATADINE",
+    "cetirizina": "CETIRIZINE HYDROCHLORIDE",
+    "ebastina": "EBASTINE",
+    "difenhidramina": "DIPHENHYDRAMINE HYDROCHLORIDE",
+    "dextrometorfano": "DEXTROMETHORPHAN HYDROBROMIDE",
+    "guaifenesina": "GUAIFENESIN",
+    "pseudoefedrina": "PSEUDOEPHEDRINE HYDROCHLORIDE",
+    "sertralina": "SERTRALINE HYDROCHLORIDE",
+    "fluoxetina": "FLUOXETINE HYDROCHLORIDE",
+    "paroxetina": "PAROXETINE HYDROCHLORIDE",
+    "escitalopram": "ESCITALOPRAM OXALATE",
+    "citalopram": "CITALOPRAM HYDROBROMIDE",
+    "venlafaxina": "VENLAFAXINE HYDROCHLORIDE",
+    "duloxetina": "DULOXETINE HYDROCHLORIDE",
+    "trazodona": "TRAZODONE HYDROCHLORIDE",
+    "mirtazapina": "MIRTAZAPINE",
+    "amitriptilina": "AMITRIPTYLINE HYDROCHLORIDE",
+    "lorazepam": "LORAZEPAM",
+    "diazepam": "DIAZEPAM",
+    "alprazolam": "ALPRAZOLAM",
+    "clonazepam": "CLONAZEPAM",
+    "zolpidem": "ZOLPIDEM TARTRATE",
+    "quetiapina": "QUETIAPINE FUMARATE",
+    "risperidona": "RISPERIDONE",
+    "olanzapina": "OLANZAPINE",
+    "haloperidol": "HALOPERIDOL",
+    "litio": "LITHIUM CARBONATE",
+    "gabapentina": "GABAPENTIN",
+    "pregabalina": "PREGABALIN",
+    "levetiracetam": "LEVETIRACETAM",
+    "carbamazepina": "CARBAMAZEPINE",
+    "acido valproico": "VALPROIC ACID",
+    "lamotrigina": "LAMOTRIGINE",
+    "levodopa": "LEVODOPA",
+    "donepezilo": "DONEPEZIL HYDROCHLORIDE",
+    "alopurinol": "ALLOPURINOL",
+    "colchicina": "COLCHICINE",
+    "tamsulosina": "TAMSULOSIN HYDROCHLORIDE",
+    "finasterida": "FINASTERIDE",
+    "sildenafilo": "SILDENAFIL CITRATE",
+    "acido folico": "FOLIC ACID",
+    "hierro": "FERROUS SULFATE",
+    "sulfato ferroso": "FERROUS SULFATE",
+    "vitamina d": "CHOLECALCIFEROL",
+    "colecalciferol": "CHOLECALCIFEROL",
+    "vitamina b12": "CYANOCOBALAMIN",
+    "calcio": "CALCIUM CARBONATE",
+    "magnesio": "MAGNESIUM OXIDE",
+    "lidocaina": "LIDOCAINE",
+    "clotrimazol": "CLOTRIMAZOLE",
+    "miconazol": "MICONAZOLE NITRATE",
+    "oxido de zinc": "ZINC OXIDE",
+    "clorhexidina": "CHLORHEXIDINE GLUCONATE",
+}
+
+# Palabras que acompañan al nombre pero no lo identifican ("amoxicilina 500 mg comprimidos")
+PALABRAS_IGNORADAS = {
+    "mg", "g", "gr", "mcg", "ug", "ml", "ui", "comprimido", "comprimidos", "tableta", "tabletas", "capsula",
+    "capsulas", "pastilla", "pastillas", "sobre", "sobres", "jarabe", "gotas", "crema", "pomada", "gel",
+    "suspension", "solucion", "inyectable", "forte", "retard", "efervescente", "de", "en",
+}
+_DOSIFICACION = re.compile(r"\b\d+(?:[.,]\d+)?(?:mg|g|mcg|ug|ml|ui|%)?\b|%")
+
+Candidato = namedtuple("Candidato", ["sustancia", "puntuacion", "termino"])
+
+
+def limpiar_consulta(texto):
+    """Nombre normalizado sin cantidades, unidades ni formas farmacéuticas"""
+    texto = _DOSIFICACION.sub(" ", normalizar_nombre(texto))
+    return " ".join(palabra for palabra in texto.split() if palabra not in PALABRAS_IGNORADAS)
+
+
+def trigramas(texto):
+    """Trigramas de cada palabra con relleno, como pg_trgm: "ab" -> {"  a", " ab", "ab "}"""
+    resultado = set()
+    for palabra in texto.split():
+        palabra = f"  {palabra} "
+        resultado.update(palabra[i:i + 3] for i in range(len(palabra) - 2))
+    return resultado
+
+
+def distancia_edicion(a, b, maximo):
+    """Inserciones, borrados, sustituciones y trasposiciones de letras contiguas para pasar de a a b.
+
+    Deja de calcular en cuanto se sabe que pasa de `maximo` y devuelve maximo + 1.
+    """
+    if abs(len(a) - len(b)) > maximo:
+        return maximo + 1
+    anterior, actual = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        antepenultima, anterior, actual = anterior, actual, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            coste = a[i - 1] != b[j - 1]
+            actual[j] = min(anterior[j] + 1, actual[j - 1] + 1, anterior[j - 1] + coste)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                actual[j] = min(actual[j], antepenultima[j - 2] + 1)
+        if min(actual) > maximo:
+            return maximo + 1
+    return actual[-1]
+
+
+class NameResolver:
+    """Resuelve lo que escribe el usuario al principio activo con el que busca OpenFDA.
+
+    El vocabulario son los nombres de SINONIMOS y las sustancias del índice
+    local de OpenFDA, si existe. Solo un nombre exacto del diccionario
+    sustituye a lo escrito (mejor). Si no está, un índice invertido de
+    trigramas da los términos que comparten más trigramas con la consulta;
+    se puntúan con el coeficiente de Dice y solo quedan los que están a
+    pocas ediciones de letra, así que una errata ("ibuprofno") tiene
+    candidato y un medicamento distinto de nombre parecido ("valacyclovir"
+    frente a "acyclovir") no. Aun así un candidato aproximado es solo una
+    sugerencia para que la confirme el usuario. Todo está en memoria y no
+    sale a la red.
+    """
+
+    def __init__(self, sustancias=(), sinonimos=None, umbral=0.7, max_ediciones=2):
+        self.umbral = umbral
+        self.max_ediciones = max_ediciones
+        self._terminos = []       # término normalizado
+        self._destinos = []       # sustancia a la que resuelve cada término
+        self._tamanos = []        # número de trigramas de cada término
+        self._exactos = {}
+        self._indice = {}
+        self._lock = threading.Lock()
+        self._contadores = {"exactos": 0, "aproximados": 0, "fallos": 0, "segundos": 0.0}
+        sinonimos = SINONIMOS if sinonimos is None else sinonimos
+        self.agregar(sinonimos)
+        # Los nombres en inglés también se resuelven a sí mismos
+        self.agregar({sustancia: sustancia for sustancia in list(sinonimos.values()) + list(sustancias)})
+
+    def agregar(self, terminos):
+        """Añade pares {término: sustancia} al vocabulario; el término también se indexa por trigramas"""
+        for termino, sustancia in terminos.items():
+            termino = limpiar_consulta(termino)
+            if not termino or termino in self._exactos:
+                continue
+            self._exactos[termino] = sustancia
+            posicion = len(self._terminos)
+            gramas = trigramas(termino)
+            self._terminos.append(termino)
+            self._destinos.append(sustancia)
+            self._tamanos.append(len(gramas))
+            for grama in gramas:
+                self._indice.setdefault(grama, []).append(posicion)
+
+    def resolver(self, texto, limite=3):
+        """Hasta `limite` Candidato(sustancia, puntuacion, termino), de mejor a peor; [] si ninguno supera el umbral"""
+        inicio = time.perf_counter()
+        consulta = limpiar_consulta(texto)
+        sustancia = self._exactos.get(consulta)
+        if sustancia is not None:
+            candidatos = [Candidato(sustancia, 1.0, consulta)]
+            resultado = "exactos"
+        else:
+            candidatos = self._aproximados(consulta, limite)
+            resultado = "aproximados" if candidatos else "fallos"
+        with self._lock:
+            self._contadores[resultado] += 1
+            self._contadores["segundos"] += time.perf_counter() - inicio
+        return candidatos
+
+    def mejor(self, texto):
+        """Sustancia si lo escrito es un nombre del vocabulario o un sinónimo, o None; nunca por parecido"""
+        candidatos = self.resolver(texto, limite=1)
+        if candidatos and candidatos[0].termino == limpiar_consulta(texto):
+            return candidatos[0].sustancia
+        return None
+
+    def sugerencia(self, texto):
+        """Término del vocabulario más parecido a lo escrito para preguntar "¿quisiste decir...?", o None"""
+        candidatos = self.resolver(texto, limite=1)
+        if candidatos and candidatos[0].termino != limpiar_consulta(texto):
+            return candidatos[0].termino
+        return None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._contadores)
+        consultas = stats["exactos"] + stats["aproximados"] + stats["fallos"]
+        stats["hit_rate"] = (stats["exactos"] + stats["aproximados"]) / consultas if consultas else 0.0
+        stats["latencia_media_us"] = stats.pop("segundos") / consultas * 1e6 if consultas else 0.0
+        stats["terminos"] = len(self._terminos)
+        return stats
+
+    def _aproximados(self, consulta, limite):
+        gramas = trigramas(consulta)
+        if not gramas:
+            return []
+        comunes = Counter()
+        for grama in gramas:
+            posiciones = self._indice.get(grama)
+            if posiciones:
+                comunes.update(posiciones)
+        # Dice: 2·|A∩B| / (|A| + |B|); un término solo puede superar el umbral si comparte bastantes trigramas
+        minimo = self.umbral * len(gramas) / 2
+        # Los nombres cortos admiten menos ediciones: "litio" a dos letras ya es otra palabra
+        ediciones = min(self.max_ediciones, len(consulta) // 4)
+        mejores = {}
+        for posicion, n in comunes.items():
+            if n < minimo:
+                continue
+            puntuacion = 2 * n / (len(gramas) + self._tamanos[posicion])
+            sustancia = self._destinos[posicion]
+            if puntuacion < self.umbral or puntuacion <= mejores.get(sustancia, (0.0,))[0]:
+                continue
+            # Compartir trigramas no basta: "desvenlafaxina" contiene "venlafaxina" entero y es otro medicamento
+            if distancia_edicion(consulta, self._terminos[posicion], ediciones) > ediciones:
+                continue
+            mejores[sustancia] = (puntuacion, self._terminos[posicion])
+        orden = sorted(mejores.items(), key=lambda par: (-par[1][0], par[0]))[:limite]
+        return [Candidato(sustancia, round(puntuacion, 3), termino) for sustancia, (puntuacion, termino) in orden]
@@ -0,0 +1,694 @@
+import itertools
+import threading
+from contextlib import contextmanager
+from threading import local
+
+from repository import (DOSIS_ENVIADA, DOSIS_OMITIDA, DOSIS_POR_RECORDATORIO, FilaDatosDosis, FilaDosis,
+                        FilaVencida, ReglaDosis, ReminderRepository, con_conexion, separar_dosis_id)
+
+try:
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.extras
+    import psycopg2.pool
+except ImportError:  # dependencia opcional: solo hace falta con DATABASE_URL=postgresql://...
+    psycopg2 = None
+
+# Mismo esquema que BBDD.py con tipos de PostgreSQL. Las dosis no se guardan una
+# a una: cada recordatorio lleva su regla y su cursor, y ExcepcionDosis las
+# omitidas y las enviadas fuera de orden (ver ReglaDosis).
+ESQUEMA = [
+    '''CREATE TABLE IF NOT EXISTS Usuario (
+        usuario_id BIGSERIAL PRIMARY KEY,
+        chat_id TEXT UNIQUE,
+        nombre TEXT,
+        telefono TEXT,
+        es_premium BOOLEAN NOT NULL DEFAULT FALSE
+    )''',
+    '''CREATE TABLE IF NOT EXISTS Recordatorio (
+        recordatorio_id BIGSERIAL PRIMARY KEY,
+        usuario_id BIGINT REFERENCES Usuario(usuario_id),
+        nombre_medicamento TEXT NOT NULL,
+        dosis TEXT NOT NULL,
+        frecuencia_horas INTEGER,
+        hora_inicio TEXT,
+        dosis_totales INTEGER,
+        activo BOOLEAN NOT NULL DEFAULT TRUE
+    )''',
+    # Columnas de la regla, también en las bases de datos creadas antes de que existieran
+    'ALTER TABLE Recordatorio ADD COLUMN IF NOT EXISTS minuto_inicio INTEGER',
+    'ALTER TABLE Recordatorio ADD COLUMN IF NOT EXISTS primer_instante BIGINT',
+    'ALTER TABLE Recordatorio ADD COLUMN IF NOT EXISTS intervalo INTEGER',
+    'ALTER TABLE Recordatorio ADD COLUMN IF NOT EXISTS siguiente_indice INTEGER NOT NULL DEFAULT 0',
+    'ALTER TABLE Recordatorio ADD COLUMN IF NOT EXISTS siguiente_instante BIGINT',
+    'ALTER TABLE Recordatorio ADD COLUMN IF NOT EXISTS adelantadas INTEGER NOT NULL DEFAULT 0',
+    'ALTER TABLE Recordatorio ADD COLUMN IF NOT EXISTS token TEXT',
+    '''CREATE TABLE IF NOT EXISTS ExcepcionDosis (
+        recordatorio_id BIGINT NOT NULL REFERENCES Recordatorio(recordatorio_id),
+        indice INTEGER NOT NULL,
+        estado SMALLINT NOT NULL,
+        PRIMARY KEY (recordatorio_id, indice)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS CuentaBancaria (
+        cuenta_id BIGSERIAL PRIMARY KEY,
+        usuario_id BIGINT NOT NULL REFERENCES Usuario(usuario_id),
+        numero_tarjeta TEXT NOT NULL,
+        titular TEXT NOT NULL,
+        fecha_vencimiento TEXT NOT NULL,
+        cvv TEXT NOT NULL,
+        fecha_registro TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        activa BOOLEAN NOT NULL DEFAULT TRUE,
+        UNIQUE (usuario_id, numero_tarjeta)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS CacheMedicamento (
+        clave TEXT PRIMARY KEY,
+        encontrado BOOLEAN NOT NULL,
+        campos TEXT,
+        texto_es TEXT,
+        caduca DOUBLE PRECISION NOT NULL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS MemoriaTraduccion (
+        hash TEXT PRIMARY KEY,
+        origen TEXT NOT NULL,
+        traduccion TEXT NOT NULL
+    )''',
+    '''CREATE INDEX IF NOT EXISTS idx_recordatorio_usuario_activo
+       ON Recordatorio (usuario_id, activo)''',
+    '''CREATE INDEX IF NOT EXISTS idx_cuenta_usuario_activa
+       ON CuentaBancaria (usuario_id, activa, fecha_registro)''',
+    # Índice parcial: el barredor busca los recordatorios cuya siguiente dosis ya venció
+    '''CREATE INDEX IF NOT EXISTS idx_recordatorio_siguiente_instante
+       ON Recordatorio (siguiente_instante) WHERE siguiente_instante IS NOT NULL''',
+]
+
+# Conversión de una tabla DosisProgramada anterior a las reglas (como la migración 3 de BBDD.py)
+CONVERSION_DOSIS = [
+    '''CREATE TEMP TABLE DosisMigradas ON COMMIT DROP AS
+       SELECT recordatorio_id, tomada, instante, hora_programada,
+              ROW_NUMBER() OVER (PARTITION BY recordatorio_id ORDER BY dosis_id) - 1 AS indice,
+              COUNT(*) OVER (PARTITION BY recordatorio_id) AS total
+       FROM DosisProgramada''',
+    'CREATE INDEX ON DosisMigradas (recordatorio_id, indice)',
+    '''UPDATE Recordatorio r SET
+           intervalo = r.frecuencia_horas * 3600,
+           dosis_totales = d.total,
+           minuto_inicio = split_part(d.hora_programada, ':', 1)::INTEGER * 60
+                           + split_part(d.hora_programada, ':', 2)::INTEGER
+       FROM DosisMigradas d
+       WHERE d.recordatorio_id = r.recordatorio_id AND d.indice = 0''',
+    '''UPDATE Recordatorio r SET
+           siguiente_indice = COALESCE((SELECT MIN(d.indice) FROM DosisMigradas d
+                                        WHERE d.recordatorio_id = r.recordatorio_id
+                                          AND d.tomada = 0), r.dosis_totales),
+           primer_instante = (SELECT d.instante - d.indice * r.intervalo FROM DosisMigradas d
+                              WHERE d.recordatorio_id = r.recordatorio_id AND d.instante IS NOT NULL
+                              ORDER BY d.tomada != 0, d.indice LIMIT 1)
+       WHERE r.intervalo IS NOT NULL''',
+    f'''INSERT INTO ExcepcionDosis (recordatorio_id, indice, estado)
+       SELECT d.recordatorio_id, d.indice, d.tomada FROM DosisMigradas d
+       JOIN Recordatorio r ON r.recordatorio_id = d.recordatorio_id
+       WHERE (d.indice < r.siguiente_indice AND d.tomada = {DOSIS_OMITIDA})
+          OR (d.indice > r.siguiente_indice AND d.tomada != 0)''',
+    '''UPDATE Recordatorio r SET
+           adelantadas = (SELECT COUNT(*) FROM ExcepcionDosis e
+                          WHERE e.recordatorio_id = r.recordatorio_id AND e.indice >= r.siguiente_indice),
+           siguiente_instante = CASE WHEN r.siguiente_indice < r.dosis_totales
+                                     THEN r.primer_instante + r.siguiente_indice * r.intervalo END
+       WHERE r.intervalo IS NOT NULL''',
+    'DROP TABLE DosisProgramada',
+]
+
+# Mismas expresiones sobre la regla de r que en BBDD.py
+COLUMNAS_REGLA = '''r.recordatorio_id, r.primer_instante, r.intervalo, r.minuto_inicio,
+       r.dosis_totales, r.siguiente_indice, r.adelantadas'''
+HAY_PENDIENTES = 'r.intervalo IS NOT NULL AND r.siguiente_indice < r.dosis_totales'
+DOSIS_RESTANTES = f'CASE WHEN {HAY_PENDIENTES} THEN r.dosis_totales - r.siguiente_indice - r.adelantadas ELSE 0 END'
+# mod() y no %: psycopg2 tomaría el % por un parámetro en las consultas que llevan alguno
+_MINUTO_SIGUIENTE = 'mod(r.minuto_inicio + r.siguiente_indice * (r.intervalo / 60), 1440)'
+PROXIMA_HORA = (f"CASE WHEN {HAY_PENDIENTES} THEN lpad(({_MINUTO_SIGUIENTE} / 60)::TEXT, 2, '0') || ':' || "
+                f"lpad(mod({_MINUTO_SIGUIENTE}, 60)::TEXT, 2, '0') END")
+SIGUIENTE_DOSIS_ID = (f'CASE WHEN {HAY_PENDIENTES} '
+                      f'THEN r.recordatorio_id * {DOSIS_POR_RECORDATORIO} + r.siguiente_indice END')
+
+
+class PostgresRepository(ReminderRepository):
+    """ReminderRepository sobre PostgreSQL, compartido por varios nodos del webhook.
+
+    Las conexiones salen de un ThreadedConnectionPool de psycopg2 acotado a
+    `max_conexiones` (si no hay ninguna libre, se espera hasta `timeout`
+    segundos). Las escrituras de muchas filas se envían al servidor en una
+    sola sentencia (execute_values / ANY(array)), y reclamar_dosis_vencidas
+    usa FOR UPDATE SKIP LOCKED sobre los recordatorios para que varios nodos
+    barran a la vez sin reclamar la misma dosis.
+    """
+
+    def __init__(self, dsn, max_conexiones=16, timeout=30):
+        if psycopg2 is None:
+            raise RuntimeError("PostgresRepository necesita psycopg2 (pip install psycopg2-binary)")
+        self.dsn = dsn
+        self.timeout = timeout
+        self._local = local()
+        self._huecos = threading.BoundedSemaphore(max_conexiones)
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
+            1, max_conexiones, dsn, cursor_factory=psycopg2.extras.DictCursor)
+        with self.conexion() as conn:
+            with conn.cursor() as cursor:
+                # Bloqueo por transacción para que dos nodos que arrancan a la vez no creen el esquema a la vez
+                cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', ('esquema-recordatorios',))
+                for sentencia in ESQUEMA:
+                    cursor.execute(sentencia)
+                cursor.execute("SELECT to_regclass('dosisprogramada') IS NOT NULL")
+                if cursor.fetchone()[0]:
+                    for sentencia in CONVERSION_DOSIS:
+                        cursor.execute(sentencia)
+            conn.commit()
+
+    @contextmanager
+    def conexion(self):
+        """Presta una conexión del pool al hilo actual durante el bloque `with` (reentrante)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+        if not self._huecos.acquire(timeout=self.timeout):
+            raise TimeoutError(f"No hay conexiones libres a PostgreSQL tras {self.timeout}s")
+        try:
+            conn = self._local.conn = self.pool.getconn()
+        except Exception:
+            self._huecos.release()
+            raise
+        try:
+            yield conn
+        finally:
+            del self._local.conn
+            if not conn.closed and conn.status != psycopg2.extensions.STATUS_READY:
+                conn.rollback()
+            self.pool.putconn(conn, close=bool(conn.closed))
+            self._huecos.release()
+
+    @property
+    def conn(self):
+        """Conexión prestada al hilo actual; solo existe dentro de `conexion()`"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            raise RuntimeError("PostgresRepository.conn solo se puede usar dentro de conexion()")
+        return conn
+
+    def close(self):
+        self.pool.closeall()
+
+    # Usuarios
+    @con_conexion
+    def add_usuario(self, chat_id, nombre=None, telefono=None):
+        with self.conn.cursor() as cursor:
+            cursor.execute('''
+            INSERT INTO Usuario (chat_id, nombre, telefono) VALUES (%s, %s, %s)
+            ON CONFLICT (chat_id) DO UPDATE SET
+                nombre = COALESCE(Usuario.nombre, EXCLUDED.nombre),
+                telefono = COALESCE(Usuario.telefono, EXCLUDED.telefono)
+            RETURNING usuario_id
+            ''', (chat_id, nombre, telefono))
+            usuario_id = cursor.fetchone()[0]
+        self.conn.commit()
+        return usuario_id
+
+    @con_conexion
+    def add_usuarios(self, usuarios):
+        try:
+            with self.conn.cursor() as cursor:
+                ids = self._upsert_usuarios(cursor, usuarios)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return [ids[str(u["chat_id"])] for u in usuarios]
+
+    def _upsert_usuarios(self, cursor, usuarios):
+        """UPSERT con execute_values; devuelve {chat_id: usuario_id} sin confirmar"""
+        filas = psycopg2.extras.execute_values(cursor, '''
+        INSERT INTO Usuario (chat_id, nombre, telefono) VALUES %s
+        ON CONFLICT (chat_id) DO UPDATE SET
+            nombre = COALESCE(Usuario.nombre, EXCLUDED.nombre),
+            telefono = COALESCE(Usuario.telefono, EXCLUDED.telefono)
+        RETURNING chat_id, usuario_id
+        ''', self._filas_usuarios(usuarios), page_size=1000, fetch=True)
+        return dict(filas)
+
+    @con_conexion
+    def get_usuario_id(self, chat_id):
+        with self.conn.cursor() as cursor:
+            cursor.execute('SELECT usuario_id FROM Usuario WHERE chat_id = %s', (chat_id,))
+            fila = cursor.fetchone()
+        return fila[0] if fila else None
+
+    @con_conexion
+    def es_usuario_premium(self, chat_id):
+        with self.conn.cursor() as cursor:
+            cursor.execute('SELECT es_premium FROM Usuario WHERE chat_id = %s', (chat_id,))
+            fila = cursor.fetchone()
+        return fila is not None and bool(fila['es_premium'])
+
+    @con_conexion
+    def get_datos_usuario(self, chat_id):
+        with self.conn.cursor() as cursor:
+            cursor.execute('''
+            SELECT u.usuario_id, u.es_premium,
+                   (SELECT COUNT(*) FROM Recordatorio r
+                    WHERE r.usuario_id = u.usuario_id AND r.activo) AS recordatorios_activos
+            FROM Usuario u
+            WHERE u.chat_id = %s
+            ''', (chat_id,))
+            return cursor.fetchone()
+
+    @con_conexion
+    def marcar_como_premium(self, chat_id):
+        with self.conn.cursor() as cursor:
+            cursor.execute('UPDATE Usuario SET es_premium = TRUE WHERE chat_id = %s', (chat_id,))
+        self.conn.commit()
+
+    # Recordatorios
+    @con_conexion
+    def add_recordatorio(self, chat_id, medicamento, dosis, frecuencia, hora_inicio, total_dosis, token=None):
+        with self.conn.cursor() as cursor:
+            cursor.execute('''
+            INSERT INTO Recordatorio (
+                usuario_id, nombre_medicamento, dosis, frecuencia_horas, hora_inicio, dosis_totales, token
+            ) VALUES ((SELECT usuario_id FROM Usuario WHERE chat_id = %s), %s, %s, %s, %s, %s, %s)
+            RETURNING recordatorio_id
+            ''', (chat_id, medicamento, dosis, frecuencia, hora_inicio, total_dosis, token))
+            recordatorio_id = cursor.fetchone()[0]
+        self.conn.commit()
+        return recordatorio_id
+
+    @con_conexion
+    def importar_tratamientos(self, tratamientos, desde=None):
+        """Crea en una sola transacción muchos recordatorios con la regla de sus dosis (ver DatabaseManager)"""
+        if not tratamientos:
+            return []
+        try:
+            with self.conn.cursor() as cursor:
+                usuarios = self._upsert_usuarios(cursor, tratamientos)
+
+                reglas = [self._regla_dosis(t["hora_inicio"], t["frecuencia"], t["total_dosis"], desde)
+                          for t in tratamientos]
+                # RETURNING devuelve los id en el orden de VALUES; page_size evita partir la sentencia
+                filas = psycopg2.extras.execute_values(cursor, '''
+                INSERT INTO Recordatorio (
+                    usuario_id, nombre_medicamento, dosis, frecuencia_horas, hora_inicio, dosis_totales,
+                    minuto_inicio, primer_instante, intervalo, siguiente_instante, token
+                ) VALUES %s RETURNING recordatorio_id
+                ''', [(usuarios[str(t["chat_id"])], t["medicamento"], t["dosis"], int(t["frecuencia"]),
+                       t["hora_inicio"], t["total_dosis"], minuto_inicio, primer_instante, intervalo,
+                       primer_instante if t["total_dosis"] else None, t.get("token"))
+                      for t, (minuto_inicio, primer_instante, intervalo) in zip(tratamientos, reglas)],
+                    page_size=max(len(tratamientos), 1), fetch=True)
+                recordatorio_ids = [fila[0] for fila in filas]
+            self.conn.commit()
+            return recordatorio_ids
+        except Exception as e:
+            self.conn.rollback()
+            raise ValueError(f"Error al importar tratamientos: {str(e)}")
+
+    @con_conexion
+    def get_recordatorios_activos(self, chat_id):
+        with self.conn.cursor() as cursor:
+            cursor.execute('''
+            SELECT r.recordatorio_id, r.nombre_medicamento, r.dosis,
+                   r.frecuencia_horas, r.hora_inicio, r.dosis_totales
+            FROM Recordatorio r
+            JOIN Usuario u ON r.usuario_id = u.usuario_id
+            WHERE u.chat_id = %s AND r.activo
+            ORDER BY r.recordatorio_id
+            ''', (chat_id,))
+            return cursor.fetchall()
+
+    @con_conexion
+    def get_resumen_recordatorios(self, chat_id):
+        """Recordatorios activos con sus dosis restantes y la próxima dosis en una sola consulta"""
+        with self.conn.cursor() as cursor:
+            cursor.execute(f'''
+            SELECT r.recordatorio_id, r.nombre_medicamento, r.dosis,
+                   r.frecuencia_horas, r.hora_inicio, r.dosis_totales,
+                   {DOSIS_RESTANTES} AS dosis_restantes,
+                   {SIGUIENTE_DOSIS_ID} AS siguiente_dosis_id,
+                   {PROXIMA_HORA} AS proxima_dosis
+            FROM Recordatorio r
+            JOIN Usuario u ON r.usuario_id = u.usuario_id
+            WHERE u.chat_id = %s AND r.activo
+            ORDER BY r.recordatorio_id
+            ''', (chat_id,))
+            return cursor.fetchall()
+
+    @con_conexion
+    def delete_recordatorio(self, recordatorio_id):
+        with self.conn.cursor() as cursor:
+            cursor.execute('DELETE FROM ExcepcionDosis WHERE recordatorio_id = %s', (recordatorio_id,))
+            cursor.execute('DELETE FROM Recordatorio WHERE recordatorio_id = %s', (recordatorio_id,))
+        self.conn.commit()
+
+    # Dosis
+    @con_conexion
+    def programar_dosis(self, recordatorio_id, hora_inicio, frecuencia, total_dosis, desde=None):
+        try:
+            minuto_inicio, primer_instante, intervalo = self._regla_dosis(hora_inicio, frecuencia, total_dosis, desde)
+            with self.conn.cursor() as cursor:
+                cursor.execute('DELETE FROM ExcepcionDosis WHERE recordatorio_id = %s', (recordatorio_id,))
+                cursor.execute('''
+                UPDATE Recordatorio SET
+                    dosis_totales = %s, minuto_inicio = %s, primer_instante = %s, intervalo = %s,
+                    siguiente_indice = 0, adelantadas = 0, siguiente_instante = %s
+                WHERE recordatorio_id = %s
+                ''', (total_dosis, minuto_inicio, primer_instante, intervalo,
+                      primer_instante if total_dosis else None, recordatorio_id))
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            raise ValueError(f"Error al programar dosis: {str(e)}")
+
+    @con_conexion
+    def delete_dosis(self, dosis_id):
+        self._marcar_y_guardar([dosis_id], DOSIS_OMITIDA)
+
+    @con_conexion
+    def marcar_dosis_tomada(self, dosis_id):
+        """Marca como enviada la dosis indicada; devuelve False si ya lo estaba o no existe"""
+        recordatorio_id, indice = separar_dosis_id(dosis_id)
+        with self.conn.cursor() as cursor:
+            # Lo habitual es marcar la dosis del cursor: basta un UPDATE por clave primaria que lo avance
+            cursor.execute('''
+            UPDATE Recordatorio SET
+                siguiente_indice = siguiente_indice + 1,
+                siguiente_instante = CASE WHEN siguiente_indice + 1 < dosis_totales
+                                          THEN primer_instante + (siguiente_indice + 1) * intervalo END
+            WHERE recordatorio_id = %s AND siguiente_indice = %s AND adelantadas = 0
+              AND intervalo IS NOT NULL AND siguiente_indice < dosis_totales
+            RETURNING recordatorio_id
+            ''', (recordatorio_id, indice))
+            marcada = cursor.fetchone() is not None
+        if marcada:
+            self.conn.commit()
+            return True
+        return bool(self._marcar_y_guardar([dosis_id], DOSIS_ENVIADA))
+
+    @con_conexion
+    def marcar_dosis_tomadas(self, dosis_ids):
+        """Marca como enviadas muchas dosis en una sola transacción; devuelve las que estaban pendientes"""
+        return self._marcar_y_guardar(dosis_ids, DOSIS_ENVIADA)
+
+    def _marcar_y_guardar(self, dosis_ids, estado):
+        # FOR UPDATE: la regla se lee y se reescribe sin que otro nodo la cambie entre medias
+        try:
+            dosis_ids = [int(dosis_id) for dosis_id in dosis_ids]
+            with self.conn.cursor() as cursor:
+                _, reglas = self._reglas(cursor, f'''
+                SELECT {COLUMNAS_REGLA} FROM Recordatorio r
+                WHERE r.recordatorio_id = ANY(%s) AND r.intervalo IS NOT NULL
+                FOR UPDATE
+                ''', (list(self._agrupar_dosis(dosis_ids)),))
+                marcadas = self._marcar_reglas(reglas, dosis_ids, estado)
+                self._guardar_reglas(cursor, reglas)
+            self.conn.commit()
+            return marcadas
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    @staticmethod
+    def _reglas(cursor, consulta, params=()):
+        """Como DatabaseManager._reglas: (filas, reglas) con las excepciones por delante del cursor"""
+        cursor.execute(consulta, params)
+        filas = cursor.fetchall()
+        excepciones = {}
+        con_excepciones = [fila["recordatorio_id"] for fila in filas if fila["adelantadas"]]
+        if con_excepciones:
+            cursor.execute('''
+            SELECT e.recordatorio_id, e.indice, e.estado
+            FROM ExcepcionDosis e JOIN Recordatorio r ON r.recordatorio_id = e.recordatorio_id
+            WHERE e.recordatorio_id = ANY(%s) AND e.indice >= r.siguiente_indice
+            ''', (con_excepciones,))
+            for recordatorio_id, indice, estado in cursor.fetchall():
+                excepciones.setdefault(recordatorio_id, {})[indice] = estado
+        return filas, [ReglaDosis.desde_fila(fila, excepciones.get(fila["recordatorio_id"])) for fila in filas]
+
+    @staticmethod
+    def _guardar_reglas(cursor, reglas):
+        """Escribe el cursor y las excepciones de las reglas que `marcar` cambió, sin confirmar"""
+        reglas = [regla for regla in reglas if regla.modificada]
+        psycopg2.extras.execute_values(cursor, '''
+        UPDATE Recordatorio r SET siguiente_indice = v.siguiente_indice,
+            siguiente_instante = v.siguiente_instante::BIGINT, adelantadas = v.adelantadas
+        FROM (VALUES %s) AS v (recordatorio_id, siguiente_indice, siguiente_instante, adelantadas)
+        WHERE r.recordatorio_id = v.recordatorio_id
+        ''', [(regla.recordatorio_id, regla.cursor, regla.siguiente_instante, len(regla.excepciones))
+              for regla in reglas], page_size=1000)
+        psycopg2.extras.execute_values(cursor, '''
+        INSERT INTO ExcepcionDosis (recordatorio_id, indice, estado) VALUES %s
+        ON CONFLICT (recordatorio_id, indice) DO UPDATE SET estado = EXCLUDED.estado
+        ''', [(regla.recordatorio_id, indice, estado) for regla in reglas for indice, estado in regla.nuevas],
+            page_size=1000)
+        psycopg2.extras.execute_values(cursor, '''
+        DELETE FROM ExcepcionDosis e USING (VALUES %s) AS v (recordatorio_id, indice)
+        WHERE e.recordatorio_id = v.recordatorio_id AND e.indice = v.indice
+        ''', [(regla.recordatorio_id, indice) for regla in reglas for indice in regla.borradas], page_size=1000)
+
+    @con_conexion
+    def get_dosis_restantes(self, recordatorio_id):
+        with self.conn.cursor() as cursor:
+            cursor.execute(f'SELECT {DOSIS_RESTANTES} FROM Recordatorio r WHERE r.recordatorio_id = %s',
+                           (recordatorio_id,))
+            fila = cursor.fetchone()
+        return fila[0] if fila else 0
+
+    @con_conexion
+    def get_siguiente_dosis(self, recordatorio_id):
+        with self.conn.cursor() as cursor:
+            cursor.execute(f'SELECT {PROXIMA_HORA} FROM Recordatorio r WHERE r.recordatorio_id = %s',
+                           (recordatorio_id,))
+            fila = cursor.fetchone()
+        return fila[0] if fila else None
+
+    @con_conexion
+    def get_dosis_pendientes(self, recordatorio_id=None, despues_de=None):
+        query = f'''
+        SELECT {COLUMNAS_REGLA} FROM Recordatorio r
+        WHERE {HAY_PENDIENTES} AND r.activo
+        '''
+        params = ()
+        if recordatorio_id is not None:
+            query += ' AND r.recordatorio_id = %s'
+            params += (recordatorio_id,)
+        query += ' ORDER BY r.recordatorio_id'
+        with self.conn.cursor() as cursor:
+            _, reglas = self._reglas(cursor, query, params)
+        return [FilaDosis((regla.dosis_id(i), regla.recordatorio_id, regla.hora(i), regla.instante(i)))
+                for regla in reglas for i in regla.pendientes_despues_de(despues_de)]
+
+    @con_conexion
+    def get_dosis_vencidas(self, hasta):
+        with self.conn.cursor() as cursor:
+            _, reglas = self._reglas(cursor, f'''
+            SELECT {COLUMNAS_REGLA} FROM Recordatorio r
+            WHERE r.siguiente_instante <= %s AND r.activo
+            ''', (hasta,))
+        return [FilaVencida((dosis_id, reglas[posicion].recordatorio_id, instante))
+                for instante, dosis_id, _, posicion in self._dosis_vencidas(reglas, hasta)]
+
+    @con_conexion
+    def omitir_dosis_vencidas(self, hasta, conservar_ultima=False):
+        try:
+            with self.conn.cursor() as cursor:
+                _, reglas = self._reglas(cursor, f'''
+                SELECT {COLUMNAS_REGLA} FROM Recordatorio r WHERE r.siguiente_instante <= %s
+                FOR UPDATE
+                ''', (hasta,))
+                omitidas = 0
+                for regla in reglas:
+                    indices = list(regla.vencidas(hasta))
+                    if conservar_ultima:
+                        indices = indices[:-1]
+                    omitidas += len(regla.marcar(indices, DOSIS_OMITIDA))
+                self._guardar_reglas(cursor, reglas)
+            self.conn.commit()
+            return omitidas
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    @con_conexion
+    def reclamar_dosis_vencidas(self, hasta, limite=5000, sin_token=True):
+        """Marca como enviadas, en una sola transacción, hasta `limite` dosis vencidas (ver DatabaseManager).
+
+        FOR UPDATE SKIP LOCKED bloquea los recordatorios elegidos y salta los
+        que otro nodo ya está reclamando, así que los barredores no se esperan
+        entre sí.
+        """
+        try:
+            with self.conn.cursor() as cursor:
+                filas, reglas = self._reglas(cursor, f'''
+                SELECT {COLUMNAS_REGLA}, u.chat_id, r.nombre_medicamento, r.dosis, r.token
+                FROM Recordatorio r
+                JOIN Usuario u ON r.usuario_id = u.usuario_id
+                WHERE r.siguiente_instante <= %s AND r.activo {'' if sin_token else 'AND r.token IS NOT NULL'}
+                ORDER BY r.siguiente_instante, r.recordatorio_id
+                LIMIT %s
+                FOR UPDATE OF r SKIP LOCKED
+                ''', (hasta, limite))
+                dosis = list(itertools.islice(self._dosis_vencidas(reglas, hasta), limite))
+                reclamadas = self._filas_reclamadas(filas, reglas, dosis)
+                self._marcar_reglas(reglas, [fila["dosis_id"] for fila in reclamadas], DOSIS_ENVIADA)
+                self._guardar_reglas(cursor, reglas)
+            self.conn.commit()
+            return reclamadas
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    @con_conexion
+    def get_siguiente_instante(self, despues_de):
+        with self.conn.cursor() as cursor:
+            cursor.execute('SELECT MIN(siguiente_instante) FROM Recordatorio WHERE siguiente_instante > %s',
+                           (despues_de,))
+            return cursor.fetchone()[0]
+
+    @con_conexion
+    def get_dosis_sin_instante(self):
+        with self.conn.cursor() as cursor:
+            _, reglas = self._reglas(cursor, f'''
+            SELECT {COLUMNAS_REGLA} FROM Recordatorio r
+            WHERE {HAY_PENDIENTES} AND r.primer_instante IS NULL
+            ORDER BY r.recordatorio_id
+            ''')
+        return [FilaDosis((regla.dosis_id(regla.cursor), regla.recordatorio_id, regla.hora(regla.cursor), None))
+                for regla in reglas]
+
+    @con_conexion
+    def guardar_instantes(self, instantes):
+        """Fecha de nuevo la regla de cada par (instante, dosis_id) en una sola sentencia"""
+        with self.conn.cursor() as cursor:
+            psycopg2.extras.execute_values(cursor, '''
+            UPDATE Recordatorio r SET
+                primer_instante = v.instante - v.indice * r.intervalo,
+                siguiente_instante = CASE WHEN r.siguiente_indice < r.dosis_totales
+                                          THEN v.instante + (r.siguiente_indice - v.indice) * r.intervalo END
+            FROM (VALUES %s) AS v (recordatorio_id, indice, instante)
+            WHERE r.recordatorio_id = v.recordatorio_id AND r.intervalo IS NOT NULL
+            ''', [separar_dosis_id(dosis_id) + (int(instante),) for instante, dosis_id in instantes],
+                page_size=1000)
+        self.conn.commit()
+
+    @con_conexion
+    def get_datos_dosis(self, dosis_id):
+        recordatorio_id, indice = separar_dosis_id(dosis_id)
+        with self.conn.cursor() as cursor:
+            filas, reglas = self._reglas(cursor, f'''
+            SELECT {COLUMNAS_REGLA}, u.chat_id, r.nombre_medicamento, r.dosis
+            FROM Recordatorio r
+            JOIN Usuario u ON r.usuario_id = u.usuario_id
+            WHERE r.recordatorio_id = %s AND r.activo AND r.intervalo IS NOT NULL
+            ''', (recordatorio_id,))
+        if not reglas or not reglas[0].pendiente(indice):
+            return None
+        fila, regla = filas[0], reglas[0]
+        siguiente = regla.siguiente(indice)
+        return FilaDatosDosis((fila["chat_id"], recordatorio_id, fila["nombre_medicamento"], fila["dosis"],
+                               regla.restantes - 1, regla.hora(siguiente) if siguiente is not None else None))
+
+    # Caché de consultas a OpenFDA
+    @con_conexion
+    def get_cache_medicamento(self, clave):
+        with self.conn.cursor() as cursor:
+            cursor.execute('SELECT encontrado, campos, texto_es, caduca FROM CacheMedicamento WHERE clave = %s',
+                           (clave,))
+            return cursor.fetchone()
+
+    @con_conexion
+    def guardar_cache_medicamento(self, clave, encontrado, campos, texto_es, caduca):
+        with self.conn.cursor() as cursor:
+            cursor.execute('''
+            INSERT INTO CacheMedicamento (clave, encontrado, campos, texto_es, caduca)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (clave) DO UPDATE SET encontrado = EXCLUDED.encontrado, campos = EXCLUDED.campos,
+                texto_es = EXCLUDED.texto_es, caduca = EXCLUDED.caduca
+            ''', (clave, bool(encontrado), campos, texto_es, caduca))
+        self.conn.commit()
+
+    # Memoria de traducción
+    @con_conexion
+    def get_traducciones(self, hashes):
+        with self.conn.cursor() as cursor:
+            cursor.execute('SELECT hash, traduccion FROM MemoriaTraduccion WHERE hash = ANY(%s)', (list(hashes),))
+            return dict(cursor.fetchall())
+
+    @con_conexion
+    def guardar_traducciones(self, filas):
+        with self.conn.cursor() as cursor:
+            psycopg2.extras.execute_values(cursor, '''
+            INSERT INTO MemoriaTraduccion (hash, origen, traduccion) VALUES %s
+            ON CONFLICT (hash) DO UPDATE SET traduccion = EXCLUDED.traduccion
+            ''', list(filas))
+        self.conn.commit()
+
+    # Cuentas bancarias
+    @con_conexion
+    def agregar_cuenta_bancaria(self, chat_id, numero_tarjeta, titular, fecha_vencimiento, cvv):
+        """Añade una nueva cuenta bancaria para un usuario"""
+        usuario_id = self.get_usuario_id(chat_id)
+        try:
+            numero_tarjeta_limpio = self._validar_cuenta(numero_tarjeta, titular, fecha_vencimiento, cvv)
+            with self.conn.cursor() as cursor:
+                cursor.execute('''
+                INSERT INTO CuentaBancaria (usuario_id, numero_tarjeta, titular, fecha_vencimiento, cvv)
+                VALUES (%s, %s, %s, %s, %s)
+                RETURNING cuenta_id
+                ''', (usuario_id, numero_tarjeta_limpio, titular, fecha_vencimiento, cvv))
+                cuenta_id = cursor.fetchone()[0]
+            self.conn.commit()
+            return cuenta_id
+        except psycopg2.IntegrityError:
+            self.conn.rollback()
+            raise ValueError("Esta tarjeta ya está registrada para este usuario")
+        except Exception as e:
+            self.conn.rollback()
+            raise ValueError(f"Error al agregar cuenta bancaria: {str(e)}")
+
+    @con_conexion
+    def obtener_cuentas_activas(self, usuario_id):
+        with self.conn.cursor() as cursor:
+            cursor.execute('''
+            SELECT cuenta_id, numero_tarjeta, titular, fecha_vencimiento
+            FROM CuentaBancaria
+            WHERE usuario_id = %s AND activa
+            ORDER BY fecha_registro DESC
+            ''', (usuario_id,))
+            return cursor.fetchall()
+
+    @con_conexion
+    def desactivar_cuenta(self, cuenta_id, usuario_id=None):
+        """Desactiva una cuenta bancaria (borrado lógico)"""
+        query = 'UPDATE CuentaBancaria SET activa = FALSE WHERE cuenta_id = %s'
+        params = (cuenta_id,)
+        if usuario_id:
+            query += ' AND usuario_id = %s'
+            params += (usuario_id,)
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute(query, params)
+                if cursor.rowcount == 0:
+                    raise ValueError("Cuenta no encontrada o no pertenece al usuario")
+            self.conn.commit()
+            return True
+        except Exception as e:
+            self.conn.rollback()
+            raise ValueError(f"Error al desactivar cuenta: {str(e)}")
+
+    @con_conexion
+    def obtener_ultima_cuenta_activa(self, usuario_id):
+        with self.conn.cursor() as cursor:
+            cursor.execute('''
+            SELECT cuenta_id, numero_tarjeta, titular, fecha_vencimiento
+            FROM CuentaBancaria
+            WHERE usuario_id = %s AND activa
+            ORDER BY fecha_registro DESC
+            LIMIT 1
+            ''', (usuario_id,))
+            return cursor.fetchone()
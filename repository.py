@@ -0,0 +1,432 @@
+import functools
+import heapq
+import math
+import re
+
+import metrics
+from scheduler import calcular_instantes
+
+# Estado de una dosis (ExcepcionDosis.estado guarda los dos últimos)
+DOSIS_PENDIENTE = 0
+DOSIS_ENVIADA = 1
+DOSIS_OMITIDA = 2  # vencida mientras el bot estaba parado y descartada al recuperar
+
+# Las dosis no se guardan una a una: la dosis i del recordatorio r tiene
+# dosis_id = r * DOSIS_POR_RECORDATORIO + i (ver ReglaDosis)
+DOSIS_POR_RECORDATORIO = 1_000_000
+
+
+def separar_dosis_id(dosis_id):
+    """(recordatorio_id, índice de la dosis dentro del recordatorio)"""
+    return divmod(int(dosis_id), DOSIS_POR_RECORDATORIO)
+
+
+def tipo_fila(*columnas):
+    """Tupla que se lee por posición o por nombre de columna, como las filas de la base de datos"""
+    posiciones = {columna: i for i, columna in enumerate(columnas)}
+
+    class Fila(tuple):
+        __slots__ = ()
+
+        def __getitem__(self, clave):
+            return tuple.__getitem__(self, posiciones[clave] if isinstance(clave, str) else clave)
+
+        def keys(self):
+            return list(columnas)
+    return Fila
+
+
+# Filas de las dosis generadas a partir de las reglas
+FilaDosis = tipo_fila("dosis_id", "recordatorio_id", "hora_programada", "instante")
+FilaVencida = tipo_fila("dosis_id", "recordatorio_id", "instante")
+FilaReclamada = tipo_fila("dosis_id", "recordatorio_id", "instante", "chat_id", "nombre_medicamento", "dosis",
+                          "dosis_restantes", "siguiente_dosis", "token")
+FilaDatosDosis = tipo_fila("chat_id", "recordatorio_id", "nombre_medicamento", "dosis", "dosis_restantes",
+                           "siguiente_dosis")
+
+
+class ReglaDosis:
+    """Dosis de un recordatorio generadas bajo demanda a partir de su regla.
+
+    La dosis i vence en primer_instante + i * intervalo y su hora "HH:MM" es
+    minuto_inicio más i intervalos, módulo 24 h. Las dosis anteriores al
+    cursor ya no están pendientes; de las demás, `excepciones` ({índice:
+    estado}) anota las enviadas u omitidas fuera de orden, y el cursor nunca se
+    queda sobre una de ellas. Las dosis restantes y la siguiente dosis salen
+    así de unas pocas operaciones en lugar de contar filas.
+
+    `marcar` cambia la regla en memoria y anota en `nuevas` y `borradas` las
+    filas de ExcepcionDosis que el repositorio debe escribir o borrar.
+    """
+
+    __slots__ = ("recordatorio_id", "primer_instante", "intervalo", "minuto_inicio", "total", "cursor",
+                 "excepciones", "nuevas", "borradas", "modificada")
+
+    def __init__(self, recordatorio_id, primer_instante, intervalo, minuto_inicio, total, cursor,
+                 excepciones=None):
+        self.recordatorio_id = recordatorio_id
+        self.primer_instante = primer_instante
+        self.intervalo = intervalo or 0
+        self.minuto_inicio = minuto_inicio or 0
+        # Sin intervalo el recordatorio aún no tiene dosis programadas
+        self.total = total if intervalo is not None else 0
+        self.cursor = cursor
+        self.excepciones = dict(excepciones or {})
+        self.nuevas = []
+        self.borradas = []
+        self.modificada = False
+
+    @classmethod
+    def desde_fila(cls, fila, excepciones=None):
+        return cls(fila["recordatorio_id"], fila["primer_instante"], fila["intervalo"], fila["minuto_inicio"],
+                   fila["dosis_totales"], fila["siguiente_indice"], excepciones)
+
+    def dosis_id(self, indice):
+        return self.recordatorio_id * DOSIS_POR_RECORDATORIO + indice
+
+    def instante(self, indice):
+        """Instante (epoch) de la dosis o None si la regla aún no tiene fecha (anterior a la migración 2)"""
+        return None if self.primer_instante is None else self.primer_instante + indice * self.intervalo
+
+    def hora(self, indice):
+        minutos = (self.minuto_inicio + indice * (self.intervalo // 60)) % 1440
+        return f"{minutos // 60:02d}:{minutos % 60:02d}"
+
+    @property
+    def restantes(self):
+        return self.total - self.cursor - len(self.excepciones)
+
+    @property
+    def siguiente_instante(self):
+        return self.instante(self.cursor) if self.cursor < self.total else None
+
+    def pendiente(self, indice):
+        return self.cursor <= indice < self.total and indice not in self.excepciones
+
+    def pendientes(self, desde=0, hasta=None):
+        """Índices de las dosis pendientes en [desde, hasta), generados uno a uno"""
+        fin = self.total if hasta is None else min(hasta, self.total)
+        for indice in range(max(desde, self.cursor), fin):
+            if indice not in self.excepciones:
+                yield indice
+
+    def pendientes_despues_de(self, instante=None):
+        """Dosis pendientes que vencen después de `instante` (todas si no hay instante o la regla no tiene fecha)"""
+        if instante is None or self.primer_instante is None:
+            return self.pendientes()
+        if self.intervalo <= 0:
+            return self.pendientes() if self.primer_instante > instante else iter(())
+        return self.pendientes(max(0, math.floor((instante - self.primer_instante) / self.intervalo) + 1))
+
+    def vencidas(self, hasta):
+        """Dosis pendientes que vencen hasta `hasta` (epoch) inclusive"""
+        if self.primer_instante is None or self.primer_instante > hasta:
+            return iter(())
+        if self.intervalo <= 0:
+            return self.pendientes()
+        return self.pendientes(hasta=math.floor((hasta - self.primer_instante) / self.intervalo) + 1)
+
+    def siguiente(self, indice):
+        """Índice de la primera dosis pendiente posterior a `indice`, o None"""
+        return next(self.pendientes(indice + 1), None)
+
+    def restantes_despues(self, indice):
+        """Dosis pendientes posteriores a `indice`"""
+        desde = max(indice + 1, self.cursor)
+        return max(0, self.total - desde) - sum(1 for i in self.excepciones if i >= desde)
+
+    def marcar(self, indices, estado):
+        """Marca con `estado` las dosis pendientes indicadas y avanza el cursor; devuelve los índices marcados"""
+        marcadas = []
+        for indice in indices:
+            if self.pendiente(indice):
+                self.excepciones[indice] = estado
+                marcadas.append(indice)
+        if not marcadas:
+            return marcadas
+        self.modificada = True
+        nuevas = set(marcadas)
+        while self.cursor < self.total and self.cursor in self.excepciones:
+            estado_cursor = self.excepciones.pop(self.cursor)
+            if self.cursor in nuevas:
+                nuevas.discard(self.cursor)
+                # Por debajo del cursor solo se anotan las omitidas: las demás se dan por enviadas
+                if estado_cursor != DOSIS_ENVIADA:
+                    self.nuevas.append((self.cursor, estado_cursor))
+            elif estado_cursor == DOSIS_ENVIADA:
+                self.borradas.append(self.cursor)
+            self.cursor += 1
+        self.nuevas.extend((indice, self.excepciones[indice]) for indice in sorted(nuevas))
+        return marcadas
+
+
+def con_conexion(metodo):
+    """Ejecuta el método con una conexión prestada por el pool al hilo actual (ver `conexion()`).
+
+    La duración de cada llamada se anota en metrics.DB con el nombre del método.
+    """
+    @functools.wraps(metodo)
+    def envoltura(self, *args, **kwargs):
+        with self.conexion():
+            return metodo(self, *args, **kwargs)
+    return metrics.DB.cronometrar(envoltura)
+
+
+class ReminderRepository:
+    """Interfaz del almacén de usuarios, recordatorios, dosis, caché de OpenFDA y cuentas.
+
+    DatabaseManager (BBDD.py) la implementa sobre un fichero SQLite local y
+    PostgresRepository (postgres_repository.py) sobre un servidor PostgreSQL
+    que pueden compartir varios nodos. Las filas devueltas se leen por nombre
+    de columna (fila["chat_id"]) o por posición.
+    """
+
+    # Usuarios
+    def add_usuario(self, chat_id, nombre=None, telefono=None):
+        """Crea el usuario si no existe y devuelve su usuario_id; rellena el nombre y teléfono que falten"""
+        raise NotImplementedError
+
+    def add_usuarios(self, usuarios):
+        """add_usuario para muchos {"chat_id", "nombre", "telefono"}; devuelve los usuario_id en el mismo orden"""
+        raise NotImplementedError
+
+    def get_usuario_id(self, chat_id):
+        raise NotImplementedError
+
+    def es_usuario_premium(self, chat_id):
+        raise NotImplementedError
+
+    def get_datos_usuario(self, chat_id):
+        """Fila (usuario_id, es_premium, recordatorios_activos) del usuario o None si no existe"""
+        raise NotImplementedError
+
+    def marcar_como_premium(self, chat_id):
+        raise NotImplementedError
+
+    # Recordatorios
+    def add_recordatorio(self, chat_id, medicamento, dosis, frecuencia, hora_inicio, total_dosis, token=None):
+        """`token` es el del bot por el que se creó: sus dosis se envían con él"""
+        raise NotImplementedError
+
+    def importar_tratamientos(self, tratamientos, desde=None):
+        raise NotImplementedError
+
+    def get_recordatorios_activos(self, chat_id):
+        raise NotImplementedError
+
+    def get_resumen_recordatorios(self, chat_id):
+        raise NotImplementedError
+
+    def delete_recordatorio(self, recordatorio_id):
+        raise NotImplementedError
+
+    # Dosis. Cada recordatorio guarda su regla y las dosis se generan al consultarlas (ver ReglaDosis)
+    def programar_dosis(self, recordatorio_id, hora_inicio, frecuencia, total_dosis, desde=None):
+        """Guarda la regla de las dosis del recordatorio, sustituyendo la anterior"""
+        raise NotImplementedError
+
+    def delete_dosis(self, dosis_id):
+        """Quita la dosis de las pendientes (queda como omitida)"""
+        raise NotImplementedError
+
+    def marcar_dosis_tomada(self, dosis_id):
+        raise NotImplementedError
+
+    def marcar_dosis_tomadas(self, dosis_ids):
+        raise NotImplementedError
+
+    def get_dosis_restantes(self, recordatorio_id):
+        raise NotImplementedError
+
+    def get_siguiente_dosis(self, recordatorio_id):
+        raise NotImplementedError
+
+    def get_dosis_pendientes(self, recordatorio_id=None, despues_de=None):
+        raise NotImplementedError
+
+    def get_dosis_vencidas(self, hasta):
+        raise NotImplementedError
+
+    def omitir_dosis_vencidas(self, hasta, conservar_ultima=False):
+        raise NotImplementedError
+
+    def reclamar_dosis_vencidas(self, hasta, limite=5000, sin_token=True):
+        """Con sin_token=False no se reclaman las dosis de recordatorios sin token del bot"""
+        raise NotImplementedError
+
+    def get_siguiente_instante(self, despues_de):
+        """Menor instante de la siguiente dosis de cada recordatorio posterior a `despues_de`, o None"""
+        raise NotImplementedError
+
+    def get_dosis_sin_instante(self):
+        """Siguiente dosis de cada recordatorio cuya regla aún no tiene fecha (anteriores a la migración 2)"""
+        raise NotImplementedError
+
+    def guardar_instantes(self, instantes):
+        """Pares (instante, dosis_id): fija el instante de la dosis y desplaza igual las demás de su recordatorio"""
+        raise NotImplementedError
+
+    def get_datos_dosis(self, dosis_id):
+        raise NotImplementedError
+
+    # Caché de consultas a OpenFDA
+    def get_cache_medicamento(self, clave):
+        raise NotImplementedError
+
+    def guardar_cache_medicamento(self, clave, encontrado, campos, texto_es, caduca):
+        raise NotImplementedError
+
+    # Memoria de traducción
+    def get_traducciones(self, hashes):
+        """{hash: traduccion} de los hashes que ya están en la memoria"""
+        raise NotImplementedError
+
+    def guardar_traducciones(self, filas):
+        """Filas (hash, origen, traduccion); sustituye las que ya existan"""
+        raise NotImplementedError
+
+    # Cuentas bancarias
+    def agregar_cuenta_bancaria(self, chat_id, numero_tarjeta, titular, fecha_vencimiento, cvv):
+        raise NotImplementedError
+
+    def obtener_cuentas_activas(self, usuario_id):
+        raise NotImplementedError
+
+    def desactivar_cuenta(self, cuenta_id, usuario_id=None):
+        raise NotImplementedError
+
+    def obtener_ultima_cuenta_activa(self, usuario_id):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    # Validación y cálculo comunes a todas las implementaciones
+    @staticmethod
+    def _regla_dosis(hora_inicio, frecuencia, total_dosis, desde=None):
+        """Valida los datos y devuelve la regla (minuto_inicio, primer_instante, intervalo).
+
+        La primera dosis cae en la próxima ocurrencia de su hora a partir de
+        `desde` (por defecto ahora) y las demás cada `frecuencia` horas exactas
+        (las horas "HH:MM" no distinguen una frecuencia de 24 h de dos dosis simultáneas).
+        """
+        # Validar que frecuencia sea un número
+        try:
+            frecuencia_num = int(frecuencia)
+        except (ValueError, TypeError):
+            raise ValueError("La frecuencia debe ser un número entero de horas")
+        # Con frecuencia 0 o negativa los instantes de las dosis no crecen, y _dosis_vencidas los necesita en orden
+        if frecuencia_num <= 0:
+            raise ValueError("La frecuencia debe ser de al menos una hora")
+
+        # Validar formato de hora
+        if not re.match(r"^([01]?[0-9]|2[0-3]):([0-5][0-9])$", str(hora_inicio)):
+            raise ValueError("Formato de hora inválido. Debe ser HH:MM")
+
+        if not 0 <= int(total_dosis) < DOSIS_POR_RECORDATORIO:
+            raise ValueError(f"El número de dosis debe estar entre 0 y {DOSIS_POR_RECORDATORIO - 1}")
+
+        hora, minuto = map(int, str(hora_inicio).split(":"))
+        primer_instante = int(calcular_instantes([str(hora_inicio)], desde)[0])
+        return hora * 60 + minuto, primer_instante, frecuencia_num * 3600
+
+    @staticmethod
+    def _agrupar_dosis(dosis_ids):
+        """{recordatorio_id: [índices]} de una lista de dosis_id"""
+        por_recordatorio = {}
+        for dosis_id in dosis_ids:
+            recordatorio_id, indice = separar_dosis_id(dosis_id)
+            por_recordatorio.setdefault(recordatorio_id, []).append(indice)
+        return por_recordatorio
+
+    @staticmethod
+    def _marcar_reglas(reglas, dosis_ids, estado):
+        """Marca las dosis indicadas en sus reglas ya cargadas; devuelve los dosis_id que estaban pendientes"""
+        por_recordatorio = ReminderRepository._agrupar_dosis(dosis_ids)
+        marcadas = set()
+        for regla in reglas:
+            marcadas.update(regla.dosis_id(i) for i in regla.marcar(por_recordatorio.get(regla.recordatorio_id, ()),
+                                                                    estado))
+        return [dosis_id for dosis_id in dict.fromkeys(dosis_ids) if dosis_id in marcadas]
+
+    @staticmethod
+    def _dosis_vencidas(reglas, hasta):
+        """Dosis vencidas de varias reglas como (instante, dosis_id, índice, posición de la regla).
+
+        Se generan bajo demanda en orden de (instante, dosis_id), mezclando las
+        de cada regla, así que tomar las primeras solo expande esas.
+        """
+        def vencidas(posicion, regla):
+            for indice in regla.vencidas(hasta):
+                yield regla.instante(indice), regla.dosis_id(indice), indice, posicion
+        return heapq.merge(*(vencidas(posicion, regla) for posicion, regla in enumerate(reglas)))
+
+    @staticmethod
+    def _filas_reclamadas(filas, reglas, dosis):
+        """FilaReclamada de cada dosis (instante, dosis_id, índice, posición) antes de marcarlas"""
+        resultado = []
+        for instante, dosis_id, indice, posicion in dosis:
+            fila, regla = filas[posicion], reglas[posicion]
+            siguiente = regla.siguiente(indice)
+            resultado.append(FilaReclamada((dosis_id, regla.recordatorio_id, instante, fila["chat_id"],
+                                            fila["nombre_medicamento"], fila["dosis"],
+                                            regla.restantes_despues(indice),
+                                            regla.hora(siguiente) if siguiente is not None else None,
+                                            fila["token"])))
+        return resultado
+
+    @staticmethod
+    def _filas_usuarios(usuarios):
+        """Filas (chat_id, nombre, telefono) sin chat_id repetidos.
+
+        Un mismo INSERT ... ON CONFLICT DO UPDATE no puede tocar dos veces la
+        misma fila; de los repetidos se toman el primer nombre y teléfono no nulos.
+        """
+        filas = {}
+        for u in usuarios:
+            chat_id = str(u["chat_id"])
+            nombre, telefono = filas.get(chat_id, (None, None))
+            filas[chat_id] = (nombre if nombre is not None else u.get("nombre"),
+                              telefono if telefono is not None else u.get("telefono"))
+        return [(chat_id, nombre, telefono) for chat_id, (nombre, telefono) in filas.items()]
+
+    @staticmethod
+    def _validar_cuenta(numero_tarjeta, titular, fecha_vencimiento, cvv):
+        """Valida los datos de una tarjeta y devuelve el número sin espacios"""
+        # Primero validamos los datos básicos
+        if not all([numero_tarjeta, titular, fecha_vencimiento, cvv]):
+            raise ValueError("Todos los campos son obligatorios")
+
+        # Validar formato de fecha (MM/YY)
+        if not re.match(r'^(0[1-9]|1[0-2])\/?([0-9]{2})$', fecha_vencimiento):
+            raise ValueError("Formato de fecha inválido. Use MM/AA")
+
+        # Validar CVV (3 o 4 dígitos)
+        if not re.match(r'^[0-9]{3,4}$', cvv):
+            raise ValueError("CVV debe tener 3 o 4 dígitos")
+
+        # Limpiar número de tarjeta (eliminar espacios)
+        numero_tarjeta_limpio = numero_tarjeta.replace(" ", "")
+
+        # Validar número de tarjeta (solo dígitos, longitud válida)
+        if not numero_tarjeta_limpio.isdigit() or len(numero_tarjeta_limpio) not in (15, 16):
+            raise ValueError("Número de tarjeta inválido")
+        return numero_tarjeta_limpio
+
+
+def crear_repositorio(database_url=None, database_path="database.db", max_conexiones=16, group_commit=False):
+    """Crea el repositorio indicado por DATABASE_URL.
+
+    postgresql://... (o postgres://...) usa PostgreSQL; sin URL, el fichero
+    SQLite `database_path`. El group commit solo existe con SQLite.
+    """
+    # Importaciones diferidas: BBDD importa este módulo y psycopg2 es opcional
+    if not database_url:
+        from BBDD import DatabaseManager
+        return DatabaseManager(database_path, max_conexiones=max_conexiones, group_commit=group_commit)
+    if database_url.startswith(("postgresql://", "postgres://")):
+        if group_commit:
+            raise ValueError("El group commit solo está disponible con SQLite")
+        from postgres_repository import PostgresRepository
+        return PostgresRepository(database_url, max_conexiones=max_conexiones)
+    raise ValueError(f"Base de datos desconocida: {database_url}")
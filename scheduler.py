@@ -0,0 +1,169 @@
+import bisect
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+def calcular_instantes(horas, desde=None):
+    """Convierte una secuencia de horas "HH:MM" en instantes absolutos (epoch).
+
+    Cada dosis se coloca en la primera ocurrencia de su hora posterior a la
+    dosis anterior, de modo que un tratamiento que cruza la medianoche o dura
+    varios días no dispara todas sus dosis el mismo día.
+    """
+    referencia = desde or datetime.now()
+    instantes = []
+    for hora_texto in horas:
+        hour, minute = map(int, hora_texto.split(":"))
+        instante = referencia.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        while instante < referencia:
+            instante += timedelta(days=1)
+        instantes.append(instante.timestamp())
+        referencia = instante
+    return instantes
+
+
+# Límites superiores (segundos) de los tramos del histograma de retraso de disparo
+TRAMOS_RETRASO = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30, 60, float("inf"))
+
+
+class HistogramaRetraso:
+    """Retraso de disparo (hora real de entrega - hora programada) por tramos"""
+
+    def __init__(self, tramos=TRAMOS_RETRASO):
+        self.tramos = tramos
+        self._lock = threading.Lock()
+        self._cuentas = [0] * len(tramos)
+        self._total = 0.0
+        self._max = 0.0
+
+    def registrar(self, *retrasos):
+        with self._lock:
+            for retraso in retrasos:
+                retraso = max(retraso, 0.0)
+                self._cuentas[bisect.bisect_left(self.tramos, retraso)] += 1
+                self._total += retraso
+                self._max = max(self._max, retraso)
+
+    def stats(self):
+        with self._lock:
+            disparadas = sum(self._cuentas)
+            return {
+                "disparadas": disparadas,
+                "retraso_medio": self._total / disparadas if disparadas else 0.0,
+                "retraso_max": self._max,
+                "retraso_histograma": dict(zip(self.tramos, self._cuentas)),
+            }
+
+
+class DoseSweeper:
+    """Barredor de dosis vencidas por lotes sobre SQLite.
+
+    Un único hilo duerme hasta el instante de la siguiente dosis pendiente
+    (el mínimo de Recordatorio.siguiente_instante, con su índice parcial), reclama en una sola
+    transacción todas las dosis vencidas, en lotes de `max_lote`, y se las
+    entrega en bloque a `entregar(filas)`. Cada fila lleva el token del bot de
+    su recordatorio; con `reclamar_sin_token=False` (no hay token por defecto
+    con el que enviarlas) las de recordatorios sin token no se reclaman y
+    siguen pendientes. No guarda nada en memoria:
+    `wake` lo despierta cuando se crea o se borra un recordatorio y, por si otro
+    proceso programa dosis, nunca duerme más de `espera_max` segundos.
+
+    El hilo arranca con `start` (o con el primer `wake`), y antes de la primera
+    pasada ejecuta `al_iniciar` (p. ej. la recuperación de las dosis que
+    vencieron con el bot parado). Tras un fork el hilo no existe en el hijo:
+    `reanudar_tras_fork` lo vuelve a arrancar si estaba en marcha.
+    """
+
+    def __init__(self, db, entregar, max_lote=5000, espera_max=60, al_iniciar=None, reclamar_sin_token=True):
+        self.db = db
+        self._entregar = entregar
+        self.max_lote = max_lote
+        self.espera_max = espera_max
+        self._al_iniciar = al_iniciar
+        self.reclamar_sin_token = reclamar_sin_token
+        self._cond = threading.Condition()
+        self._despertar = False
+        self._thread = None
+        self._running = False
+        self._retrasos = HistogramaRetraso()
+        self._lotes = 0
+
+    def wake(self):
+        """Vuelve a barrer y recalcula la siguiente dosis"""
+        with self._cond:
+            self._despertar = True
+            self._cond.notify()
+        self.start()
+
+    def sweep(self, ahora=None):
+        """Entrega todas las dosis vencidas hasta `ahora`; devuelve cuántas"""
+        total = 0
+        while True:
+            ahora_lote = time.time() if ahora is None else ahora
+            filas = self.db.reclamar_dosis_vencidas(ahora_lote, self.max_lote, self.reclamar_sin_token)
+            if not filas:
+                return total
+            self._retrasos.registrar(*(ahora_lote - fila["instante"] for fila in filas))
+            self._lotes += 1
+            total += len(filas)
+            try:
+                self._entregar(filas)
+            except Exception as e:
+                print(f"Error al entregar un lote de {len(filas)} dosis: {e}")
+            if len(filas) < self.max_lote:
+                return total
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="barredor-dosis", daemon=True)
+            self._thread.start()
+
+    def reanudar_tras_fork(self):
+        """En el proceso hijo de un fork (p. ej. gunicorn --preload) arranca un hilo nuevo si lo había"""
+        estaba_en_marcha = self._running
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._despertar = False
+        if estaba_en_marcha:
+            self.start()
+
+    def stop(self, wait=True):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None and wait:
+            self._thread.join()
+
+    def stats(self):
+        return {"lotes": self._lotes, **self._retrasos.stats()}
+
+    def _run(self):
+        if self._al_iniciar is not None:
+            try:
+                self._al_iniciar()
+            except Exception as e:
+                print(f"Error al preparar las dosis pendientes: {e}")
+        while True:
+            try:
+                self.sweep()
+                siguiente = self.db.get_siguiente_instante(time.time())
+            except Exception as e:
+                print(f"Error al barrer las dosis vencidas: {e}")
+                siguiente = None
+            with self._cond:
+                limite = time.time() + self.espera_max
+                if siguiente is not None:
+                    limite = min(limite, siguiente)
+                while self._running and not self._despertar:
+                    espera = limite - time.time()
+                    if espera <= 0:
+                        break
+                    self._cond.wait(espera)
+                if not self._running:
+                    return
+                self._despertar = False
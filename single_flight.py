@@ -0,0 +1,54 @@
+import asyncio
+
+
+class SingleFlight:
+    """Agrupa las llamadas concurrentes con la misma clave en una sola ejecución.
+
+    La primera llamada con una clave lanza la corrutina como tarea del bucle;
+    las que llegan mientras sigue en curso esperan esa misma tarea y reciben
+    su resultado o su excepción. Al terminar la clave se libera, así que la
+    siguiente llamada vuelve a ejecutar (los resultados los guarda la caché,
+    no esta clase). Todo ocurre en el bucle de asyncio, sin locks; entre
+    procesos no se agrupa nada.
+
+    `timeout` limita lo que espera cada llamada, no la tarea compartida: si
+    una llamada se cansa las demás siguen esperando el mismo resultado.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self._en_curso = {}
+        self._metrics = {"llamadas": 0, "ejecuciones": 0, "compartidas": 0, "timeouts": 0, "errores": 0}
+
+    async def ejecutar(self, clave, fabrica, timeout=None):
+        """Devuelve el resultado de `await fabrica()`, compartido con las llamadas concurrentes de `clave`"""
+        self._metrics["llamadas"] += 1
+        tarea = self._en_curso.get(clave)
+        if tarea is None:
+            self._metrics["ejecuciones"] += 1
+            tarea = asyncio.ensure_future(fabrica())
+            self._en_curso[clave] = tarea
+            tarea.add_done_callback(lambda t: self._terminar(clave, t))
+        else:
+            self._metrics["compartidas"] += 1
+        try:
+            # shield: cancelar o agotar la espera de una llamada no cancela la tarea de las demás
+            return await asyncio.wait_for(asyncio.shield(tarea), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self._metrics["timeouts"] += 1
+            raise
+
+    def _terminar(self, clave, tarea):
+        if self._en_curso.get(clave) is tarea:
+            del self._en_curso[clave]
+        # Se recupera siempre la excepción para que asyncio no avise aunque nadie la espere ya
+        if not tarea.cancelled() and tarea.exception() is not None:
+            self._metrics["errores"] += 1
+
+    def en_curso(self, clave):
+        return clave in self._en_curso
+
+    def stats(self):
+        llamadas = self._metrics["llamadas"]
+        return dict(self._metrics, en_curso=len(self._en_curso),
+                    compartidas_ratio=round(self._metrics["compartidas"] / llamadas, 3) if llamadas else 0.0)
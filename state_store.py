@@ -0,0 +1,129 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from db_pool import ConnectionPool
+
+
+class StateStore:
+    """Interfaz del almacén del estado de conversación de cada chat.
+
+    Los estados son diccionarios serializables a JSON. `get` devuelve None si
+    el chat no tiene estado (o ha caducado por inactividad).
+    """
+
+    def get(self, chat_id):
+        raise NotImplementedError
+
+    def set(self, chat_id, state):
+        raise NotImplementedError
+
+    def delete(self, chat_id):
+        raise NotImplementedError
+
+
+class MemoryStateStore(StateStore):
+    """Estados en memoria del proceso con expulsión LRU y caducidad por inactividad"""
+
+    def __init__(self, maxsize=10000, idle_ttl=24 * 3600):
+        self.maxsize = maxsize
+        self.idle_ttl = idle_ttl
+        self._estados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chat_id):
+        with self._lock:
+            entrada = self._estados.get(str(chat_id))
+            if entrada is None:
+                return None
+            state, actualizado = entrada
+            if time.time() - actualizado > self.idle_ttl:
+                del self._estados[str(chat_id)]
+                return None
+            self._estados.move_to_end(str(chat_id))
+            # Copia para que los cambios solo se vean al hacer set(), como en SQLite
+            return json.loads(json.dumps(state))
+
+    def set(self, chat_id, state):
+        with self._lock:
+            self._estados[str(chat_id)] = (json.loads(json.dumps(state)), time.time())
+            self._estados.move_to_end(str(chat_id))
+            while len(self._estados) > self.maxsize:
+                self._estados.popitem(last=False)
+
+    def delete(self, chat_id):
+        with self._lock:
+            self._estados.pop(str(chat_id), None)
+
+    def __len__(self):
+        return len(self._estados)
+
+
+class SQLiteStateStore(StateStore):
+    """Estados en una tabla SQLite en modo WAL, compartida entre procesos.
+
+    Cada operación toma prestada una conexión de un ConnectionPool acotado a
+    `max_conexiones`, como DatabaseManager: los hilos del despachador no
+    abren cada uno la suya, y `close` cierra todas las del pool.
+    """
+
+    def __init__(self, db_name="database.db", idle_ttl=24 * 3600, purge_every=1000, max_conexiones=4):
+        self.db_name = db_name
+        self.idle_ttl = idle_ttl
+        self.purge_every = purge_every
+        self.pool = ConnectionPool(db_name, max_conexiones=max_conexiones)
+        self._lock = threading.Lock()
+        self._escrituras = 0
+        with self.pool.checkout() as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS EstadoConversacion (
+                chat_id TEXT PRIMARY KEY,
+                estado TEXT NOT NULL,
+                actualizado REAL NOT NULL
+            )''')
+            conn.commit()
+
+    def get(self, chat_id):
+        with self.pool.checkout() as conn:
+            fila = conn.execute(
+                'SELECT estado FROM EstadoConversacion WHERE chat_id = ? AND actualizado >= ?',
+                (str(chat_id), time.time() - self.idle_ttl)
+            ).fetchone()
+        return json.loads(fila[0]) if fila else None
+
+    def set(self, chat_id, state):
+        with self.pool.checkout() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO EstadoConversacion (chat_id, estado, actualizado) VALUES (?, ?, ?)',
+                (str(chat_id), json.dumps(state), time.time())
+            )
+            conn.commit()
+        with self._lock:
+            self._escrituras += 1
+            purgar = self._escrituras % self.purge_every == 0
+        if purgar:
+            self.purgar()
+
+    def delete(self, chat_id):
+        with self.pool.checkout() as conn:
+            conn.execute('DELETE FROM EstadoConversacion WHERE chat_id = ?', (str(chat_id),))
+            conn.commit()
+
+    def purgar(self):
+        """Borra los estados inactivos durante más de idle_ttl"""
+        with self.pool.checkout() as conn:
+            conn.execute('DELETE FROM EstadoConversacion WHERE actualizado < ?', (time.time() - self.idle_ttl,))
+            conn.commit()
+
+    def close(self):
+        self.pool.close()
+
+
+def crear_state_store(backend, db_name="database.db", max_conexiones=4):
+    """Crea el almacén indicado por STATE_STORE: "sqlite" o "memory" """
+    if backend == "memory":
+        return MemoryStateStore()
+    if backend == "sqlite":
+        return SQLiteStateStore(db_name, max_conexiones=max_conexiones)
+    raise ValueError(f"Almacén de estados desconocido: {backend}")
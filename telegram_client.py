@@ -0,0 +1,225 @@
+import queue
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# Límites publicados por Telegram para bots
+GLOBAL_RATE = 30        # mensajes por segundo en total
+CHAT_INTERVAL = 1.0     # segundos entre mensajes al mismo chat
+
+
+class RateLimiter:
+    """Reserva huecos de envío respetando un límite global y otro por chat.
+
+    `reservar` devuelve cuántos segundos hay que esperar antes de enviar; el
+    hueco queda reservado, así que varios hilos pueden llamarlo a la vez.
+    Un valor de 0 en cualquiera de los límites lo desactiva.
+    """
+
+    def __init__(self, global_rate=GLOBAL_RATE, chat_interval=CHAT_INTERVAL):
+        self.global_interval = 1.0 / global_rate if global_rate else 0.0
+        self.chat_interval = chat_interval
+        self._lock = threading.Lock()
+        self._siguiente_global = 0.0
+        self._siguiente_chat = {}
+
+    def reservar(self, chat_id=None):
+        with self._lock:
+            ahora = time.monotonic()
+            instante = max(ahora, self._siguiente_global)
+            self._siguiente_global = instante + self.global_interval
+            if chat_id is not None and self.chat_interval:
+                instante = max(instante, self._siguiente_chat.get(chat_id, 0.0))
+                self._siguiente_chat[chat_id] = instante + self.chat_interval
+                if len(self._siguiente_chat) > 10000:
+                    # Olvidar los chats cuyo hueco ya pasó para no crecer sin límite
+                    self._siguiente_chat = {c: t for c, t in self._siguiente_chat.items() if t > ahora}
+            return instante - ahora
+
+
+class ClienteTelegramBase:
+    """Lo común a los clientes síncrono y asíncrono de Telegram.
+
+    Construye las peticiones y decide qué hacer con cada respuesta (aceptada,
+    429 con `retry_after`, error del cliente sin reintento, 5xx o fallo de red
+    con backoff) y lleva las métricas; cada cliente solo hace la petición
+    HTTP y la espera con su propia E/S.
+    """
+
+    def __init__(self, base_url, global_rate, chat_interval, max_retries, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.limiter = RateLimiter(global_rate, chat_interval)
+        self._lock = threading.Lock()
+        self._metrics = {"enviados": 0, "fallidos": 0, "reintentos": 0, "limitados": 0, "latencia_total": 0.0}
+        self._inicio = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        transcurrido = time.monotonic() - self._inicio
+        metrics["pendientes"] = self._pendientes_en_cola()
+        metrics["mensajes_por_segundo"] = metrics["enviados"] / transcurrido if transcurrido else 0.0
+        metrics["latencia_media"] = (metrics.pop("latencia_total") / metrics["enviados"]
+                                     if metrics["enviados"] else 0.0)
+        return metrics
+
+    def _pendientes_en_cola(self):
+        raise NotImplementedError
+
+    def _url(self, token, method):
+        return f"{self.base_url}/bot{token}/{method}"
+
+    @staticmethod
+    def _payload(chat_id, text, reply_markup, parse_mode):
+        payload = {"chat_id": chat_id, "text": text, "parse_mode": parse_mode}
+        if reply_markup is not None:
+            payload["reply_markup"] = reply_markup
+        return payload
+
+    def _contar(self, clave, valor=1):
+        with self._lock:
+            self._metrics[clave] += valor
+
+    def _procesar_respuesta(self, response, inicio, intento, max_retries):
+        """Registra la respuesta del intento (None si falló la red) y decide el siguiente paso.
+
+        Devuelve (resultado, espera): con resultado True o False el envío ha
+        terminado; con None hay que reintentar tras `espera` segundos.
+        """
+        metrics.TELEGRAM.observar(time.monotonic() - inicio,
+                                  str(response.status_code) if response is not None else "error_red")
+        espera = None
+        if response is not None and response.status_code == 200:
+            with self._lock:
+                self._metrics["enviados"] += 1
+                self._metrics["latencia_total"] += time.monotonic() - inicio
+            try:
+                return bool(response.json().get("ok", False)), None
+            except ValueError:
+                return False, None
+
+        if response is not None and response.status_code == 429:
+            self._contar("limitados")
+            try:
+                espera = response.json().get("parameters", {}).get("retry_after")
+            except ValueError:
+                pass
+        elif response is not None and response.status_code < 500:
+            # Errores del cliente (token inválido, chat inexistente...): no se reintentan
+            intento = max_retries
+
+        if intento >= max_retries:
+            self._contar("fallidos")
+            return False, None
+        self._contar("reintentos")
+        if espera is None:
+            espera = min(30, 0.5 * 2 ** intento) * (0.5 + random.random() / 2)
+        return None, espera
+
+    @staticmethod
+    def _avisar_fallo(chat_id, error=None):
+        print(f"Error al enviar el mensaje a {chat_id}" + (f": {error}" if error is not None else ""))
+
+
+class TelegramClient(ClienteTelegramBase):
+    """Cliente HTTP de Telegram con conexiones persistentes y cola de envíos.
+
+    `send` envía de forma síncrona (respuestas del menú) y `enqueue` deja el
+    mensaje en una cola que vacían `workers` hilos, respetando los límites de
+    Telegram y reintentando los 429/5xx con backoff.
+    """
+
+    def __init__(self, base_url="https://api.telegram.org", workers=4,
+                 global_rate=GLOBAL_RATE, chat_interval=CHAT_INTERVAL,
+                 max_retries=5, timeout=10):
+        super().__init__(base_url, global_rate, chat_interval, max_retries, timeout)
+        self.workers = workers
+
+        # Una sola sesión compartida: urllib3 reutiliza las conexiones TCP+TLS
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(workers, 10))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._queue = queue.Queue()
+        self._threads = []
+
+    # API pública
+    def send(self, token, chat_id, text, reply_markup=None, parse_mode="Markdown", max_retries=2):
+        """Envía un mensaje y devuelve True si Telegram lo aceptó"""
+        # Las respuestas interactivas solo respetan el límite global
+        espera = self.limiter.reservar()
+        if espera > 0:
+            time.sleep(espera)
+        return self._post(token, "sendMessage", self._payload(chat_id, text, reply_markup, parse_mode), max_retries)
+
+    def enqueue(self, token, chat_id, text, reply_markup=None, parse_mode="Markdown"):
+        """Encola un mensaje para enviarlo en segundo plano"""
+        self._start()
+        self._queue.put((token, chat_id, text, reply_markup, parse_mode))
+
+    def enqueue_many(self, mensajes):
+        """Encola una lista de tuplas (token, chat_id, text)"""
+        self._start()
+        for token, chat_id, text in mensajes:
+            self._queue.put((token, chat_id, text, None, "Markdown"))
+
+    def join(self):
+        """Espera a que la cola de envíos se vacíe"""
+        self._queue.join()
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    # Internos
+    def _pendientes_en_cola(self):
+        return self._queue.qsize()
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"telegram-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                token, chat_id, text, reply_markup, parse_mode = item
+                espera = self.limiter.reservar(chat_id)
+                if espera > 0:
+                    time.sleep(espera)
+                payload = self._payload(chat_id, text, reply_markup, parse_mode)
+                if not self._post(token, "sendMessage", payload, self.max_retries):
+                    self._avisar_fallo(chat_id)
+            finally:
+                self._queue.task_done()
+
+    def _post(self, token, method, payload, max_retries):
+        url = self._url(token, method)
+        for intento in range(max_retries + 1):
+            inicio = time.monotonic()
+            try:
+                response = self.session.post(url, data=payload, timeout=self.timeout)
+            except requests.RequestException:
+                response = None
+            resultado, espera = self._procesar_respuesta(response, inicio, intento, max_retries)
+            if resultado is not None:
+                return resultado
+            time.sleep(espera)
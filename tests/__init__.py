@@ -0,0 +1,12 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+# Las pruebas que importan app no deben crear database.db en el directorio del repositorio:
+# la base de datos de la app (y el estado de las conversaciones) van a un directorio temporal
+_TMP = tempfile.mkdtemp(prefix="remembermed-tests-")
+atexit.register(shutil.rmtree, _TMP, ignore_errors=True)
+os.environ.setdefault("DATABASE_PATH", os.path.join(_TMP, "database.db"))
+# Cada prueba arranca a mano el barredor que necesita, sobre su propia base de datos
+os.environ.setdefault("SWEEPER_AUTOSTART", "0")
@@ -0,0 +1,90 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import httpx
+
+import app
+from async_io import AsyncTelegramClient, EventLoopThread
+
+
+def respuesta(status, cuerpo):
+    r = mock.Mock(status_code=status)
+    r.json.return_value = cuerpo
+    return r
+
+
+class TestAsyncTelegramClient(unittest.TestCase):
+    def setUp(self):
+        self.loop = EventLoopThread()
+        self.cliente = AsyncTelegramClient("http://telegram.local", loop=self.loop, max_concurrentes=4,
+                                           global_rate=0, chat_interval=0)
+
+    def tearDown(self):
+        self.cliente.stop()
+        self.loop.stop()
+
+    def test_reintenta_429_respetando_retry_after(self):
+        self.cliente.http.post = mock.AsyncMock(side_effect=[
+            respuesta(429, {"ok": False, "parameters": {"retry_after": 3}}),
+            respuesta(200, {"ok": True}),
+        ])
+        with mock.patch("async_io.asyncio.sleep", mock.AsyncMock()) as sleep:
+            self.assertTrue(self.cliente.send("TOKEN", 1, "hola"))
+        sleep.assert_awaited_once_with(3)
+        stats = self.cliente.stats()
+        self.assertEqual((stats["enviados"], stats["limitados"], stats["reintentos"]), (1, 1, 1))
+
+    def test_cola_envia_con_concurrencia_limitada(self):
+        """Los mensajes encolados se envían sin superar max_concurrentes peticiones en curso"""
+        en_curso = {"ahora": 0, "maximo": 0}
+
+        async def post(url, data):
+            en_curso["ahora"] += 1
+            en_curso["maximo"] = max(en_curso["maximo"], en_curso["ahora"])
+            await asyncio.sleep(0.001)
+            en_curso["ahora"] -= 1
+            return respuesta(200, {"ok": True})
+
+        self.cliente.http.post = post
+        self.cliente.enqueue_many(("TOKEN", i, "hola") for i in range(200))
+        self.cliente.join()
+        self.assertEqual(self.cliente.stats()["enviados"], 200)
+        self.assertEqual(en_curso["maximo"], 4)
+
+    def test_errores_de_red_se_reintentan(self):
+        self.cliente.http.post = mock.AsyncMock(side_effect=[
+            httpx.NetworkError("conexión rechazada"), respuesta(200, {"ok": True})])
+        with mock.patch("async_io.asyncio.sleep", mock.AsyncMock()):
+            self.assertTrue(self.cliente.send("TOKEN", 1, "hola"))
+
+    def test_run_desde_el_propio_bucle_falla(self):
+        async def anidada():
+            return self.loop.run(asyncio.sleep(0))
+
+        with self.assertRaises(RuntimeError):
+            self.loop.run(anidada())
+
+
+class TestWebhookASGI(unittest.TestCase):
+    def llamar(self, metodo, ruta, json=None):
+        async def peticion():
+            async with httpx.AsyncClient(app=app.asgi_app, base_url="http://bot.local") as cliente:
+                return await cliente.request(metodo, ruta, json=json)
+        return asyncio.run(peticion())
+
+    def test_encola_mensajes_de_texto(self):
+        update = {"update_id": 1, "message": {"chat": {"id": 7}, "text": "/start"}}
+        with mock.patch.object(app.updates, "submit") as submit:
+            r = self.llamar("POST", "/telegram?token=T", update)
+            self.assertEqual(r.status_code, 200)
+            submit.assert_called_once_with("T", update)
+            # Las actualizaciones sin texto se confirman sin procesarlas
+            r = self.llamar("POST", "/telegram?token=T", {"update_id": 2, "edited_message": {}})
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(submit.call_count, 1)
+        self.assertEqual(self.llamar("GET", "/telegram").status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
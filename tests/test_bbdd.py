@@ -0,0 +1,241 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+
+from app import calculate_dosage_times
+from BBDD import DOSIS_OMITIDA, DOSIS_RESTANTES, DatabaseManager, MIGRACIONES
+from repository import DOSIS_POR_RECORDATORIO
+
+
+class TestDatabaseManager(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.ruta = os.path.join(self.tmp.name, "test.db")
+        self.db = DatabaseManager(self.ruta)
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def test_migraciones_actualizan_user_version(self):
+        """Una base de datos nueva queda en la última versión del esquema"""
+        version = self.db.conn.execute('PRAGMA user_version').fetchone()[0]
+        self.assertEqual(version, len(MIGRACIONES))
+
+    def test_migraciones_son_idempotentes(self):
+        """Abrir de nuevo la base de datos no vuelve a aplicar migraciones"""
+        self.db.close()
+        self.db = DatabaseManager(self.ruta)
+        version = self.db.conn.execute('PRAGMA user_version').fetchone()[0]
+        self.assertEqual(version, len(MIGRACIONES))
+
+    def test_add_usuario_rellena_nombre_y_telefono(self):
+        """El UPSERT completa los datos que faltan sin sobrescribir los que ya hay"""
+        usuario_id = self.db.add_usuario("42")
+        self.assertEqual(self.db.add_usuario("42", "Ana", "600000000"), usuario_id)
+        self.assertEqual(self.db.add_usuarios([{"chat_id": "42", "nombre": "Otra"}, {"chat_id": "43"}])[0], usuario_id)
+        fila = self.db.conn.execute('SELECT nombre, telefono FROM Usuario WHERE chat_id = ?', ("42",)).fetchone()
+        self.assertEqual(tuple(fila), ("Ana", "600000000"))
+        self.assertEqual(self.db.conn.execute('SELECT COUNT(*) FROM Usuario').fetchone()[0], 2)
+
+    def test_dosis_restantes_no_cuentan_filas(self):
+        """Las dosis restantes salen de la fila del recordatorio, sin recorrer sus dosis"""
+        plan = self.db.conn.execute(f'''
+        EXPLAIN QUERY PLAN
+        SELECT {DOSIS_RESTANTES} FROM Recordatorio r WHERE r.recordatorio_id = ?
+        ''', (1,)).fetchall()
+        self.assertIn("INTEGER PRIMARY KEY", " ".join(fila[-1] for fila in plan))
+
+    def test_tratamiento_largo_ocupa_una_fila(self):
+        """Cada 8 h durante 90 días: 270 dosis sin una fila por dosis"""
+        self.db.add_usuario("42")
+        recordatorio_id = self.db.add_recordatorio("42", "x", "y", 8, "08:00", 270)
+        self.db.programar_dosis(recordatorio_id, "08:00", 8, 270, desde=datetime(2024, 6, 1, 7, 0))
+        self.assertEqual(self.db.conn.execute('SELECT COUNT(*) FROM ExcepcionDosis').fetchone()[0], 0)
+        self.assertEqual(self.db.get_dosis_restantes(recordatorio_id), 270)
+        pendientes = self.db.get_dosis_pendientes(recordatorio_id)
+        self.assertEqual(len(pendientes), 270)
+        self.assertEqual(datetime.fromtimestamp(pendientes[-1]["instante"]), datetime(2024, 8, 30, 0, 0))
+
+        # Tomar una dosis fuera de orden solo añade una excepción
+        self.assertTrue(self.db.marcar_dosis_tomada(pendientes[100]["dosis_id"]))
+        self.assertTrue(self.db.marcar_dosis_tomada(pendientes[0]["dosis_id"]))
+        self.assertEqual(self.db.conn.execute('SELECT COUNT(*) FROM ExcepcionDosis').fetchone()[0], 1)
+        self.assertEqual(self.db.get_dosis_restantes(recordatorio_id), 268)
+        self.assertEqual(self.db.get_siguiente_dosis(recordatorio_id), "16:00")
+
+    def test_resumen_recordatorios(self):
+        """El resumen coincide con get_dosis_restantes y la próxima dosis en orden de programación"""
+        self.db.add_usuario("42", "Prueba")
+        primero = self.db.add_recordatorio("42", "ibuprofeno", "1 tableta", 8, "20:00", 3)
+        self.db.programar_dosis(primero, "20:00", 8, 3)
+        self.db.marcar_dosis_tomada(self.db.get_dosis_pendientes(primero)[0]["dosis_id"])
+        segundo = self.db.add_recordatorio("42", "paracetamol", "1 sobre", 6, "09:00", 2)
+
+        resumen = self.db.get_resumen_recordatorios("42")
+        self.assertEqual([r["recordatorio_id"] for r in resumen], [primero, segundo])
+        self.assertEqual(resumen[0]["dosis_restantes"], self.db.get_dosis_restantes(primero))
+        self.assertEqual(resumen[0]["proxima_dosis"], "04:00")
+        self.assertEqual((resumen[1]["dosis_restantes"], resumen[1]["proxima_dosis"]), (0, None))
+
+    def test_programar_dosis_coincide_con_calculate_dosage_times(self):
+        self.db.add_usuario("42")
+        for hora_inicio, frecuencia, total in [("08:00", 4, 3), ("22:30", 7, 40), ("09:15", 24, 5), ("00:00", 1, 30)]:
+            recordatorio_id = self.db.add_recordatorio("42", "x", "y", frecuencia, hora_inicio, total)
+            self.db.programar_dosis(recordatorio_id, hora_inicio, frecuencia, total)
+            horas = [fila["hora_programada"] for fila in self.db.get_dosis_pendientes(recordatorio_id)]
+            self.assertEqual(horas, calculate_dosage_times(hora_inicio, frecuencia, total))
+
+    def test_programar_dosis_rechaza_reglas_invalidas(self):
+        self.db.add_usuario("42")
+        recordatorio_id = self.db.add_recordatorio("42", "x", "y", 8, "08:00", 3)
+        for frecuencia, total in [(0, 2), (-8, 3), (8, -1), (8, DOSIS_POR_RECORDATORIO)]:
+            with self.assertRaises(ValueError):
+                self.db.programar_dosis(recordatorio_id, "08:00", frecuencia, total)
+
+    def test_importar_tratamientos_es_atomico(self):
+        """Un tratamiento inválido deshace la importación completa"""
+        tratamientos = [
+            {"chat_id": "1", "nombre": "Ana", "medicamento": "ibuprofeno", "dosis": "1", "frecuencia": 8,
+             "hora_inicio": "08:00", "total_dosis": 3},
+            {"chat_id": "2", "medicamento": "paracetamol", "dosis": "1", "frecuencia": 6,
+             "hora_inicio": "09:00", "total_dosis": 4},
+        ]
+        ids = self.db.importar_tratamientos(tratamientos)
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(self.db.get_dosis_restantes(ids[1]), 4)
+
+        with self.assertRaises(ValueError):
+            self.db.importar_tratamientos(tratamientos + [dict(tratamientos[0], chat_id="3", hora_inicio="25:00")])
+        self.assertIsNone(self.db.get_usuario_id("3"))
+        self.assertEqual(len(self.db.get_dosis_pendientes()), 7)
+
+    def test_marcar_dosis_por_id(self):
+        """Se marca exactamente la dosis indicada y una dosis ya enviada no cuenta dos veces"""
+        self.db.add_usuario("42")
+        recordatorio_id = self.db.add_recordatorio("42", "x", "y", 6, "08:00", 4)
+        self.db.programar_dosis(recordatorio_id, "08:00", 6, 4)
+        ids = [fila["dosis_id"] for fila in self.db.get_dosis_pendientes(recordatorio_id)]
+
+        self.assertTrue(self.db.marcar_dosis_tomada(ids[2]))
+        self.assertFalse(self.db.marcar_dosis_tomada(ids[2]))
+        self.assertEqual(sorted(self.db.marcar_dosis_tomadas([ids[0], ids[2], ids[3], 999])), [ids[0], ids[3]])
+        self.assertEqual([fila["dosis_id"] for fila in self.db.get_dosis_pendientes(recordatorio_id)], [ids[1]])
+
+        plan = self.db.conn.execute('''
+        EXPLAIN QUERY PLAN UPDATE Recordatorio SET siguiente_indice = siguiente_indice + 1
+        WHERE recordatorio_id = ? AND siguiente_indice = ? AND adelantadas = 0
+        ''', (recordatorio_id, 1)).fetchall()
+        self.assertIn("INTEGER PRIMARY KEY", " ".join(fila[-1] for fila in plan))
+
+    def test_dosis_guardan_instante_absoluto(self):
+        self.db.add_usuario("42")
+        recordatorio_id = self.db.add_recordatorio("42", "x", "y", 8, "20:00", 3)
+        self.db.programar_dosis(recordatorio_id, "20:00", 8, 3, desde=datetime(2024, 1, 1, 18, 0))
+        fechas = [datetime.fromtimestamp(fila["instante"]) for fila in self.db.get_dosis_pendientes(recordatorio_id)]
+        self.assertEqual(fechas, [datetime(2024, 1, 1, 20, 0), datetime(2024, 1, 2, 4, 0), datetime(2024, 1, 2, 12, 0)])
+
+    def test_omitir_dosis_vencidas_conserva_la_ultima(self):
+        """Solo se omiten las dosis vencidas; con conservar_ultima queda la más reciente de cada recordatorio"""
+        ids = self.db.importar_tratamientos([
+            {"chat_id": "1", "medicamento": "a", "dosis": "1", "frecuencia": 4, "hora_inicio": "08:00", "total_dosis": 6},
+            {"chat_id": "2", "medicamento": "b", "dosis": "1", "frecuencia": 12, "hora_inicio": "09:00", "total_dosis": 2},
+        ], desde=datetime(2024, 1, 1, 7, 0))
+        mediodia = datetime(2024, 1, 1, 13, 0).timestamp()
+        self.assertEqual(len(self.db.get_dosis_vencidas(mediodia)), 3)
+
+        self.assertEqual(self.db.omitir_dosis_vencidas(mediodia, conservar_ultima=True), 1)
+        self.assertEqual([fila["recordatorio_id"] for fila in self.db.get_dosis_vencidas(mediodia)], [ids[1], ids[0]])
+        self.assertEqual(self.db.omitir_dosis_vencidas(mediodia), 2)
+        self.assertEqual(self.db.get_dosis_vencidas(mediodia), [])
+        omitidas = self.db.conn.execute('SELECT COUNT(*) FROM ExcepcionDosis WHERE estado = ?',
+                                        (DOSIS_OMITIDA,)).fetchone()[0]
+        self.assertEqual(omitidas, 3)
+        self.assertEqual(len(self.db.get_dosis_pendientes(despues_de=mediodia)), 5)
+
+    def test_dosis_vencidas_usan_indice(self):
+        plan = self.db.conn.execute('''
+        EXPLAIN QUERY PLAN
+        SELECT recordatorio_id FROM Recordatorio WHERE siguiente_instante <= ? AND activo = 1
+        ''', (0,)).fetchall()
+        self.assertIn("idx_recordatorio_siguiente_instante", " ".join(fila[-1] for fila in plan))
+
+
+class TestMigracionReglas(unittest.TestCase):
+    """La migración 3 convierte las dosis guardadas una a una en reglas con cursor y excepciones"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.ruta = os.path.join(self.tmp.name, "test.db")
+        # Base de datos en la versión 2 del esquema, con DosisProgramada
+        conn = sqlite3.connect(self.ruta)
+        conn.executescript('''
+        CREATE TABLE Usuario (usuario_id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id TEXT UNIQUE, nombre TEXT,
+                              telefono TEXT, es_premium BOOLEAN DEFAULT 0);
+        CREATE TABLE Recordatorio (recordatorio_id INTEGER PRIMARY KEY AUTOINCREMENT, usuario_id INTEGER,
+                                   nombre_medicamento TEXT NOT NULL, dosis TEXT NOT NULL, frecuencia_horas INTEGER,
+                                   hora_inicio TEXT, dosis_totales INTEGER, activo BOOLEAN DEFAULT 1);
+        CREATE TABLE DosisProgramada (dosis_id INTEGER PRIMARY KEY AUTOINCREMENT, recordatorio_id INTEGER,
+                                      hora_programada TEXT, tomada BOOLEAN DEFAULT 0);
+        CREATE TABLE CuentaBancaria (cuenta_id INTEGER PRIMARY KEY AUTOINCREMENT, usuario_id INTEGER NOT NULL,
+                                     numero_tarjeta TEXT NOT NULL, titular TEXT NOT NULL,
+                                     fecha_vencimiento TEXT NOT NULL, cvv TEXT NOT NULL,
+                                     fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP, activa BOOLEAN DEFAULT 1);
+        ''')
+        for sentencia in MIGRACIONES[0] + MIGRACIONES[1]:
+            conn.execute(sentencia)
+        conn.execute('PRAGMA user_version = 2')
+        conn.execute("INSERT INTO Usuario (chat_id) VALUES ('1')")
+        conn.executemany('''
+        INSERT INTO Recordatorio (usuario_id, nombre_medicamento, dosis, frecuencia_horas, hora_inicio, dosis_totales)
+        VALUES (1, ?, '1', ?, ?, 4)''', [("a", 6, "08:00"), ("b", 12, "20:00"), ("c", 8, "09:00")])
+        inicio = int(datetime(2024, 1, 1, 8, 0).timestamp())
+        # a: enviada, pendiente, enviada fuera de orden, pendiente
+        # b: omitida, omitida, pendiente, pendiente
+        # c: sin instante (anterior a la migración 2), la primera enviada
+        conn.executemany('''
+        INSERT INTO DosisProgramada (recordatorio_id, hora_programada, tomada, instante) VALUES (?, ?, ?, ?)
+        ''', [(1, "08:00", 1, inicio), (1, "14:00", 0, inicio + 6 * 3600),
+              (1, "20:00", 1, inicio + 12 * 3600), (1, "02:00", 0, inicio + 18 * 3600),
+              (2, "20:00", 2, inicio + 12 * 3600), (2, "08:00", 2, inicio + 24 * 3600),
+              (2, "20:00", 0, inicio + 36 * 3600), (2, "08:00", 0, inicio + 48 * 3600),
+              (3, "09:00", 1, None), (3, "17:00", 0, None), (3, "01:00", 0, None), (3, "09:00", 0, None)])
+        conn.commit()
+        conn.close()
+        self.inicio = inicio
+        self.db = DatabaseManager(self.ruta)
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def test_convierte_dosis_en_reglas(self):
+        conn = self.db.conn
+        self.assertEqual(conn.execute('PRAGMA user_version').fetchone()[0], len(MIGRACIONES))
+        self.assertIsNone(conn.execute("SELECT name FROM sqlite_master WHERE name = 'DosisProgramada'").fetchone())
+
+        pendientes = [(f["recordatorio_id"], f["hora_programada"], f["instante"]) for f in self.db.get_dosis_pendientes()]
+        self.assertEqual(pendientes, [
+            (1, "14:00", self.inicio + 6 * 3600), (1, "02:00", self.inicio + 18 * 3600),
+            (2, "20:00", self.inicio + 36 * 3600), (2, "08:00", self.inicio + 48 * 3600),
+            (3, "17:00", None), (3, "01:00", None), (3, "09:00", None),
+        ])
+        self.assertEqual([self.db.get_dosis_restantes(r) for r in (1, 2, 3)], [2, 2, 3])
+        self.assertEqual([r["proxima_dosis"] for r in self.db.get_resumen_recordatorios("1")],
+                         ["14:00", "20:00", "17:00"])
+        excepciones = conn.execute('SELECT recordatorio_id, indice, estado FROM ExcepcionDosis').fetchall()
+        self.assertEqual([tuple(e) for e in excepciones], [(1, 2, 1), (2, 0, DOSIS_OMITIDA), (2, 1, DOSIS_OMITIDA)])
+
+    def test_fecha_las_reglas_sin_instante(self):
+        sin_instante = self.db.get_dosis_sin_instante()
+        self.assertEqual([(f["recordatorio_id"], f["hora_programada"]) for f in sin_instante], [(3, "17:00")])
+        self.db.guardar_instantes([(1000, sin_instante[0]["dosis_id"])])
+        self.assertEqual([f["instante"] for f in self.db.get_dosis_pendientes(3)], [1000, 1000 + 8 * 3600,
+                                                                                   1000 + 16 * 3600])
+        self.assertEqual(self.db.get_dosis_sin_instante(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SUITE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks", "suite.py")
+
+
+class TestBenchSuite(unittest.TestCase):
+    """La suite de rendimiento sigue funcionando y su JSON conserva el formato"""
+
+    def test_suite_pequena(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            salida = os.path.join(tmp, "resultados.json")
+            base = os.path.join(tmp, "base.json")
+            with open(base, "w", encoding="utf-8") as f:
+                json.dump({"commit": "base", "webhook": {"updates": 16}}, f)
+            proceso = subprocess.run([sys.executable, SUITE, "--chats", "4", "--clientes", "2", "--workers", "2",
+                                      "--salida", salida, "--comparar", base],
+                                     cwd=tmp, capture_output=True, text=True, timeout=120)
+            self.assertEqual(proceso.returncode, 0, proceso.stderr)
+            with open(salida, encoding="utf-8") as f:
+                resultados = json.load(f)
+
+        self.assertEqual(resultados["webhook"]["updates"], 4 * 8)
+        self.assertEqual(resultados["webhook"]["errores_http"], 0)
+        self.assertGreater(resultados["webhook"]["sql_por_update"], 0)
+        self.assertEqual(set(resultados["webhook"]["latencia_ms"]), {"p50", "p95", "p99", "max", "media"})
+        self.assertEqual((resultados["disparo"]["dosis"], resultados["disparo"]["entregadas"]), (4, 4))
+        self.assertGreater(resultados["memoria"]["rss_max_kib"], 0)
+        self.assertRegex(proceso.stdout, r"webhook\.updates +16\.00 +32\.00 +\+100\.0%")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import gc
+import os
+import tempfile
+import threading
+import unittest
+
+from BBDD import DatabaseManager
+from db_pool import ConnectionPool
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.ruta = os.path.join(self.tmp.name, "test.db")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_pragmas_por_conexion(self):
+        pool = ConnectionPool(self.ruta)
+        with pool.checkout() as conn:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)  # NORMAL
+            self.assertEqual(conn.execute("PRAGMA busy_timeout").fetchone()[0], 5000)
+        pool.close()
+
+    def test_acotado_y_timeout(self):
+        """Con el pool lleno, acquire espera a que se devuelva una conexión o lanza TimeoutError"""
+        pool = ConnectionPool(self.ruta, max_conexiones=2)
+        a, b = pool.acquire(), pool.acquire()
+        with self.assertRaises(TimeoutError):
+            pool.acquire(timeout=0.05)
+
+        obtenida = []
+        hilo = threading.Thread(target=lambda: obtenida.append(pool.acquire(timeout=2)))
+        hilo.start()
+        pool.release(a)
+        hilo.join()
+        self.assertIs(obtenida[0], a)
+        stats = pool.stats()
+        self.assertEqual((stats["creadas"], stats["en_uso"], stats["agotado"], stats["esperas"]), (2, 2, 1, 1))
+        pool.release(b)
+        pool.release(obtenida[0])
+        pool.close()
+        self.assertEqual(pool.stats()["abiertas"], 0)
+
+    def test_deshace_transacciones_abiertas_al_devolver(self):
+        pool = ConnectionPool(self.ruta, max_conexiones=1)
+        with pool.checkout() as conn:
+            conn.execute("CREATE TABLE t (x)")
+            conn.commit()
+            conn.execute("INSERT INTO t VALUES (1)")
+        with pool.checkout() as conn:
+            self.assertFalse(conn.in_transaction)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM t").fetchone()[0], 0)
+        pool.close()
+
+
+class TestDatabaseManagerPool(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = DatabaseManager(os.path.join(self.tmp.name, "test.db"), max_conexiones=4)
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def test_muchos_hilos_comparten_pocas_conexiones(self):
+        """Cada hilo toma una conexión por operación y la devuelve; ninguna queda abierta por hilo"""
+        errores = []
+
+        def trabajador(i):
+            try:
+                self.db.add_usuario(str(i))
+                recordatorio_id = self.db.add_recordatorio(str(i), "ibuprofeno", "1", 8, "08:00", 3)
+                self.db.programar_dosis(recordatorio_id, "08:00", 8, 3)
+                self.db.get_resumen_recordatorios(str(i))
+            except Exception as e:
+                errores.append(e)
+
+        hilos = [threading.Thread(target=trabajador, args=(i,)) for i in range(50)]
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+        self.assertEqual(errores, [])
+        stats = self.db.pool.stats()
+        self.assertLessEqual(stats["creadas"], 4)
+        self.assertEqual(stats["en_uso"], 0)
+        self.assertEqual(len(self.db.get_dosis_pendientes()), 150)
+
+    def test_conexion_es_reentrante(self):
+        with self.db.conexion() as conn:
+            self.assertIs(self.db.conn, conn)
+            self.db.add_usuario("1")
+            self.assertEqual(self.db.pool.stats()["en_uso"], 1)
+        self.assertEqual(self.db.pool.stats()["en_uso"], 0)
+
+    def test_conexion_fijada_se_devuelve_al_terminar_el_hilo(self):
+        hilo = threading.Thread(target=lambda: self.db.conn.execute("SELECT 1"))
+        hilo.start()
+        hilo.join()
+        del hilo
+        gc.collect()
+        self.assertEqual(self.db.pool.stats()["en_uso"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import functools
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+import zipfile
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import app
+from BBDD import DatabaseManager
+from fda_index import FDAIndex, leer_resultados
+from medication_cache import MedicationCache
+from translation_memory import TranslationMemory
+
+
+def etiqueta(set_id, sustancias, version="1", advertencias="Allergy alert"):
+    return {"set_id": set_id, "id": f"{set_id}-{version}",
+            "openfda": {"generic_name": [" AND ".join(sustancias)], "substance_name": sustancias, "route": ["ORAL"]},
+            "warnings": [advertencias], "dosage_and_administration": ["1 tablet every 6 hours"],
+            "indications_and_usage": ["Relieves minor aches"]}
+
+
+def escribir_zip(ruta, etiquetas):
+    # Como en la descarga masiva: "meta" también tiene una clave "results"
+    datos = {"meta": {"last_updated": "2024-06-01", "results": {"skip": 0, "total": len(etiquetas)}},
+             "results": etiquetas}
+    with zipfile.ZipFile(ruta, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("drug-label-0001-of-0001.json", json.dumps(datos, indent=1))
+
+
+ETIQUETAS = [etiqueta("a", ["IBUPROFEN"]), etiqueta("b", ["IBUPROFEN", "FAMOTIDINE"]),
+             etiqueta("c", ["ACETAMINOPHEN"]), etiqueta("d", ["AMOXICILLIN"])]
+
+
+class TestFDAIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.zip = os.path.join(self.tmp.name, "labels.json.zip")
+        escribir_zip(self.zip, ETIQUETAS)
+        self.indice = FDAIndex(os.path.join(self.tmp.name, "fda.db"))
+
+    def tearDown(self):
+        self.indice.close()
+        self.tmp.cleanup()
+
+    def test_leer_resultados_por_bloques(self):
+        """Los bloques pequeños parten claves y etiquetas sin cambiar el resultado"""
+        texto = json.dumps({"meta": {"results": {"total": 4}}, "results": ETIQUETAS})
+        for bloque in (3, 17, 1 << 16):
+            self.assertEqual(list(leer_resultados(io.StringIO(texto), bloque)), ETIQUETAS)
+        self.assertEqual(list(leer_resultados(io.StringIO('{"results": []}'))), [])
+        with self.assertRaises(ValueError):
+            list(leer_resultados(io.StringIO(texto[:-40]), 64))
+
+    def test_importar_y_buscar(self):
+        resultado = self.indice.importar_zips([self.zip])
+        self.assertEqual((resultado["etiquetas"], resultado["escritas"]), (4, 4))
+
+        campos = self.indice.buscar("  Ibuprofen ")
+        self.assertEqual(campos, {"nombre": "IBUPROFEN", "ruta": "ORAL", "advertencias": "Allergy alert",
+                                  "dosis": "1 tablet every 6 hours", "indicaciones": "Relieves minor aches"})
+        self.assertEqual(self.indice.buscar("famotidine")["nombre"], "IBUPROFEN AND FAMOTIDINE")
+        # Solo se busca en los nombres, no en el texto de la etiqueta
+        self.assertIsNone(self.indice.buscar("allergy"))
+        self.assertIsNone(self.indice.buscar('"'))
+        stats = self.indice.stats()
+        self.assertEqual((stats["aciertos"], stats["fallos"], stats["etiquetas"]), (2, 2, 4))
+
+    def test_reimportar_solo_escribe_lo_que_cambia(self):
+        self.indice.importar_zips([self.zip])
+        escribir_zip(self.zip, ETIQUETAS[:3] + [etiqueta("d", ["AMOXICILLIN"], "2", "Nueva advertencia"),
+                                                etiqueta("e", ["NAPROXEN"])])
+        resultado = self.indice.importar_zips([self.zip])
+        self.assertEqual((resultado["etiquetas"], resultado["escritas"], resultado["sin_cambios"]), (5, 2, 3))
+        self.assertEqual(self.indice.buscar("amoxicillin")["advertencias"], "Nueva advertencia")
+        self.assertEqual(self.indice.buscar("naproxen")["nombre"], "NAPROXEN")
+        # El índice de texto sigue el contenido: la versión anterior ya no aparece
+        self.assertEqual(self.indice.conn.execute(
+            "SELECT COUNT(*) FROM EtiquetaFTS WHERE EtiquetaFTS MATCH 'advertencias : allergy'").fetchone()[0], 4)
+
+    def test_sin_indice_no_crea_el_fichero(self):
+        self.assertIsNone(self.indice.buscar("ibuprofen"))
+        self.assertFalse(os.path.exists(self.indice.ruta))
+        self.assertNotIn("etiquetas", self.indice.stats())
+
+    def test_refrescar_desde_el_manifiesto(self):
+        servidor = ThreadingHTTPServer(("127.0.0.1", 0),
+                                       functools.partial(_HandlerSilencioso, directory=self.tmp.name))
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{servidor.server_port}"
+        manifiesto = os.path.join(self.tmp.name, "download.json")
+
+        def publicar(fecha, etiquetas):
+            escribir_zip(self.zip, etiquetas)
+            with open(manifiesto, "w") as f:
+                json.dump({"results": {"drug": {"label": {
+                    "export_date": fecha, "partitions": [{"file": f"{url}/labels.json.zip"}]}}}}, f)
+
+        try:
+            publicar("2024-06-01", ETIQUETAS)
+            self.assertEqual(self.indice.refrescar(f"{url}/download.json")["escritas"], 4)
+            # Misma exportación: no se descarga nada
+            self.assertIsNone(self.indice.refrescar(f"{url}/download.json"))
+
+            publicar("2024-06-08", ETIQUETAS[:2] + ETIQUETAS[3:])
+            resultado = self.indice.refrescar(f"{url}/download.json")
+            self.assertEqual((resultado["escritas"], resultado["sin_cambios"], resultado["borradas"]), (0, 3, 1))
+            self.assertIsNone(self.indice.buscar("acetaminophen"))
+            self.assertEqual(self.indice.stats()["etiquetas"], 3)
+        finally:
+            servidor.shutdown()
+            servidor.server_close()
+
+    def test_fetch_medication_info_usa_el_indice(self):
+        """Con el medicamento en el índice local no se llama a OpenFDA"""
+        self.indice.importar_zips([self.zip])
+        db = DatabaseManager(os.path.join(self.tmp.name, "test.db"))
+        try:
+            with mock.patch.object(app, "medication_cache", MedicationCache(db)), \
+                    mock.patch.object(app, "traducciones", TranslationMemory(db, app._traducir)), \
+                    mock.patch.object(app, "fda_index", self.indice), \
+                    mock.patch.object(app.http, "get", mock.AsyncMock()) as get, \
+                    mock.patch.object(app.translator, "translate",
+                                      side_effect=lambda texto, src, dest: mock.Mock(text=texto.upper())) as translate:
+                self.assertIn("ALLERGY ALERT", app.fetch_medication_info("Ibuprofen"))
+            self.assertEqual(get.call_count, 0)
+            self.assertIn("IBUPROFEN", translate.call_args[0][0])
+        finally:
+            db.close()
+
+
+class _HandlerSilencioso(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
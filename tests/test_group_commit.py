@@ -0,0 +1,101 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+
+from BBDD import DatabaseManager
+
+
+class TestGroupCommit(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.ruta = os.path.join(self.tmp.name, "test.db")
+        self.db = DatabaseManager(self.ruta, group_commit=True)
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def test_escrituras_de_muchos_hilos_en_pocos_commits(self):
+        errores = []
+
+        def escritor(i):
+            try:
+                for n in range(20):
+                    self.db.add_usuario(f"{i}-{n}")
+            except Exception as e:
+                errores.append(e)
+
+        hilos = [threading.Thread(target=escritor, args=(i,)) for i in range(20)]
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+        self.assertEqual(errores, [])
+        stats = self.db.writer.stats()
+        self.assertEqual(stats["escrituras"], 400)
+        self.assertLess(stats["lotes"], 400)
+        # Lo que devuelve un método ya está confirmado: otra conexión lo ve
+        conn = sqlite3.connect(self.ruta)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM Usuario").fetchone()[0], 400)
+        conn.close()
+
+    def test_un_error_solo_deshace_su_escritura(self):
+        """Las escrituras que fallan en un lote no arrastran a las demás"""
+        usuario_id = self.db.add_usuario("1")
+        futuros = [
+            self.db.escribir(self.db.add_usuario, "2"),
+            self.db.escribir(self.db.add_usuario, "1"),
+            self.db.escribir(self.db.programar_dosis, 1, "no-es-una-hora", 8, 3),
+            self.db.escribir(self.db.add_recordatorio, "2", "ibuprofeno", "1", 8, "08:00", 3),
+        ]
+        recordatorio_id = futuros[3].result()
+        self.assertEqual(futuros[1].result(), usuario_id)
+        with self.assertRaises(ValueError):
+            futuros[2].result()
+        self.assertEqual(self.db.get_recordatorios_activos("2")[0]["recordatorio_id"], recordatorio_id)
+        self.assertEqual(self.db.get_dosis_pendientes(), [])
+
+    def test_la_reclamacion_de_dosis_pasa_por_el_escritor(self):
+        """El barredor no abre su propia transacción: compite en la cola del escritor, no por el bloqueo"""
+        desde = datetime.now().replace(second=0, microsecond=0) - timedelta(minutes=1)
+        self.db.importar_tratamientos([
+            {"chat_id": str(chat), "medicamento": "a", "dosis": "1", "frecuencia": 24,
+             "hora_inicio": desde.strftime("%H:%M"), "total_dosis": 2} for chat in range(50)
+        ], desde=desde)
+        escrituras = self.db.writer.stats()["escrituras"]
+        reclamadas, errores = [], []
+
+        def escritor(i):
+            try:
+                for n in range(20):
+                    self.db.add_usuario(f"otro-{i}-{n}")
+            except Exception as e:
+                errores.append(e)
+
+        hilos = [threading.Thread(target=escritor, args=(i,)) for i in range(5)]
+        for h in hilos:
+            h.start()
+        for _ in range(10):
+            reclamadas.extend(self.db.reclamar_dosis_vencidas(time.time(), limite=5))
+        for h in hilos:
+            h.join()
+        self.assertEqual(errores, [])
+        self.assertEqual(len({fila["dosis_id"] for fila in reclamadas}), 50)
+        self.assertEqual(self.db.writer.stats()["escrituras"] - escrituras, 100 + 10)
+        # Lo reclamado ya está confirmado al volver
+        self.assertEqual(self.db.get_dosis_vencidas(time.time()), [])
+
+    def test_sin_group_commit_el_future_ya_esta_resuelto(self):
+        db = DatabaseManager(os.path.join(self.tmp.name, "otra.db"))
+        futuro = db.escribir(db.add_usuario, "1")
+        self.assertTrue(futuro.done())
+        self.assertEqual(db.get_usuario_id("1"), futuro.result())
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
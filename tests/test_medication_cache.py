@@ -0,0 +1,86 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import app
+from BBDD import DatabaseManager
+from medication_cache import MedicationCache, normalizar_nombre
+from translation_memory import TranslationMemory
+
+CAMPOS = {"nombre": "IBUPROFEN", "ruta": "ORAL", "advertencias": "-", "dosis": "-", "indicaciones": "-"}
+
+
+class TestMedicationCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = DatabaseManager(os.path.join(self.tmp.name, "test.db"))
+        self.cache = MedicationCache(self.db)
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def test_normalizar_nombre(self):
+        self.assertEqual(normalizar_nombre("  Ibuprofeno   600 "), "ibuprofeno 600")
+        self.assertEqual(normalizar_nombre("AMOXICILÍNA"), "amoxicilina")
+
+    def test_segundo_nivel_sobrevive_a_la_memoria(self):
+        """Una caché nueva sobre la misma base de datos encuentra la entrada en SQLite"""
+        self.cache.set("Ibuprofeno", CAMPOS, "texto traducido")
+        otra = MedicationCache(self.db)
+        entrada = otra.get("ibuprofeno")
+        self.assertEqual(entrada["texto"], "texto traducido")
+        self.assertEqual(entrada["campos"], CAMPOS)
+        self.assertEqual(otra.get("IBUPROFENO")["texto"], "texto traducido")
+        stats = otra.stats()
+        self.assertEqual((stats["hits_sqlite"], stats["hits_memoria"], stats["misses"]), (1, 1, 0))
+
+    def test_cache_negativa_caduca(self):
+        self.cache.set("desconocido", None, None)
+        self.assertFalse(self.cache.get("desconocido")["encontrado"])
+        with mock.patch("medication_cache.time.time", return_value=10 ** 12):
+            self.assertIsNone(self.cache.get("desconocido"))
+
+    def test_fetch_medication_info_no_repite_peticiones(self):
+        """La segunda consulta del mismo medicamento no llama a OpenFDA ni al traductor"""
+        respuesta = mock.Mock(status_code=200)
+        respuesta.json.return_value = {"results": [{"openfda": {"generic_name": ["IBUPROFEN"]}}]}
+        with mock.patch.object(app, "medication_cache", self.cache), \
+                mock.patch.object(app, "traducciones", TranslationMemory(self.db, app._traducir)), \
+                mock.patch.object(app.http, "get", mock.AsyncMock(return_value=respuesta)) as get, \
+                mock.patch.object(app.translator, "translate",
+                                  side_effect=lambda texto, src, dest: mock.Mock(text=texto.lower())) as translate:
+            info = app.fetch_medication_info("Ibuprofeno")
+            self.assertIn("`ibuprofen`", info)
+            self.assertEqual(app.fetch_medication_info("ibuprofeno "), info)
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(translate.call_count, 1)
+
+    def test_la_cache_y_el_indice_no_bloquean_el_bucle(self):
+        """Las lecturas y escrituras en disco se hacen en el pool de hilos, no en el hilo de asyncio"""
+        hilos = []
+
+        def anotar(funcion):
+            def envoltura(*args):
+                hilos.append(threading.current_thread().name)
+                return funcion(*args)
+            return envoltura
+
+        respuesta = mock.Mock(status_code=200)
+        respuesta.json.return_value = {"results": [{"openfda": {"generic_name": ["IBUPROFEN"]}}]}
+        with mock.patch.object(app, "medication_cache", self.cache), \
+                mock.patch.object(self.cache, "get", anotar(self.cache.get)), \
+                mock.patch.object(self.cache, "set", anotar(self.cache.set)), \
+                mock.patch.object(app.fda_index, "buscar", anotar(lambda nombre: None)), \
+                mock.patch.object(app, "traducciones", TranslationMemory(self.db, lambda texto: texto)), \
+                mock.patch.object(app.http, "get", mock.AsyncMock(return_value=respuesta)):
+            app.fetch_medication_info("ibuprofeno")
+        # get en la fachada y en la consulta, búsqueda en el índice y set
+        self.assertEqual(len(hilos), 4)
+        self.assertNotIn(app.aio.name, hilos)
+
+
+if __name__ == '__main__':
+    unittest.main()
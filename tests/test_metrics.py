@@ -0,0 +1,108 @@
+import os
+import re
+import tempfile
+import threading
+import unittest
+
+import app
+import metrics
+from BBDD import DatabaseManager
+
+
+class TestHistograma(unittest.TestCase):
+    def test_tramos_y_suma(self):
+        h = metrics.Histograma((0.1, 1))
+        for segundos in (0.05, 0.1, 0.5, 2):
+            h.observar(segundos)
+        cuentas, suma = h.valores()
+        # El límite es inclusivo, como `le` en Prometheus
+        self.assertEqual(cuentas, [2, 1, 1])
+        self.assertAlmostEqual(suma, 2.65)
+
+    def test_reparte_al_superar_el_limite(self):
+        h = metrics.Histograma()
+        for _ in range(h.LIMITE_PENDIENTES + 1):
+            h.observar(0.001)
+        self.assertEqual(len(h._pendientes), 0)
+        self.assertEqual(sum(h.valores()[0]), h.LIMITE_PENDIENTES + 1)
+
+    def test_no_pierde_muestras_entre_hilos(self):
+        h = metrics.Histograma()
+
+        def observar():
+            for _ in range(5000):
+                h.observar(0.002)
+        hilos = [threading.Thread(target=observar) for _ in range(8)]
+        for t in hilos:
+            t.start()
+        for t in hilos:
+            t.join()
+        self.assertEqual(sum(h.valores()[0]), 8 * 5000)
+
+
+class TestExportar(unittest.TestCase):
+    def setUp(self):
+        self.registro = metrics.Registro()
+
+    def test_formato_prometheus(self):
+        familia = self.registro.histograma("prueba_segundos", "Ayuda", "metodo", tramos=(0.1, 1))
+        familia.observar(0.05, 'con "comillas"')
+        familia.observar(0.5, 'con "comillas"')
+
+        @familia.cronometrar
+        def funcion():
+            return 42
+        self.assertEqual(funcion(), 42)
+
+        texto = self.registro.exportar()
+        self.assertIn("# TYPE prueba_segundos histogram", texto)
+        self.assertIn('prueba_segundos_bucket{metodo="con \\"comillas\\"",le="0.1"} 1', texto)
+        self.assertIn('prueba_segundos_bucket{metodo="con \\"comillas\\"",le="1"} 2', texto)
+        self.assertIn('prueba_segundos_bucket{metodo="con \\"comillas\\"",le="+Inf"} 2', texto)
+        self.assertIn('prueba_segundos_count{metodo="con \\"comillas\\""} 2', texto)
+        self.assertIn('prueba_segundos_count{metodo="funcion"} 1', texto)
+        self.assertRegex(texto, r'prueba_segundos_sum\{metodo="con \\"comillas\\""\} 0\.55')
+
+    def test_estadisticas_como_gauges(self):
+        self.registro.estadisticas("cola", lambda: {"pendientes": 3, "media": 0.5, "nombre": "x", "ratio-hit": 1})
+        self.registro.estadisticas("roto", lambda: 1 / 0)
+        texto = self.registro.exportar()
+        self.assertIn("# TYPE cola_pendientes gauge\ncola_pendientes 3\n", texto)
+        self.assertIn("cola_media 0.5\n", texto)
+        self.assertIn("cola_ratio_hit 1\n", texto)
+        self.assertNotIn("cola_nombre", texto)
+        # Un componente que falla no impide exportar el resto
+        self.assertIn("# roto: error al leer las estadísticas", texto)
+
+
+class TestMetricasApp(unittest.TestCase):
+    def test_metodos_de_la_base_de_datos(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = DatabaseManager(os.path.join(tmp, "test.db"))
+            try:
+                antes = sum(metrics.DB.hijo("add_usuario").valores()[0])
+                db.add_usuario("1", "Ana", None)
+                db.get_usuario_id("1")
+                self.assertEqual(sum(metrics.DB.hijo("add_usuario").valores()[0]), antes + 1)
+            finally:
+                db.close()
+        self.assertIn('bot_db_segundos_count{metodo="get_usuario_id"}', metrics.REGISTRO.exportar())
+
+    def test_endpoint(self):
+        cliente = app.app.test_client()
+        respuesta = cliente.get("/metrics")
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.headers["Content-Type"], metrics.CONTENT_TYPE)
+        texto = respuesta.get_data(as_text=True)
+        for nombre in ("bot_webhook_segundos", "bot_db_segundos", "bot_telegram_segundos"):
+            self.assertIn(f"# TYPE {nombre} histogram", texto)
+        self.assertRegex(texto, r"\nbot_updates_pendientes \d+\n")
+        self.assertRegex(texto, r"\nbot_telegram_pendientes \d+\n")
+        # Cada línea que no es comentario es "nombre{etiquetas} valor"
+        for linea in texto.splitlines():
+            if not linea.startswith("#"):
+                self.assertRegex(linea, r'^[a-zA-Z_][a-zA-Z0-9_]*(\{.*\})? [-+0-9.eInf]+$')
+
+
+if __name__ == '__main__':
+    unittest.main()
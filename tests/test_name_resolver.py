@@ -0,0 +1,146 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import app
+from BBDD import DatabaseManager
+from medication_cache import MedicationCache
+from name_resolver import NameResolver, distancia_edicion, limpiar_consulta, trigramas
+from translation_memory import TranslationMemory
+
+
+class TestNameResolver(unittest.TestCase):
+    def setUp(self):
+        # Sustancias como las del índice local de OpenFDA
+        self.resolver = NameResolver(["IBUPROFEN", "IBUPROFEN AND FAMOTIDINE", "AMOXICILLIN",
+                                      "ACETAMINOPHEN", "ATORVASTATIN CALCIUM", "NAPROXEN SODIUM"])
+
+    def test_limpiar_consulta(self):
+        self.assertEqual(limpiar_consulta("Amoxicilina 500 mg"), "amoxicilina")
+        self.assertEqual(limpiar_consulta(" IBUPROFENO 600mg comprimidos "), "ibuprofeno")
+        self.assertEqual(limpiar_consulta("Ácido Fólico 5%"), "acido folico")
+        self.assertEqual(trigramas("ab"), {"  a", " ab", "ab "})
+
+    def test_sinonimos_en_espanol(self):
+        self.assertEqual(self.resolver.mejor("ibuprofeno"), "IBUPROFEN")
+        self.assertEqual(self.resolver.mejor("Paracetamol"), "ACETAMINOPHEN")
+        self.assertEqual(self.resolver.mejor("amoxicilina 500"), "AMOXICILLIN")
+        self.assertEqual(self.resolver.resolver("ácido acetilsalicílico"), [("ASPIRIN", 1.0, "acido acetilsalicilico")])
+
+    def test_nombres_en_ingles(self):
+        self.assertEqual(self.resolver.mejor("Ibuprofen"), "IBUPROFEN")
+        self.assertEqual(self.resolver.mejor("atorvastatin calcium 20 mg"), "ATORVASTATIN CALCIUM")
+        self.assertIsNone(self.resolver.sugerencia("Ibuprofen"))
+
+    def test_erratas_solo_como_sugerencia(self):
+        """Una errata no sustituye a lo escrito: se sugiere el término para que lo confirme el usuario"""
+        for texto, termino in [("ibuprofno", "ibuprofeno"), ("amoxicillina", "amoxicilina"),
+                               ("paracetmol", "paracetamol"), ("omeprazl", "omeprazol"),
+                               ("ATORVASTATIN", "atorvastatina"), ("naproxen sodico", "naproxen sodium")]:
+            self.assertIsNone(self.resolver.mejor(texto), texto)
+            self.assertEqual(self.resolver.sugerencia(texto), termino)
+        candidatos = self.resolver.resolver("naproxen sodico")
+        self.assertEqual(candidatos[0].sustancia, "NAPROXEN SODIUM")
+        self.assertEqual([c.puntuacion for c in candidatos], sorted((c.puntuacion for c in candidatos), reverse=True))
+
+    def test_medicamentos_distintos_de_nombre_parecido(self):
+        """Un principio activo fuera del vocabulario no se confunde con el que más se le parece"""
+        for texto in ["hydroxychloroquine", "hidromorfona", "valacyclovir", "clorazepato", "oxcarbazepina",
+                      "desvenlafaxina", "levocetirizina", "norfloxacino", "rabeprazol"]:
+            self.assertIsNone(self.resolver.mejor(texto), texto)
+            self.assertIsNone(self.resolver.sugerencia(texto), texto)
+            self.assertEqual(self.resolver.resolver(texto), [], texto)
+
+    def test_distancia_edicion(self):
+        self.assertEqual(distancia_edicion("omeprazol", "omeprazol", 2), 0)
+        self.assertEqual(distancia_edicion("paracetmol", "paracetamol", 2), 1)
+        self.assertEqual(distancia_edicion("ibuporfeno", "ibuprofeno", 2), 1)
+        self.assertEqual(distancia_edicion("desvenlafaxina", "venlafaxina", 2), 3)
+
+    def test_sin_coincidencias(self):
+        self.assertEqual(self.resolver.resolver("zzzz"), [])
+        self.assertEqual(self.resolver.resolver("500 mg"), [])
+        self.assertIsNone(self.resolver.mejor("hola"))
+
+    def test_estadisticas_y_latencia(self):
+        consultas = ["ibuprofeno", "amoxicilina 500", "paracetmol", "desconocido"] * 250
+        inicio = time.perf_counter()
+        for consulta in consultas:
+            self.resolver.resolver(consulta)
+        media = (time.perf_counter() - inicio) / len(consultas)
+        self.assertLess(media, 0.001)
+
+        stats = self.resolver.stats()
+        self.assertEqual((stats["exactos"], stats["aproximados"], stats["fallos"]), (500, 250, 250))
+        self.assertEqual(stats["hit_rate"], 0.75)
+        self.assertGreater(stats["latencia_media_us"], 0)
+
+    def test_fetch_medication_info_busca_el_principio_activo(self):
+        """El nombre en español se resuelve antes de consultar OpenFDA y comparte la caché"""
+        respuesta = mock.Mock(status_code=200)
+        respuesta.json.return_value = {"results": [{"openfda": {"generic_name": ["AMOXICILLIN"]}}]}
+        with tempfile.TemporaryDirectory() as tmp:
+            db = DatabaseManager(os.path.join(tmp, "test.db"))
+            try:
+                with mock.patch.object(app, "medication_cache", MedicationCache(db)), \
+                        mock.patch.object(app, "traducciones", TranslationMemory(db, app._traducir)), \
+                        mock.patch.object(app, "name_resolver", self.resolver), \
+                        mock.patch.object(app.fda_index, "buscar", return_value=None), \
+                        mock.patch.object(app.http, "get", mock.AsyncMock(return_value=respuesta)) as get, \
+                        mock.patch.object(app.translator, "translate", side_effect=Exception("sin red")):
+                    info = app.fetch_medication_info("Amoxicilina 500")
+                    app.fetch_medication_info("AMOXICILLIN")
+            finally:
+                db.close()
+        self.assertIn("AMOXICILLIN", info)
+        self.assertEqual(get.call_count, 1)
+        self.assertTrue(get.call_args[0][0].endswith("substance_name:AMOXICILLIN&limit=1"))
+
+    def test_fetch_medication_info_no_sustituye_nombres_parecidos(self):
+        """Un medicamento fuera del vocabulario se busca tal cual, no como el más parecido"""
+        respuesta = mock.Mock(status_code=404)
+        with tempfile.TemporaryDirectory() as tmp:
+            db = DatabaseManager(os.path.join(tmp, "test.db"))
+            try:
+                with mock.patch.object(app, "medication_cache", MedicationCache(db)), \
+                        mock.patch.object(app, "name_resolver", NameResolver(["ACYCLOVIR"])), \
+                        mock.patch.object(app.fda_index, "buscar", return_value=None) as buscar, \
+                        mock.patch.object(app.http, "get", mock.AsyncMock(return_value=respuesta)) as get:
+                    info = app.fetch_medication_info("valacyclovir")
+            finally:
+                db.close()
+        self.assertEqual(info, app.MEDICAMENTO_NO_ENCONTRADO)
+        buscar.assert_called_once_with("valacyclovir")
+        self.assertTrue(get.call_args[0][0].endswith("substance_name:valacyclovir&limit=1"))
+
+    def test_dialogo_pregunta_antes_de_buscar_el_nombre_parecido(self):
+        """Si lo escrito no se encuentra, el término parecido solo se busca cuando el usuario lo confirma"""
+        def fetch(nombre):
+            return "info IBUPROFEN" if self.resolver.mejor(nombre) else app.MEDICAMENTO_NO_ENCONTRADO
+
+        with mock.patch.object(app, "name_resolver", self.resolver), \
+                mock.patch.object(app, "fetch_medication_info", side_effect=fetch) as buscar, \
+                mock.patch.object(app, "send_telegram_message") as enviar:
+            for respuesta, buscados, ultimo in [("Sí", ["ibuprofno", "ibuprofeno"], "info IBUPROFEN"),
+                                                ("No", ["ibuprofno"], "De acuerdo")]:
+                buscar.reset_mock()
+                state = {"step": "getting_medication"}
+                app._procesar_paso("T", "42", "ibuprofno", state)
+                self.assertEqual(state["step"], "confirming_medication")
+                self.assertIn("¿Quisiste decir *ibuprofeno*?", enviar.call_args[0][2])
+                app._procesar_paso("T", "42", respuesta, state)
+                self.assertEqual(state, {"step": "menu"})
+                self.assertEqual([llamada[0][0] for llamada in buscar.call_args_list], buscados)
+                self.assertIn(ultimo, enviar.call_args[0][2])
+
+            # Sin nombre parecido se responde directamente
+            state = {"step": "getting_medication"}
+            app._procesar_paso("T", "42", "valacyclovir", state)
+            self.assertEqual(state, {"step": "menu"})
+            self.assertEqual(enviar.call_args[0][2], app.MEDICAMENTO_NO_ENCONTRADO)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,361 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+
+from BBDD import DatabaseManager
+from postgres_repository import PostgresRepository, psycopg2
+from repository import DOSIS_ENVIADA, DOSIS_OMITIDA, ReglaDosis, ReminderRepository, crear_repositorio
+
+try:
+    import pgserver  # PostgreSQL empaquetado en un wheel: sin servidor ni contenedores
+except ImportError:
+    pgserver = None
+
+# Servidor PostgreSQL de pruebas; sin esta variable se arranca uno local con pgserver
+# en un directorio temporal, y si tampoco está instalado solo se prueba SQLite
+TEST_POSTGRES_URL = os.environ.get("TEST_POSTGRES_URL")
+_servidor_postgres = None
+
+
+def setUpModule():
+    global TEST_POSTGRES_URL, _servidor_postgres
+    if TEST_POSTGRES_URL or pgserver is None or psycopg2 is None:
+        return
+    datos = tempfile.mkdtemp(prefix="pg-pruebas-")
+    _servidor_postgres = pgserver.get_server(datos, cleanup_mode="delete")
+    TEST_POSTGRES_URL = _servidor_postgres.get_uri()
+
+
+def tearDownModule():
+    if _servidor_postgres is not None:
+        _servidor_postgres.cleanup()
+
+
+class ContratoRepositorio:
+    """Comportamiento que cualquier ReminderRepository debe cumplir"""
+
+    def crear_repositorio(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.db = self.crear_repositorio()
+        self.ahora = datetime.now().replace(second=0, microsecond=0)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_usuarios(self):
+        usuario_id = self.db.add_usuario("1", "Ana")
+        self.assertEqual(self.db.add_usuario("1"), usuario_id)
+        self.assertEqual(self.db.get_usuario_id("1"), usuario_id)
+        self.assertIsNone(self.db.get_usuario_id("2"))
+        self.assertFalse(self.db.es_usuario_premium("1"))
+        self.db.marcar_como_premium("1")
+        self.assertTrue(self.db.es_usuario_premium("1"))
+        self.db.add_recordatorio("1", "ibuprofeno", "1 tableta", 8, "08:00", 3)
+        datos = self.db.get_datos_usuario("1")
+        self.assertEqual((datos["usuario_id"], bool(datos["es_premium"]), datos["recordatorios_activos"]),
+                         (usuario_id, True, 1))
+        self.assertIsNone(self.db.get_datos_usuario("2"))
+
+    def test_add_usuarios(self):
+        existente = self.db.add_usuario("1")
+        ids = self.db.add_usuarios([{"chat_id": "2", "nombre": "Ana"}, {"chat_id": "1"}, {"chat_id": 3}, {"chat_id": "2"}])
+        self.assertEqual(ids[1], existente)
+        self.assertEqual(ids[0], ids[3])
+        self.assertEqual(ids, [self.db.get_usuario_id(c) for c in ("2", "1", "3", "2")])
+        self.assertEqual(len(set(ids)), 3)
+        self.assertEqual(self.db.add_usuarios([]), [])
+
+    def test_add_usuario_concurrente(self):
+        """Muchos hilos dando de alta el mismo chat obtienen el mismo usuario_id sin errores"""
+        resultados = []
+        errores = []
+        salida = threading.Barrier(16)
+
+        def alta():
+            salida.wait()
+            try:
+                for _ in range(25):
+                    resultados.append(self.db.add_usuario("1", "Ana"))
+            except Exception as e:
+                errores.append(e)
+
+        hilos = [threading.Thread(target=alta) for _ in range(16)]
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+        self.assertEqual(errores, [])
+        self.assertEqual(len(resultados), 400)
+        self.assertEqual(set(resultados), {self.db.get_usuario_id("1")})
+
+    def test_recordatorio_y_resumen(self):
+        self.db.add_usuario("1")
+        recordatorio_id = self.db.add_recordatorio("1", "ibuprofeno", "1 tableta", 8, "08:00", 3)
+        self.db.programar_dosis(recordatorio_id, "08:00", 8, 3, desde=self.ahora)
+        with self.assertRaises(ValueError):
+            self.db.programar_dosis(recordatorio_id, "25:00", 8, 3)
+
+        resumen = self.db.get_resumen_recordatorios("1")
+        self.assertEqual([(r["recordatorio_id"], r["dosis_restantes"], r["proxima_dosis"]) for r in resumen],
+                         [(recordatorio_id, 3, "08:00")])
+        self.assertEqual(self.db.get_dosis_restantes(recordatorio_id), 3)
+        primera = self.db.get_dosis_pendientes(recordatorio_id)[0]["dosis_id"]
+        self.assertTrue(self.db.marcar_dosis_tomada(primera))
+        self.assertFalse(self.db.marcar_dosis_tomada(primera))
+        self.assertEqual(self.db.get_resumen_recordatorios("1")[0]["proxima_dosis"], "16:00")
+
+        self.db.delete_recordatorio(recordatorio_id)
+        self.assertEqual(self.db.get_recordatorios_activos("1"), [])
+        self.assertEqual(self.db.get_dosis_pendientes(), [])
+
+    def test_reclamar_dosis_vencidas(self):
+        """Las dosis vencidas se reclaman una sola vez aunque barran varios hilos"""
+        self.db.importar_tratamientos([
+            {"chat_id": str(chat), "medicamento": "a", "dosis": "1", "frecuencia": 1,
+             "hora_inicio": (self.ahora - timedelta(hours=3)).strftime("%H:%M"), "total_dosis": 5}
+            for chat in range(20)
+        ], desde=self.ahora - timedelta(hours=3))
+        ahora = self.ahora.timestamp()
+        self.assertEqual(len(self.db.get_dosis_vencidas(ahora)), 80)
+
+        reclamadas = []
+        lock = threading.Lock()
+
+        def barrer():
+            while True:
+                filas = self.db.reclamar_dosis_vencidas(ahora, limite=7)
+                if not filas:
+                    return
+                with lock:
+                    reclamadas.extend(filas)
+
+        hilos = [threading.Thread(target=barrer) for _ in range(4)]
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+        self.assertEqual(sorted(f["dosis_id"] for f in reclamadas),
+                         sorted(set(f["dosis_id"] for f in reclamadas)))
+        self.assertEqual(len(reclamadas), 80)
+        self.assertEqual(sorted(f["dosis_restantes"] for f in reclamadas if f["chat_id"] == "0"), [1, 2, 3, 4])
+        self.assertEqual(self.db.get_siguiente_instante(ahora), int(ahora + 3600))
+
+    def test_omitir_y_fechar_dosis(self):
+        self.db.importar_tratamientos([
+            {"chat_id": "1", "medicamento": "a", "dosis": "1", "frecuencia": 1,
+             "hora_inicio": (self.ahora - timedelta(hours=2)).strftime("%H:%M"), "total_dosis": 4}
+        ], desde=self.ahora - timedelta(hours=2))
+        self.assertEqual(self.db.omitir_dosis_vencidas(self.ahora.timestamp(), conservar_ultima=True), 2)
+        pendientes = self.db.get_dosis_pendientes()
+        self.assertEqual(len(pendientes), 2)
+        # Las dosis van a intervalos fijos: fechar la primera desplaza igual la siguiente
+        self.db.guardar_instantes([(1, pendientes[0]["dosis_id"])])
+        self.assertEqual([f["instante"] for f in self.db.get_dosis_pendientes()], [1, 3601])
+        self.assertEqual(self.db.get_siguiente_instante(0), 1)
+        self.assertEqual(self.db.marcar_dosis_tomadas([f["dosis_id"] for f in pendientes] + [10 ** 9]),
+                         [f["dosis_id"] for f in pendientes])
+
+    def test_cache_medicamento(self):
+        caduca = time.time() + 60
+        self.db.guardar_cache_medicamento("ibuprofeno", False, None, None, caduca)
+        self.db.guardar_cache_medicamento("ibuprofeno", True, "{}", "texto", caduca)
+        fila = self.db.get_cache_medicamento("ibuprofeno")
+        self.assertTrue(fila["encontrado"])
+        self.assertEqual((fila["campos"], fila["texto_es"]), ("{}", "texto"))
+        self.assertIsNone(self.db.get_cache_medicamento("paracetamol"))
+
+    def test_memoria_traduccion(self):
+        self.assertEqual(self.db.get_traducciones([]), {})
+        self.db.guardar_traducciones([("h1", "Keep out of reach of children.", "Mantener fuera del alcance"),
+                                      ("h2", "Oral", "Oral")])
+        self.db.guardar_traducciones([("h1", "Keep out of reach of children.", "Mantener fuera del alcance de los niños.")])
+        self.assertEqual(self.db.get_traducciones(["h1", "h2", "h3"]),
+                         {"h1": "Mantener fuera del alcance de los niños.", "h2": "Oral"})
+
+    def test_cuentas_bancarias(self):
+        usuario_id = self.db.add_usuario("1")
+        cuenta_id = self.db.agregar_cuenta_bancaria("1", "4111 1111 1111 1111", "Ana", "12/30", "123")
+        with self.assertRaises(ValueError):
+            self.db.agregar_cuenta_bancaria("1", "4111111111111111", "Ana", "12/30", "123")
+        self.assertEqual(self.db.obtener_ultima_cuenta_activa(usuario_id)["cuenta_id"], cuenta_id)
+        self.assertTrue(self.db.desactivar_cuenta(cuenta_id, usuario_id))
+        self.assertEqual(self.db.obtener_cuentas_activas(usuario_id), [])
+
+
+class TestReglaDosis(unittest.TestCase):
+    """Dosis generadas a partir de la regla, sin base de datos"""
+
+    def setUp(self):
+        # Cada 8 h desde las 20:00, 6 dosis
+        self.regla = ReglaDosis(7, 1000, 8 * 3600, 20 * 60, 6, 0)
+
+    def test_instantes_y_horas(self):
+        self.assertEqual([self.regla.instante(i) for i in range(3)], [1000, 1000 + 28800, 1000 + 57600])
+        self.assertEqual([self.regla.hora(i) for i in range(4)], ["20:00", "04:00", "12:00", "20:00"])
+        self.assertEqual(self.regla.dosis_id(3), 7000003)
+        self.assertEqual((self.regla.restantes, self.regla.siguiente_instante), (6, 1000))
+
+    def test_vencidas_y_posteriores(self):
+        self.assertEqual(list(self.regla.vencidas(999)), [])
+        self.assertEqual(list(self.regla.vencidas(1000 + 28800)), [0, 1])
+        self.assertEqual(list(self.regla.pendientes_despues_de(1000 + 28800)), [2, 3, 4, 5])
+        self.assertEqual(list(self.regla.pendientes_despues_de(0)), list(range(6)))
+
+    def test_marcar_fuera_de_orden(self):
+        self.assertEqual(self.regla.marcar([2, 2, 9], DOSIS_ENVIADA), [2])
+        self.assertEqual((self.regla.cursor, self.regla.restantes, self.regla.siguiente(1)), (0, 5, 3))
+        self.assertEqual(self.regla.restantes_despues(0), 4)
+        self.assertEqual(self.regla.nuevas, [(2, DOSIS_ENVIADA)])
+
+        # Al llegar el cursor a la excepción la salta y la enviada deja de hacer falta
+        self.assertEqual(self.regla.marcar([0, 1], DOSIS_OMITIDA), [0, 1])
+        self.assertEqual((self.regla.cursor, self.regla.excepciones), (3, {}))
+        self.assertEqual(self.regla.borradas, [2])
+        self.assertEqual(self.regla.nuevas, [(2, DOSIS_ENVIADA), (0, DOSIS_OMITIDA), (1, DOSIS_OMITIDA)])
+        self.assertEqual(list(self.regla.pendientes()), [3, 4, 5])
+
+    def test_sin_dosis_programadas(self):
+        regla = ReglaDosis(7, None, None, None, 3, 0)
+        self.assertEqual((regla.restantes, regla.siguiente_instante, list(regla.pendientes())), (0, None, []))
+
+
+class TestRepositorioSQLite(ContratoRepositorio, unittest.TestCase):
+    def crear_repositorio(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        return crear_repositorio(None, os.path.join(self.tmp.name, "test.db"))
+
+    def test_es_un_reminder_repository(self):
+        self.assertIsInstance(self.db, DatabaseManager)
+        self.assertIsInstance(self.db, ReminderRepository)
+
+    def test_url_desconocida(self):
+        with self.assertRaises(ValueError):
+            crear_repositorio("mysql://localhost/recordatorios")
+
+    @unittest.skipIf(psycopg2, "psycopg2 está instalado")
+    def test_postgres_sin_psycopg2(self):
+        with self.assertRaises(RuntimeError):
+            crear_repositorio("postgresql://localhost/recordatorios")
+
+
+class TestRepositorioPostgres(ContratoRepositorio, unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        if not (TEST_POSTGRES_URL and psycopg2):
+            raise unittest.SkipTest("sin TEST_POSTGRES_URL ni pgserver, o psycopg2 no instalado")
+
+    def ejecutar(self, *sentencias):
+        conn = psycopg2.connect(TEST_POSTGRES_URL)
+        try:
+            with conn, conn.cursor() as cursor:
+                for sentencia in sentencias:
+                    cursor.execute(sentencia)
+        finally:
+            conn.close()
+
+    def crear_repositorio(self):
+        self.ejecutar('DROP TABLE IF EXISTS CuentaBancaria, ExcepcionDosis, DosisProgramada, Recordatorio, '
+                      'Usuario, CacheMedicamento, MemoriaTraduccion CASCADE')
+        return crear_repositorio(TEST_POSTGRES_URL)
+
+    def test_esquema_idempotente(self):
+        """Crear el repositorio sobre un esquema existente no cambia nada, y el esquema es el de ESQUEMA"""
+        self.db.add_usuario("1")
+        self.db.add_recordatorio("1", "a", "1", 8, "08:00", 3, token="BOT")
+        otro = crear_repositorio(TEST_POSTGRES_URL)
+        try:
+            self.assertEqual(otro.get_recordatorios_activos("1")[0]["nombre_medicamento"], "a")
+        finally:
+            otro.close()
+        with self.db.conexion() as conn, conn.cursor() as cursor:
+            cursor.execute("""SELECT column_name FROM information_schema.columns
+                              WHERE table_name = 'recordatorio' ORDER BY ordinal_position""")
+            columnas = [fila[0] for fila in cursor.fetchall()]
+            conn.rollback()
+        self.assertEqual(columnas[-7:], ["minuto_inicio", "primer_instante", "intervalo", "siguiente_indice",
+                                         "siguiente_instante", "adelantadas", "token"])
+
+    def test_reclamar_salta_los_recordatorios_bloqueados(self):
+        """FOR UPDATE SKIP LOCKED: lo que otro nodo tiene bloqueado se deja para después, sin esperar"""
+        ids = self.db.importar_tratamientos([
+            {"chat_id": str(chat), "medicamento": "a", "dosis": "1", "frecuencia": 24,
+             "hora_inicio": (self.ahora - timedelta(minutes=1)).strftime("%H:%M"), "total_dosis": 2}
+            for chat in range(3)
+        ], desde=self.ahora - timedelta(minutes=1))
+        otro_nodo = psycopg2.connect(TEST_POSTGRES_URL)
+        try:
+            with otro_nodo.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM Recordatorio WHERE recordatorio_id = %s FOR UPDATE", (ids[0],))
+            filas = []
+            barredor = threading.Thread(target=lambda: filas.extend(self.db.reclamar_dosis_vencidas(time.time())))
+            barredor.start()
+            barredor.join(5)
+            self.assertFalse(barredor.is_alive(), "el barredor esperó al bloqueo del otro nodo")
+            self.assertEqual(sorted(fila["recordatorio_id"] for fila in filas), ids[1:])
+        finally:
+            otro_nodo.rollback()
+            otro_nodo.close()
+            barredor.join()
+        self.assertEqual([fila["recordatorio_id"] for fila in self.db.reclamar_dosis_vencidas(time.time())],
+                         ids[:1])
+
+    def test_conversion_dosis(self):
+        """CONVERSION_DOSIS pasa una tabla DosisProgramada anterior a las reglas, como la migración 3 de SQLite"""
+        self.db.close()
+        self.ejecutar(
+            'DROP TABLE IF EXISTS CuentaBancaria, ExcepcionDosis, Recordatorio, Usuario CASCADE',
+            '''CREATE TABLE Usuario (usuario_id BIGSERIAL PRIMARY KEY, chat_id TEXT UNIQUE, nombre TEXT,
+                                   telefono TEXT, es_premium BOOLEAN NOT NULL DEFAULT FALSE)''',
+            '''CREATE TABLE Recordatorio (recordatorio_id BIGSERIAL PRIMARY KEY,
+                                        usuario_id BIGINT REFERENCES Usuario(usuario_id),
+                                        nombre_medicamento TEXT NOT NULL, dosis TEXT NOT NULL,
+                                        frecuencia_horas INTEGER, hora_inicio TEXT, dosis_totales INTEGER,
+                                        activo BOOLEAN NOT NULL DEFAULT TRUE)''',
+            '''CREATE TABLE DosisProgramada (dosis_id BIGSERIAL PRIMARY KEY,
+                                           recordatorio_id BIGINT REFERENCES Recordatorio(recordatorio_id),
+                                           hora_programada TEXT, tomada SMALLINT NOT NULL DEFAULT 0,
+                                           instante BIGINT)''',
+            "INSERT INTO Usuario (chat_id) VALUES ('1')",
+            '''INSERT INTO Recordatorio (usuario_id, nombre_medicamento, dosis, frecuencia_horas, hora_inicio,
+                                       dosis_totales)
+               VALUES (1, 'a', '1', 6, '08:00', 4), (1, 'b', '1', 12, '20:00', 4), (1, 'c', '1', 8, '09:00', 4)''')
+        inicio = int(datetime(2024, 1, 1, 8, 0).timestamp())
+        # a: enviada, pendiente, enviada fuera de orden, pendiente
+        # b: omitida, omitida, pendiente, pendiente
+        # c: sin instante (anterior a la migración 2), la primera enviada
+        dosis = [(1, "08:00", 1, inicio), (1, "14:00", 0, inicio + 6 * 3600),
+                 (1, "20:00", 1, inicio + 12 * 3600), (1, "02:00", 0, inicio + 18 * 3600),
+                 (2, "20:00", 2, inicio + 12 * 3600), (2, "08:00", 2, inicio + 24 * 3600),
+                 (2, "20:00", 0, inicio + 36 * 3600), (2, "08:00", 0, inicio + 48 * 3600),
+                 (3, "09:00", 1, None), (3, "17:00", 0, None), (3, "01:00", 0, None), (3, "09:00", 0, None)]
+        self.ejecutar(*(f"INSERT INTO DosisProgramada (recordatorio_id, hora_programada, tomada, instante) "
+                        f"VALUES ({r}, '{hora}', {tomada}, {'NULL' if instante is None else instante})"
+                        for r, hora, tomada, instante in dosis))
+        self.db = crear_repositorio(TEST_POSTGRES_URL)
+
+        pendientes = [(f["recordatorio_id"], f["hora_programada"], f["instante"]) for f in self.db.get_dosis_pendientes()]
+        self.assertEqual(pendientes, [
+            (1, "14:00", inicio + 6 * 3600), (1, "02:00", inicio + 18 * 3600),
+            (2, "20:00", inicio + 36 * 3600), (2, "08:00", inicio + 48 * 3600),
+            (3, "17:00", None), (3, "01:00", None), (3, "09:00", None),
+        ])
+        self.assertEqual([self.db.get_dosis_restantes(r) for r in (1, 2, 3)], [2, 2, 3])
+        self.assertEqual([r["proxima_dosis"] for r in self.db.get_resumen_recordatorios("1")],
+                         ["14:00", "20:00", "17:00"])
+        with self.db.conexion() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('dosisprogramada') IS NULL")
+            self.assertTrue(cursor.fetchone()[0])
+            cursor.execute('SELECT recordatorio_id, indice, estado FROM ExcepcionDosis ORDER BY 1, 2')
+            excepciones = [tuple(fila) for fila in cursor.fetchall()]
+            conn.rollback()
+        self.assertEqual(excepciones, [(1, 2, 1), (2, 0, DOSIS_OMITIDA), (2, 1, DOSIS_OMITIDA)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,319 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs
+
+import app
+from BBDD import DatabaseManager
+from scheduler import DoseSweeper, calcular_instantes
+from state_store import MemoryStateStore
+from update_queue import UpdateDispatcher
+from user_cache import UserCache
+
+
+class TestCalcularInstantes(unittest.TestCase):
+    def test_calcular_instantes_cruza_medianoche(self):
+        """Las dosis posteriores a la medianoche se programan al día siguiente"""
+        desde = datetime(2024, 1, 1, 18, 0)
+        instantes = calcular_instantes(["20:00", "04:00", "12:00"], desde)
+        fechas = [datetime.fromtimestamp(t) for t in instantes]
+        self.assertEqual(fechas, [
+            datetime(2024, 1, 1, 20, 0),
+            datetime(2024, 1, 2, 4, 0),
+            datetime(2024, 1, 2, 12, 0),
+        ])
+
+
+class TestDoseSweeper(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.ruta = os.path.join(self.tmp.name, "test.db")
+        self.db = DatabaseManager(self.ruta)
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def programar(self, chats, desde, token=None, primer_chat=0):
+        return self.db.importar_tratamientos([
+            {"chat_id": str(chat), "medicamento": "a", "dosis": "1", "frecuencia": 24,
+             "hora_inicio": desde.strftime("%H:%M"), "total_dosis": 2, "token": token}
+            for chat in range(primer_chat, primer_chat + chats)
+        ], desde=desde)
+
+    def test_reclama_por_lotes_y_marca_enviadas(self):
+        """Las dosis vencidas se entregan en lotes de max_lote y no se vuelven a entregar"""
+        ahora = datetime.now().replace(second=0, microsecond=0)
+        self.programar(25, ahora - timedelta(minutes=1))
+        lotes = []
+        sweeper = DoseSweeper(self.db, lambda filas: lotes.append(len(filas)), max_lote=10)
+        self.assertEqual(sweeper.sweep(), 25)
+        self.assertEqual(lotes, [10, 10, 5])
+        self.assertEqual(sweeper.sweep(), 0)
+        self.assertEqual(sweeper.stats()["disparadas"], 25)
+        # Solo quedan las segundas dosis, dentro de 24 h
+        self.assertEqual(self.db.get_siguiente_instante(time.time()),
+                         int((ahora + timedelta(hours=23, minutes=59)).timestamp()))
+
+    def test_dos_barredores_no_reclaman_la_misma_dosis(self):
+        self.programar(300, datetime.now().replace(second=0, microsecond=0) - timedelta(minutes=1))
+        entregadas = []
+        barredores = [DoseSweeper(DatabaseManager(self.ruta), lambda filas: entregadas.extend(
+            fila["dosis_id"] for fila in filas), max_lote=7) for _ in range(4)]
+        hilos = [threading.Thread(target=b.sweep) for b in barredores]
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+        self.assertEqual(len(entregadas), 300)
+        self.assertEqual(len(set(entregadas)), 300)
+
+    def test_wake_despierta_al_hilo(self):
+        """El hilo duerme hasta la siguiente dosis y wake lo despierta cuando se programa otra"""
+        listo = threading.Event()
+        sweeper = DoseSweeper(self.db, lambda filas: listo.set())
+        sweeper.start()
+        time.sleep(0.05)
+        self.programar(1, datetime.now().replace(second=0, microsecond=0))
+        sweeper.wake()
+        self.assertTrue(listo.wait(2))
+        sweeper.stop()
+
+    def test_reanudar_tras_fork(self):
+        """En el hijo de un fork el hilo del padre no existe: se arranca otro, y solo si estaba en marcha"""
+        parado = DoseSweeper(self.db, lambda filas: None)
+        parado.reanudar_tras_fork()
+        self.assertIsNone(parado._thread)
+
+        listo = threading.Event()
+        sweeper = DoseSweeper(self.db, lambda filas: listo.set())
+        sweeper.start()
+        hilo_padre = sweeper._thread
+        sweeper.reanudar_tras_fork()
+        self.assertIsNot(sweeper._thread, hilo_padre)
+        self.programar(1, datetime.now().replace(second=0, microsecond=0))
+        sweeper.wake()
+        self.assertTrue(listo.wait(2))
+        sweeper.stop()
+        hilo_padre.join(1)
+
+    def test_cada_dosis_lleva_el_token_de_su_bot(self):
+        desde = datetime.now().replace(second=0, microsecond=0) - timedelta(minutes=1)
+        self.programar(2, desde, token="BOT_A")
+        self.programar(2, desde, token="BOT_B", primer_chat=2)
+        filas = []
+        DoseSweeper(self.db, filas.extend).sweep()
+        self.assertEqual(sorted((fila["chat_id"], fila["token"]) for fila in filas),
+                         [("0", "BOT_A"), ("1", "BOT_A"), ("2", "BOT_B"), ("3", "BOT_B")])
+
+    def test_sin_token_por_defecto_no_se_reclaman_las_dosis_sin_token(self):
+        """Un recordatorio sin token no se puede enviar: sus dosis siguen pendientes en lugar de perderse"""
+        desde = datetime.now().replace(second=0, microsecond=0) - timedelta(minutes=1)
+        self.programar(1, desde)
+        self.programar(1, desde, token="BOT_A", primer_chat=1)
+        filas = []
+        self.assertEqual(DoseSweeper(self.db, filas.extend, reclamar_sin_token=False).sweep(), 1)
+        self.assertEqual([(fila["chat_id"], fila["token"]) for fila in filas], [("1", "BOT_A")])
+        self.assertEqual(len(self.db.get_dosis_vencidas(time.time())), 1)
+
+        # Con un token por defecto (TELEGRAM_TOKEN) ya se pueden reclamar
+        self.assertEqual(DoseSweeper(self.db, filas.extend).sweep(), 1)
+        self.assertIsNone(filas[-1]["token"])
+
+
+class TestRecuperacionDosis(unittest.TestCase):
+    """Dosis que vencieron con el bot parado: se reenvían, se agrupan o se omiten"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = DatabaseManager(os.path.join(self.tmp.name, "test.db"))
+        # Dos recordatorios cada 2 h desde hace 5 h: 3 dosis vencidas y 2 futuras en cada uno
+        self.ahora = datetime.now().replace(second=0, microsecond=0)
+        inicio = (self.ahora - timedelta(hours=5)).strftime("%H:%M")
+        self.db.importar_tratamientos([
+            {"chat_id": chat, "medicamento": "a", "dosis": "1", "frecuencia": 2, "hora_inicio": inicio,
+             "total_dosis": 5} for chat in ("1", "2")
+        ], desde=self.ahora - timedelta(hours=5))
+        self.parche = mock.patch.object(app, "db", self.db)
+        self.parche.start()
+
+    def tearDown(self):
+        self.parche.stop()
+        self.db.close()
+        self.tmp.cleanup()
+
+    def recuperar(self, politica):
+        """Aplica la política y devuelve su resultado y las dosis que envía después el barredor"""
+        resultado = app.recover_missed_doses(politica, self.ahora.timestamp())
+        lotes = []
+        DoseSweeper(self.db, lambda filas: lotes.append(filas)).sweep(self.ahora.timestamp())
+        return resultado, [fila for lote in lotes for fila in lote]
+
+    def test_send_reenvia_todas(self):
+        (reenviadas, omitidas), enviadas = self.recuperar("send")
+        self.assertEqual((reenviadas, omitidas, len(enviadas)), (6, 0, 6))
+
+    def test_coalesce_reenvia_la_ultima_de_cada_recordatorio(self):
+        (reenviadas, omitidas), enviadas = self.recuperar("coalesce")
+        self.assertEqual((reenviadas, omitidas), (2, 4))
+        self.assertEqual([fila["dosis_restantes"] for fila in enviadas], [2, 2])
+        # Las dosis futuras siguen pendientes
+        self.assertEqual(len(self.db.get_dosis_pendientes(despues_de=self.ahora.timestamp())), 4)
+
+    def test_skip_omite_todas(self):
+        (reenviadas, omitidas), enviadas = self.recuperar("skip")
+        self.assertEqual((reenviadas, omitidas, enviadas), (0, 6, []))
+
+    def test_politica_desconocida(self):
+        with self.assertRaises(ValueError):
+            app.recover_missed_doses("reintentar")
+
+
+
+class _TelegramFalso:
+    """Sustituye al cliente de Telegram: anota los mensajes encolados por el barredor"""
+
+    def __init__(self):
+        self.encolados = []
+        self.respuestas = []
+        self.enviado = threading.Event()
+
+    def send(self, token, chat_id, text, reply_markup=None):
+        self.respuestas.append(text)
+        return True
+
+    def enqueue_many(self, mensajes):
+        self.encolados.extend(mensajes)
+        self.enviado.set()
+
+
+class TestBarredorEnLaApp(unittest.TestCase):
+    """Sin ejecutar app.py como __main__ (uvicorn, gunicorn...) los recordatorios también se envían"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = DatabaseManager(os.path.join(self.tmp.name, "test.db"))
+        self.telegram = _TelegramFalso()
+        # Por si otra prueba ya arrancó el barredor de la app: debe arrancarlo el nuevo recordatorio
+        app.sweeper.stop()
+        parches = [mock.patch.object(app, "db", self.db), mock.patch.object(app.sweeper, "db", self.db),
+                   mock.patch.object(app.sweeper, "espera_max", 0.05),
+                   mock.patch.object(app, "telegram", self.telegram),
+                   mock.patch.object(app, "user_cache", UserCache(self.db)),
+                   mock.patch.object(app, "user_states", MemoryStateStore()),
+                   mock.patch.object(app, "updates", UpdateDispatcher(app.handle_message, workers=0))]
+        for parche in parches:
+            parche.start()
+            self.addCleanup(parche.stop)
+
+    def tearDown(self):
+        app.sweeper.stop()
+        self.db.close()
+        self.tmp.cleanup()
+
+    def test_recordatorio_creado_por_el_webhook_se_entrega(self):
+        cliente = app.app.test_client()
+        # La hora de hace un minuto: la primera dosis queda para mañana a esa hora
+        hora = (datetime.now() - timedelta(minutes=1)).strftime("%H:%M")
+        for texto in ["/start", "1. Establecer recordatorio", "Ibuprofeno", "1 tableta", "8", "3", hora]:
+            respuesta = cliente.post("/telegram", query_string={"token": "T"},
+                                     json={"message": {"chat": {"id": 42, "first_name": "Ana"}, "text": texto}})
+            self.assertEqual(respuesta.status_code, 200)
+        self.assertFalse(self.telegram.enviado.wait(0.2))
+
+        # Pasa un día: la primera dosis vence y el barredor (que nadie arrancó a mano) la envía
+        with self.db.conexion() as conn:
+            conn.execute("UPDATE Recordatorio SET primer_instante = primer_instante - 86400, "
+                         "siguiente_instante = siguiente_instante - 86400")
+            conn.commit()
+        self.assertTrue(self.telegram.enviado.wait(2))
+        token, chat_id, mensaje = self.telegram.encolados[0]
+        self.assertEqual((token, chat_id), ("T", "42"))
+        self.assertIn("Ibuprofeno", mensaje)
+        self.assertIn("*Dosis restantes:* 2", mensaje)
+
+    def test_dialogo_rechaza_frecuencia_y_dosis_fuera_de_rango(self):
+        """Una frecuencia o un número de dosis inválidos se vuelven a pedir sin dejar un recordatorio huérfano"""
+        cliente = app.app.test_client()
+
+        def enviar(texto):
+            cliente.post("/telegram", query_string={"token": "T"},
+                         json={"message": {"chat": {"id": 42, "first_name": "Ana"}, "text": texto}})
+            return self.telegram.respuestas[-1]
+
+        for texto in ["/start", "1. Establecer recordatorio", "Ibuprofeno", "1 tableta"]:
+            enviar(texto)
+        for frecuencia in ["0", "-8"]:
+            self.assertIn("frecuencia", enviar(frecuencia))
+        enviar("8")
+        for dosis in ["0", "-1", str(app.DOSIS_POR_RECORDATORIO)]:
+            self.assertIn("cantidad de dosis", enviar(dosis))
+        self.assertEqual(self.db.get_recordatorios_activos("42"), [])
+
+        enviar("3")
+        enviar("20:00")
+        recordatorios = self.db.get_recordatorios_activos("42")
+        self.assertEqual(len(recordatorios), 1)
+
+
+
+class _TelegramHTTP(BaseHTTPRequestHandler):
+    """Telegram imitado por HTTP para un proceso aparte: anota (ruta, datos) de cada envío"""
+
+    def do_POST(self):
+        datos = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+        self.server.recibidos.append((self.path, {clave: valor[0] for clave, valor in datos.items()}))
+        self.server.recibido.set()
+        cuerpo = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestBarredorAlArrancar(unittest.TestCase):
+    def test_las_dosis_vencidas_se_envian_sin_ningun_mensaje(self):
+        """Un worker recién arrancado (solo importa la app, como uvicorn o gunicorn) envía las dosis vencidas"""
+        servidor = ThreadingHTTPServer(("127.0.0.1", 0), _TelegramHTTP)
+        servidor.recibidos, servidor.recibido = [], threading.Event()
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        with tempfile.TemporaryDirectory() as tmp:
+            ruta = os.path.join(tmp, "app.db")
+            db = DatabaseManager(ruta)
+            desde = datetime.now().replace(second=0, microsecond=0) - timedelta(minutes=1)
+            db.importar_tratamientos([{"chat_id": "7", "medicamento": "Ibuprofeno", "dosis": "1", "frecuencia": 24,
+                                       "hora_inicio": desde.strftime("%H:%M"), "total_dosis": 2, "token": "T"}],
+                                     desde=desde)
+            db.close()
+            entorno = dict(os.environ, DATABASE_PATH=ruta, SWEEPER_AUTOSTART="1", STATE_STORE="memory",
+                           RECOVERY_POLICY="send", FDA_INDEX_PATH=os.path.join(tmp, "fda_index.db"),
+                           TELEGRAM_API_URL=f"http://127.0.0.1:{servidor.server_port}")
+            worker = subprocess.Popen([sys.executable, "-c", "import app, time; time.sleep(60)"], env=entorno,
+                                      cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                self.assertTrue(servidor.recibido.wait(30))
+            finally:
+                worker.kill()
+                worker.wait()
+                servidor.shutdown()
+                servidor.server_close()
+        ruta_envio, datos = servidor.recibidos[0]
+        self.assertEqual(ruta_envio, "/botT/sendMessage")
+        self.assertEqual(datos["chat_id"], "7")
+        self.assertIn("Ibuprofeno", datos["text"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import app
+from BBDD import DatabaseManager
+from medication_cache import MedicationCache
+from single_flight import SingleFlight
+from translation_memory import TranslationMemory
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_llamadas_concurrentes_comparten_la_ejecucion(self):
+        vuelos = SingleFlight()
+        ejecuciones = []
+
+        async def consulta(clave):
+            ejecuciones.append(clave)
+            await asyncio.sleep(0.01)
+            return clave.upper()
+
+        async def escenario():
+            resultados = await asyncio.gather(*[vuelos.ejecutar(c, lambda c=c: consulta(c)) for c in "aaab"])
+            # Terminada la ejecución la clave se libera y la siguiente llamada vuelve a ejecutar
+            resultados.append(await vuelos.ejecutar("a", lambda: consulta("a")))
+            return resultados
+
+        self.assertEqual(asyncio.run(escenario()), ["A", "A", "A", "B", "A"])
+        self.assertEqual(ejecuciones, ["a", "b", "a"])
+        stats = vuelos.stats()
+        self.assertEqual((stats["llamadas"], stats["ejecuciones"], stats["compartidas"], stats["en_curso"]),
+                         (5, 3, 2, 0))
+
+    def test_la_excepcion_llega_a_todas_las_llamadas(self):
+        vuelos = SingleFlight()
+
+        async def falla():
+            await asyncio.sleep(0.01)
+            raise ValueError("OpenFDA caído")
+
+        async def escenario():
+            return await asyncio.gather(*[vuelos.ejecutar("x", falla) for _ in range(3)], return_exceptions=True)
+
+        errores = asyncio.run(escenario())
+        self.assertEqual([type(e) for e in errores], [ValueError] * 3)
+        self.assertFalse(vuelos.en_curso("x"))
+        self.assertEqual((vuelos.stats()["ejecuciones"], vuelos.stats()["errores"]), (1, 1))
+
+    def test_timeout_no_cancela_la_consulta_compartida(self):
+        vuelos = SingleFlight(timeout=1)
+
+        async def lenta():
+            await asyncio.sleep(0.05)
+            return "ok"
+
+        async def escenario():
+            impaciente = vuelos.ejecutar("x", lenta, timeout=0.01)
+            paciente = vuelos.ejecutar("x", lenta)
+            return await asyncio.gather(impaciente, paciente, return_exceptions=True)
+
+        impaciente, paciente = asyncio.run(escenario())
+        self.assertIsInstance(impaciente, asyncio.TimeoutError)
+        self.assertEqual(paciente, "ok")
+        self.assertEqual((vuelos.stats()["ejecuciones"], vuelos.stats()["timeouts"]), (1, 1))
+
+
+class _OpenFDAStub(BaseHTTPRequestHandler):
+    """OpenFDA lento que cuenta las peticiones recibidas"""
+    peticiones = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            type(self).peticiones += 1
+        time.sleep(0.2)
+        cuerpo = json.dumps({"results": [{"openfda": {"generic_name": ["IBUPROFEN"], "route": ["ORAL"]},
+                                          "warnings": ["Allergy alert"]}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestConsultasMedicamentosAgrupadas(unittest.TestCase):
+    def test_mil_consultas_simultaneas_una_llamada_a_openfda(self):
+        servidor = ThreadingHTTPServer(("127.0.0.1", 0), _OpenFDAStub)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{servidor.server_port}/drug/label.json?search=openfda.substance_name:"
+        traducciones = []
+
+        def traducir(texto, src, dest):
+            traducciones.append(texto)
+            time.sleep(0.05)
+            return mock.Mock(text=texto.lower())
+
+        async def consultas():
+            # Mayúsculas, tildes y espacios distintos: todas normalizan al mismo medicamento
+            nombres = ["Ibuprofeno", "IBUPROFENO", " ibuprofeno ", "ibuprofen"]
+            return await asyncio.gather(*[app.fetch_medication_info_async(nombres[i % 4]) for i in range(1000)])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            db = DatabaseManager(os.path.join(tmp, "test.db"))
+            try:
+                with mock.patch.object(app, "OPENFDA_URL", url), \
+                        mock.patch.object(app, "medication_cache", MedicationCache(db)), \
+                        mock.patch.object(app, "traducciones", TranslationMemory(db, app._traducir)), \
+                        mock.patch.object(app, "consultas_medicamentos", SingleFlight(timeout=10)) as vuelos, \
+                        mock.patch.object(app.fda_index, "buscar", return_value=None), \
+                        mock.patch.object(app.translator, "translate", side_effect=traducir):
+                    resultados = app.aio.run(consultas())
+                    # Ya en caché: la siguiente consulta tampoco sale a la red
+                    self.assertEqual(app.fetch_medication_info("ibuprofeno"), resultados[0])
+            finally:
+                db.close()
+                servidor.shutdown()
+                servidor.server_close()
+
+        self.assertIn("allergy alert", resultados[0])
+        self.assertEqual(resultados, resultados[:1] * 1000)
+        self.assertEqual(_OpenFDAStub.peticiones, 1)
+        self.assertEqual(len(traducciones), 1)
+        stats = vuelos.stats()
+        self.assertEqual((stats["ejecuciones"], stats["compartidas"], stats["en_curso"]), (1, 999, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from state_store import MemoryStateStore, SQLiteStateStore
+
+DIALOGO = ["/start", "1. Establecer recordatorio", "ibuprofeno", "1 tableta", "8", "3", "08:00", "No"]
+
+
+def _proceso_webhook(indice, procesos, chats, barrera):
+    """Cada paso del diálogo de un chat lo atiende un proceso distinto"""
+    import app
+    app.send_telegram_message = lambda *args, **kwargs: True
+    cliente = app.app.test_client()
+    for paso, texto in enumerate(DIALOGO):
+        for chat in range(chats):
+            if (chat + paso) % procesos == indice:
+                respuesta = cliente.post("/telegram", query_string={"token": "T"},
+                                         json={"message": {"chat": {"id": 1000 + chat}, "text": texto}})
+                assert respuesta.status_code == 200
+        app.updates.wait_idle()
+        barrera.wait()
+
+
+class TestStateStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.ruta = os.path.join(self.tmp.name, "test.db")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_memoria_expulsa_por_lru(self):
+        store = MemoryStateStore(maxsize=2)
+        store.set(1, {"step": "menu"})
+        store.set(2, {"step": "menu"})
+        store.get(1)
+        store.set(3, {"step": "menu"})
+        self.assertIsNone(store.get(2))
+        self.assertEqual(store.get(1), {"step": "menu"})
+        self.assertEqual(len(store), 2)
+
+    def test_memoria_caduca_por_inactividad(self):
+        store = MemoryStateStore(idle_ttl=60)
+        store.set(1, {"step": "menu"})
+        with mock.patch("state_store.time.time", return_value=10 ** 12):
+            self.assertIsNone(store.get(1))
+
+    def test_sqlite_comparte_un_pool_acotado(self):
+        """Muchos hilos usan como mucho max_conexiones conexiones, que close() cierra"""
+        store = SQLiteStateStore(self.ruta, purge_every=50, max_conexiones=2)
+        errores = []
+
+        def conversacion(chat):
+            try:
+                for paso in range(25):
+                    store.set(chat, {"step": paso})
+                    self.assertEqual(store.get(chat), {"step": paso})
+            except Exception as e:
+                errores.append(e)
+
+        hilos = [threading.Thread(target=conversacion, args=(chat,)) for chat in range(16)]
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+        self.assertEqual(errores, [])
+        self.assertEqual(store._escrituras, 400)
+        self.assertLessEqual(store.pool.stats()["creadas"], 2)
+        store.close()
+        self.assertEqual(store.pool.stats()["abiertas"], 0)
+
+    def test_sqlite_sobrevive_a_reinicios(self):
+        store = SQLiteStateStore(self.ruta)
+        store.set(1, {"step": "deleting_reminder", "opciones": {"1": 7}})
+        store.close()
+        otro = SQLiteStateStore(self.ruta)
+        self.assertEqual(otro.get(1), {"step": "deleting_reminder", "opciones": {"1": 7}})
+        otro.delete(1)
+        self.assertIsNone(otro.get(1))
+        otro.close()
+
+    def test_dialogo_repartido_entre_procesos(self):
+        """Varios procesos atienden el mismo diálogo de creación de recordatorios"""
+        procesos, chats = 3, 12
+        contexto = multiprocessing.get_context("spawn")
+        barrera = contexto.Barrier(procesos)
+        entorno = {"DATABASE_PATH": self.ruta, "STATE_STORE": "sqlite"}
+        with mock.patch.dict(os.environ, entorno):
+            trabajadores = [contexto.Process(target=_proceso_webhook, args=(i, procesos, chats, barrera))
+                            for i in range(procesos)]
+            for p in trabajadores:
+                p.start()
+            for p in trabajadores:
+                p.join(120)
+        self.assertTrue(all(p.exitcode == 0 for p in trabajadores))
+
+        conn = sqlite3.connect(self.ruta)
+        recordatorios = conn.execute('''
+        SELECT u.chat_id, COUNT(r.recordatorio_id), SUM(r.dosis_totales - r.siguiente_indice)
+        FROM Usuario u JOIN Recordatorio r ON r.usuario_id = u.usuario_id
+        WHERE r.intervalo IS NOT NULL
+        GROUP BY u.chat_id
+        ''').fetchall()
+        conn.close()
+        self.assertEqual(len(recordatorios), chats)
+        self.assertTrue(all(fila[1:] == (1, 3) for fila in recordatorios))
+        store = SQLiteStateStore(self.ruta)
+        self.assertTrue(all(store.get(1000 + chat)["step"] == "menu" for chat in range(chats)))
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
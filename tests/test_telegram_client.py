@@ -0,0 +1,67 @@
+import unittest
+from unittest import mock
+
+from telegram_client import RateLimiter, TelegramClient
+
+
+def respuesta(status, cuerpo):
+    r = mock.Mock(status_code=status)
+    r.json.return_value = cuerpo
+    return r
+
+
+class TestTelegramClient(unittest.TestCase):
+    def setUp(self):
+        self.cliente = TelegramClient("http://telegram.local", workers=2, global_rate=0, chat_interval=0)
+
+    def test_reintenta_429_respetando_retry_after(self):
+        """Un 429 espera lo que indica retry_after y vuelve a intentarlo"""
+        self.cliente.session.post = mock.Mock(side_effect=[
+            respuesta(429, {"ok": False, "parameters": {"retry_after": 3}}),
+            respuesta(200, {"ok": True}),
+        ])
+        with mock.patch("telegram_client.time.sleep") as sleep:
+            self.assertTrue(self.cliente.send("TOKEN", 1, "hola"))
+        sleep.assert_called_once_with(3)
+        stats = self.cliente.stats()
+        self.assertEqual((stats["enviados"], stats["limitados"], stats["reintentos"]), (1, 1, 1))
+
+    def test_no_reintenta_errores_del_cliente(self):
+        """Un 401 (token inválido) falla sin reintentos"""
+        self.cliente.session.post = mock.Mock(return_value=respuesta(401, {"ok": False}))
+        self.assertFalse(self.cliente.send("TOKEN", 1, "hola"))
+        self.assertEqual(self.cliente.session.post.call_count, 1)
+
+    def test_decision_por_respuesta(self):
+        """La política de reintentos que comparten el cliente síncrono y el asíncrono"""
+        decidir = self.cliente._procesar_respuesta
+        self.assertEqual(decidir(respuesta(200, {"ok": True}), 0, 0, 2), (True, None))
+        self.assertEqual(decidir(respuesta(429, {"parameters": {"retry_after": 7}}), 0, 0, 2), (None, 7))
+        self.assertEqual(decidir(respuesta(400, {"ok": False}), 0, 0, 2), (False, None))
+        # 5xx y errores de red: backoff hasta agotar los intentos
+        resultado, espera = decidir(None, 0, 1, 2)
+        self.assertIsNone(resultado)
+        self.assertTrue(0.5 <= espera <= 1)
+        self.assertEqual(decidir(respuesta(503, {}), 0, 2, 2), (False, None))
+        stats = self.cliente.stats()
+        self.assertEqual((stats["enviados"], stats["limitados"], stats["reintentos"], stats["fallidos"]),
+                         (1, 1, 2, 2))
+
+    def test_cola_reutiliza_la_sesion(self):
+        """Los mensajes encolados se envían todos por la sesión compartida"""
+        self.cliente.session.post = mock.Mock(return_value=respuesta(200, {"ok": True}))
+        self.cliente.enqueue_many(("TOKEN", i, "hola") for i in range(50))
+        self.cliente.join()
+        self.cliente.stop()
+        self.assertEqual(self.cliente.session.post.call_count, 50)
+
+    def test_rate_limiter_por_chat(self):
+        """El mismo chat espera CHAT_INTERVAL entre mensajes; otro chat no"""
+        limiter = RateLimiter(global_rate=0, chat_interval=1.0)
+        self.assertEqual(limiter.reservar("a"), 0)
+        self.assertAlmostEqual(limiter.reservar("a"), 1.0, places=2)
+        self.assertEqual(limiter.reservar("b"), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
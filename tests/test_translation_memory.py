@@ -0,0 +1,116 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import app
+from BBDD import DatabaseManager
+from medication_cache import MedicationCache
+from translation_memory import TranslationMemory, segmentar
+
+
+class TraductorLocal:
+    """Sustituye a googletrans: traduce línea a línea con un diccionario y anota cada llamada"""
+    FRASES = {"Allergy alert.": "Alerta de alergia.",
+              "Keep out of reach of children.": "Mantener fuera del alcance de los niños.",
+              "Stop use and ask a doctor if pain persists.": "Deje de usarlo y consulte a un médico si persiste."}
+
+    def __init__(self):
+        self.llamadas = []
+        self.disponible = True
+
+    def __call__(self, texto):
+        self.llamadas.append(texto)
+        if not self.disponible:
+            raise ConnectionError("traductor no disponible")
+        return "\n".join(self.FRASES.get(linea, f"[es] {linea}") for linea in texto.split("\n"))
+
+
+class TestTranslationMemory(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = DatabaseManager(os.path.join(self.tmp.name, "test.db"))
+        self.traductor = TraductorLocal()
+        self.memoria = TranslationMemory(self.db, self.traductor)
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def test_segmentar(self):
+        texto = "Allergy alert. Keep out of reach of children.\n\n• 2 tablets every 6 hours; do not exceed 6 tablets"
+        partes = segmentar(texto)
+        self.assertEqual(partes[::2], ["Allergy alert.", "Keep out of reach of children.",
+                                       "• 2 tablets every 6 hours; do not exceed 6 tablets"])
+        self.assertEqual("".join(partes), texto)
+
+    def test_solo_se_piden_los_segmentos_nuevos_en_una_llamada(self):
+        advertencias = "Allergy alert. Keep out of reach of children."
+        traducciones, sin_traducir = self.memoria.traducir(["IBUPROFEN", advertencias,
+                                                            "Keep out of reach of children."])
+        self.assertEqual(traducciones, ["[es] IBUPROFEN",
+                                        "Alerta de alergia. Mantener fuera del alcance de los niños.",
+                                        "Mantener fuera del alcance de los niños."])
+        self.assertEqual(sin_traducir, 0)
+        # Los segmentos repetidos se envían una sola vez
+        self.assertEqual(self.traductor.llamadas, ["IBUPROFEN\nAllergy alert.\nKeep out of reach of children."])
+
+        self.memoria.traducir(["NAPROXEN", advertencias + " Stop use and ask a doctor if pain persists.", "500 mg"])
+        self.assertEqual(self.traductor.llamadas[1], "NAPROXEN\nStop use and ask a doctor if pain persists.\n500 mg")
+        stats = self.memoria.stats()
+        self.assertEqual((stats["segmentos"], stats["hits_memoria"], stats["traducidos"], stats["llamadas"]),
+                         (8, 2, 6, 2))
+
+    def test_la_memoria_sobrevive_a_un_reinicio(self):
+        self.memoria.traducir(["Allergy alert. Keep out of reach of children."])
+        otra = TranslationMemory(self.db, self.traductor)
+        self.assertEqual(otra.traducir(["Keep out of reach of children.\nAllergy alert."]),
+                         (["Mantener fuera del alcance de los niños.\nAlerta de alergia."], 0))
+        self.assertEqual(len(self.traductor.llamadas), 1)
+        self.assertEqual(otra.stats()["hits_db"], 2)
+
+    def test_sin_traductor_se_sirve_lo_que_hay_en_memoria(self):
+        self.memoria.traducir(["Allergy alert."])
+        self.traductor.disponible = False
+        traducciones, sin_traducir = self.memoria.traducir(
+            ["Allergy alert. Stop use and ask a doctor if pain persists."])
+        self.assertEqual(traducciones, ["Alerta de alergia. Stop use and ask a doctor if pain persists."])
+        self.assertEqual(sin_traducir, 1)
+
+        # Al volver el traductor solo se pide lo que faltaba
+        self.traductor.disponible = True
+        self.assertEqual(self.memoria.traducir(["Stop use and ask a doctor if pain persists."])[1], 0)
+        self.assertEqual(self.traductor.llamadas[-1], "Stop use and ask a doctor if pain persists.")
+        self.assertEqual(self.memoria.stats()["errores"], 1)
+
+    def test_lote_descuadrado_se_traduce_segmento_a_segmento(self):
+        # Un traductor que une las líneas del lote en una sola
+        memoria = TranslationMemory(self.db, lambda texto: self.traductor(texto).replace("\n", " "))
+        traducciones, sin_traducir = memoria.traducir(["Allergy alert.", "IBUPROFEN"])
+        self.assertEqual((traducciones, sin_traducir), (["Alerta de alergia.", "[es] IBUPROFEN"], 0))
+        self.assertEqual(memoria.stats()["lotes_descuadrados"], 1)
+        self.assertEqual(len(self.traductor.llamadas), 3)
+
+    def test_fetch_medication_info_con_el_traductor_caido(self):
+        """Sin traductor se responde en inglés y no se guarda el texto, así la próxima consulta lo traduce"""
+        respuesta = mock.Mock(status_code=200)
+        respuesta.json.return_value = {"results": [{"openfda": {"generic_name": ["IBUPROFEN"]},
+                                                    "warnings": ["Allergy alert. Keep out of reach of children."]}]}
+        cache = MedicationCache(self.db)
+        self.traductor.disponible = False
+        with mock.patch.object(app, "medication_cache", cache), \
+                mock.patch.object(app, "traducciones", self.memoria), \
+                mock.patch.object(app.fda_index, "buscar", return_value=None), \
+                mock.patch.object(app.http, "get", mock.AsyncMock(return_value=respuesta)) as get:
+            self.assertIn("Allergy alert. Keep out of reach of children.", app.fetch_medication_info("ibuprofeno"))
+            self.assertIsNone(cache.get("IBUPROFEN")["texto"])
+
+            self.traductor.disponible = True
+            info = app.fetch_medication_info("ibuprofeno")
+        self.assertIn("Alerta de alergia. Mantener fuera del alcance de los niños.", info)
+        self.assertEqual(cache.get("IBUPROFEN")["texto"], info)
+        self.assertEqual(get.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
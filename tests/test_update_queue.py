@@ -0,0 +1,57 @@
+import random
+import threading
+import time
+import unittest
+
+from update_queue import UpdateDispatcher
+
+
+def update(update_id, chat_id, text="hola"):
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "text": text}}
+
+
+class TestUpdateDispatcher(unittest.TestCase):
+    def test_descarta_update_id_repetidos(self):
+        procesados = []
+        dispatcher = UpdateDispatcher(lambda token, u: procesados.append(u["update_id"]), workers=2)
+        self.assertTrue(dispatcher.submit("T", update(1, 10)))
+        self.assertFalse(dispatcher.submit("T", update(1, 10)))
+        self.assertTrue(dispatcher.submit("T", update(2, 10)))
+        dispatcher.wait_idle()
+        self.assertEqual(procesados, [1, 2])
+        self.assertEqual(dispatcher.stats()["duplicados"], 1)
+
+    def test_orden_por_chat_con_varios_trabajadores(self):
+        """Los mensajes de cada chat se procesan en orden aunque haya concurrencia"""
+        por_chat = {}
+        lock = threading.Lock()
+
+        def handler(token, u):
+            time.sleep(random.random() / 1000)
+            with lock:
+                por_chat.setdefault(u["message"]["chat"]["id"], []).append(u["update_id"])
+
+        dispatcher = UpdateDispatcher(handler, workers=4)
+        for update_id in range(400):
+            dispatcher.submit("T", update(update_id, update_id % 10))
+        dispatcher.wait_idle()
+        self.assertEqual(len(por_chat), 10)
+        for chat_id, ids in por_chat.items():
+            self.assertEqual(ids, sorted(ids))
+            self.assertEqual(len(ids), 40)
+
+    def test_errores_no_detienen_al_trabajador(self):
+        def handler(token, u):
+            if u["update_id"] == 1:
+                raise RuntimeError("fallo")
+
+        dispatcher = UpdateDispatcher(handler, workers=1)
+        dispatcher.submit("T", update(1, 10))
+        dispatcher.submit("T", update(2, 10))
+        dispatcher.wait_idle()
+        stats = dispatcher.stats()
+        self.assertEqual((stats["procesados"], stats["errores"]), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import app
+from BBDD import DatabaseManager
+from state_store import MemoryStateStore
+from user_cache import UserCache
+
+
+class Contador:
+    """Envuelve el repositorio y anota cada método llamado"""
+
+    def __init__(self, db):
+        self.db = db
+        self.llamadas = []
+
+    def __getattr__(self, nombre):
+        atributo = getattr(self.db, nombre)
+        if not callable(atributo):
+            return atributo
+
+        def envoltura(*args, **kwargs):
+            self.llamadas.append(nombre)
+            return atributo(*args, **kwargs)
+        return envoltura
+
+
+class TestUserCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.real = DatabaseManager(os.path.join(self.tmp.name, "test.db"))
+        self.db = Contador(self.real)
+        self.cache = UserCache(self.db)
+
+    def tearDown(self):
+        self.real.close()
+        self.tmp.cleanup()
+
+    def test_usuario_nuevo_sin_lecturas_posteriores(self):
+        usuario_id = self.cache.registrar("1", "Ana")
+        self.assertEqual(self.real.get_usuario_id("1"), usuario_id)
+        self.db.llamadas.clear()
+        self.assertEqual(self.cache.registrar("1"), usuario_id)
+        self.assertEqual(self.cache.get("1"), {"usuario_id": usuario_id, "es_premium": False, "recordatorios_activos": 0})
+        self.assertEqual(self.db.llamadas, [])
+
+    def test_usuario_existente_se_lee_una_vez(self):
+        usuario_id = self.real.add_usuario("1")
+        self.real.add_recordatorio("1", "ibuprofeno", "1", 8, "08:00", 3)
+        self.assertEqual(self.cache.registrar("1"), usuario_id)
+        self.assertEqual(self.cache.get("1")["recordatorios_activos"], 1)
+        self.assertEqual(self.db.llamadas, ["get_datos_usuario"])
+        self.assertIsNone(self.cache.get("desconocido"))
+
+    def test_invalidar_relee_los_datos(self):
+        self.cache.registrar("1")
+        self.real.marcar_como_premium("1")
+        self.assertFalse(self.cache.get("1")["es_premium"])
+        self.cache.invalidar("1")
+        self.assertTrue(self.cache.get("1")["es_premium"])
+        stats = self.cache.stats()
+        self.assertEqual((stats["invalidaciones"], stats["entradas"]), (1, 1))
+
+    def test_invalidacion_durante_la_lectura(self):
+        """Lo leído antes de una invalidación no se guarda: podría ser anterior al cambio"""
+        self.real.add_usuario("1")
+        leer = self.real.get_datos_usuario
+
+        def leer_e_invalidar(chat_id):
+            fila = leer(chat_id)
+            self.cache.invalidar(chat_id)
+            return fila
+
+        with mock.patch.object(self.db, "get_datos_usuario", leer_e_invalidar, create=True):
+            self.assertIsNotNone(self.cache.get("1"))
+        self.assertEqual(self.cache.stats()["entradas"], 0)
+
+    def test_caduca(self):
+        self.cache.registrar("1")
+        with mock.patch("medication_cache.time.time", return_value=10 ** 12):
+            self.db.llamadas.clear()
+            self.cache.get("1")
+        self.assertEqual(self.db.llamadas, ["get_datos_usuario"])
+
+
+class TestMenuSinLecturas(unittest.TestCase):
+    """Un usuario que vuelve navega por el menú sin consultar la base de datos"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.real = DatabaseManager(os.path.join(self.tmp.name, "test.db"))
+        self.db = Contador(self.real)
+        self.enviados = []
+        self.parches = [
+            mock.patch.object(app, "db", self.db),
+            mock.patch.object(app, "user_cache", UserCache(self.db)),
+            mock.patch.object(app, "user_states", MemoryStateStore()),
+            mock.patch.object(app, "send_telegram_message",
+                              lambda token, chat_id, texto, reply_markup=None: self.enviados.append(texto)),
+            mock.patch.object(app, "schedule_reminders", lambda recordatorio_id: None),
+        ]
+        for parche in self.parches:
+            parche.start()
+
+    def tearDown(self):
+        for parche in reversed(self.parches):
+            parche.stop()
+        self.real.close()
+        self.tmp.cleanup()
+
+    def mensaje(self, texto):
+        app.handle_message("TOKEN", {"message": {"chat": {"id": 7, "first_name": "Ana"}, "text": texto}})
+
+    def test_navegacion_sin_lecturas(self):
+        for texto in ("/start", "1. Establecer recordatorio", "/start"):
+            self.mensaje(texto)
+        self.db.llamadas.clear()
+        for texto in ("1. Establecer recordatorio", "/start", "2. Obtener información medicamento", "/start",
+                      "1. Establecer recordatorio", "/start", "5. Suscribirse a Premium"):
+            self.mensaje(texto)
+        self.assertEqual(self.db.llamadas, [])
+
+    def test_limite_tras_crear_recordatorios(self):
+        """Crear o borrar recordatorios invalida la caché y el límite de 3 se respeta"""
+        self.mensaje("/start")
+        for i in range(3):
+            for texto in ("1. Establecer recordatorio", f"med{i}", "1", "8", "3", "08:00", "No"):
+                self.mensaje(texto)
+        self.mensaje("1. Establecer recordatorio")
+        self.assertIn("límite de 3 recordatorios", self.enviados[-1])
+
+        self.real.marcar_como_premium("7")
+        app.user_cache.invalidar(7)
+        self.mensaje("/start")
+        self.mensaje("1. Establecer recordatorio")
+        self.assertEqual(self.enviados[-1], "Por favor, introduce el nombre del medicamento.")
+
+    def test_premium_de_otro_proceso_no_bloquea(self):
+        """Antes de rechazar por el límite se confirma en la base de datos"""
+        self.mensaje("/start")
+        usuario_id = self.real.get_usuario_id("7")
+        app.user_cache.memoria.set("7", {"usuario_id": usuario_id, "es_premium": False, "recordatorios_activos": 3}, 300)
+        self.mensaje("1. Establecer recordatorio")
+        self.assertEqual(self.enviados[-1], "Por favor, introduce el nombre del medicamento.")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import hashlib
+import re
+import threading
+
+from medication_cache import LRUCache
+
+# Cortes entre segmentos: saltos de línea y finales de frase seguidos de mayúscula, cifra o viñeta.
+# El grupo hace que re.split devuelva también los separadores para recomponer el texto
+_CORTE = re.compile(r"(\s*\n\s*|(?<=[.!?;])\s+(?=[A-Z0-9\"'(•]))")
+# Solo se traducen los segmentos con alguna letra ("500 mg" sí, "•" o "2.5" no)
+_LETRA = re.compile(r"[^\W\d_]")
+# Segundos que un segmento sigue en el LRU; en la base de datos no caduca
+TTL_MEMORIA = 24 * 3600
+
+
+def segmentar(texto):
+    """Parte el texto en [segmento, separador, segmento, ...] por líneas y frases"""
+    return _CORTE.split(texto)
+
+
+def clave_segmento(segmento, src, dest):
+    return hashlib.sha256(f"{src}>{dest}\n{segmento}".encode()).hexdigest()
+
+
+class TranslationMemory:
+    """Traducción por segmentos con una memoria persistente de los ya traducidos.
+
+    Los textos se parten en frases y líneas; cada segmento se busca por el
+    hash de su texto en un LRU en memoria y después en la tabla
+    MemoriaTraduccion del repositorio, así que los párrafos repetidos entre
+    etiquetas (y entre reinicios) se traducen una sola vez. Los que faltan se
+    envían al traductor en una sola llamada, una línea por segmento.
+
+    `traducir` es la función que llama al traductor: recibe un texto y
+    devuelve su traducción, o None si el traductor no está disponible. En ese
+    caso los segmentos que ya estaban en la memoria se sirven traducidos y el
+    resto se deja en el idioma original.
+    """
+
+    def __init__(self, db, traducir, src="en", dest="es", maxsize=4096):
+        self.db = db
+        self.traducir_texto = traducir
+        self.src = src
+        self.dest = dest
+        self.memoria = LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self._contadores = {"segmentos": 0, "hits_memoria": 0, "hits_db": 0, "traducidos": 0, "sin_traducir": 0,
+                            "llamadas": 0, "errores": 0, "lotes_descuadrados": 0}
+
+    def traducir(self, textos):
+        """Traduce una lista de textos; devuelve (traducciones, sin_traducir).
+
+        `sin_traducir` cuenta los segmentos que se devuelven en el idioma
+        original porque el traductor falló.
+        """
+        partes = [segmentar(texto or "") for texto in textos]
+        segmentos = {}
+        for texto in partes:
+            for i in range(0, len(texto), 2):
+                segmento = " ".join(texto[i].split())
+                if _LETRA.search(segmento):
+                    segmentos.setdefault(segmento, clave_segmento(segmento, self.src, self.dest))
+
+        traducciones = self._buscar(segmentos)
+        faltan = [segmento for segmento in segmentos if segmento not in traducciones]
+        nuevas = self._pedir(faltan, segmentos) if faltan else {}
+        traducciones.update(nuevas)
+
+        resultado, sin_traducir = [], 0
+        for texto in partes:
+            for i in range(0, len(texto), 2):
+                segmento = " ".join(texto[i].split())
+                if segmento in traducciones:
+                    texto[i] = traducciones[segmento]
+                elif segmento in segmentos:
+                    sin_traducir += 1
+            resultado.append("".join(texto))
+        self._contar(segmentos=len(segmentos), sin_traducir=len(faltan) - len(nuevas))
+        return resultado, sin_traducir
+
+    def _buscar(self, segmentos):
+        """{segmento: traducción} de los que ya están en el LRU o en la base de datos"""
+        encontrados, pendientes = {}, {}
+        for segmento, clave in segmentos.items():
+            traduccion = self.memoria.get(clave)
+            if traduccion is not None:
+                encontrados[segmento] = traduccion
+            else:
+                pendientes[clave] = segmento
+        hits_memoria = len(encontrados)
+        if pendientes:
+            for clave, traduccion in self.db.get_traducciones(list(pendientes)).items():
+                encontrados[pendientes[clave]] = traduccion
+                self.memoria.set(clave, traduccion, TTL_MEMORIA)
+        self._contar(hits_memoria=hits_memoria, hits_db=len(encontrados) - hits_memoria)
+        return encontrados
+
+    def _pedir(self, faltan, segmentos):
+        """Traduce los segmentos que faltan en una sola llamada y los guarda en la memoria"""
+        self._contar(llamadas=1)
+        lineas = self._llamar("\n".join(faltan))
+        if lineas is None:
+            return {}
+        if len(lineas) != len(faltan):
+            # El traductor unió o partió líneas: no se puede saber qué traducción es de qué segmento
+            self._contar(lotes_descuadrados=1, llamadas=len(faltan))
+            lineas = []
+            for segmento in faltan:
+                traduccion = self._llamar(segmento)
+                if traduccion is None:
+                    break
+                lineas.append(" ".join(traduccion))
+        traducciones = dict(zip(faltan, lineas))
+        if traducciones:
+            self.db.guardar_traducciones([(segmentos[segmento], segmento, traduccion)
+                                          for segmento, traduccion in traducciones.items()])
+            for segmento, traduccion in traducciones.items():
+                self.memoria.set(segmentos[segmento], traduccion, TTL_MEMORIA)
+        self._contar(traducidos=len(traducciones))
+        return traducciones
+
+    def _llamar(self, texto):
+        """Líneas no vacías de la traducción, o None si el traductor falla"""
+        try:
+            traduccion = self.traducir_texto(texto)
+        except Exception:
+            traduccion = None
+        if not traduccion:
+            self._contar(errores=1)
+            return None
+        return [linea.strip() for linea in traduccion.split("\n") if linea.strip()]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._contadores)
+        total = stats["segmentos"]
+        stats["hit_rate"] = (stats["hits_memoria"] + stats["hits_db"]) / total if total else 0.0
+        stats["entradas_memoria"] = len(self.memoria)
+        return stats
+
+    def _contar(self, **incrementos):
+        with self._lock:
+            for clave, valor in incrementos.items():
+                self._contadores[clave] += valor
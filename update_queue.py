@@ -0,0 +1,86 @@
+import queue
+import threading
+import zlib
+from collections import OrderedDict
+
+
+class UpdateDispatcher:
+    """Procesa las actualizaciones de Telegram fuera del hilo de la petición.
+
+    Cada chat se asigna siempre al mismo trabajador (por hash del chat_id), así
+    que los mensajes de un chat se procesan en el orden en que llegaron aunque
+    haya varios trabajadores. Las actualizaciones repetidas (mismo update_id,
+    p. ej. reintentos de Telegram) se descartan.
+    Con workers=0 el procesamiento es síncrono, en el hilo que llama a submit.
+    """
+
+    def __init__(self, handler, workers=8, dedup_size=10000):
+        self._handler = handler
+        self.workers = workers
+        self.dedup_size = dedup_size
+        self._vistos = OrderedDict()
+        self._lock = threading.Lock()
+        self._colas = [queue.Queue() for _ in range(workers)]
+        self._threads = []
+        self._metrics = {"encolados": 0, "duplicados": 0, "procesados": 0, "errores": 0}
+
+    def submit(self, token, update):
+        """Encola una actualización; devuelve False si es un duplicado"""
+        update_id = update.get("update_id")
+        with self._lock:
+            if update_id is not None:
+                if update_id in self._vistos:
+                    self._metrics["duplicados"] += 1
+                    return False
+                self._vistos[update_id] = True
+                if len(self._vistos) > self.dedup_size:
+                    self._vistos.popitem(last=False)
+            self._metrics["encolados"] += 1
+
+        if not self.workers:
+            self._procesar(token, update)
+            return True
+
+        self._start()
+        chat_id = update["message"]["chat"]["id"]
+        cola = self._colas[zlib.crc32(str(chat_id).encode()) % self.workers]
+        cola.put((token, update))
+        return True
+
+    def wait_idle(self):
+        """Espera a que se hayan procesado todas las actualizaciones encoladas"""
+        for cola in self._colas:
+            cola.join()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._metrics)
+        stats["pendientes"] = sum(cola.qsize() for cola in self._colas)
+        return stats
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i, cola in enumerate(self._colas):
+                t = threading.Thread(target=self._worker, args=(cola,), name=f"webhook-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _worker(self, cola):
+        while True:
+            token, update = cola.get()
+            try:
+                self._procesar(token, update)
+            finally:
+                cola.task_done()
+
+    def _procesar(self, token, update):
+        try:
+            self._handler(token, update)
+            resultado = "procesados"
+        except Exception as e:
+            print(f"Error al procesar la actualización {update.get('update_id')}: {e}")
+            resultado = "errores"
+        with self._lock:
+            self._metrics[resultado] += 1
@@ -0,0 +1,82 @@
+import threading
+
+from medication_cache import LRUCache
+
+
+class UserCache:
+    """Caché por proceso de chat_id → (usuario_id, es_premium, recordatorios activos).
+
+    Evita que cada paso del menú de un usuario conocido consulte la base de
+    datos. Quien modifica esos datos llama a `invalidar` (alta de recordatorio,
+    borrado, paso a premium); los cambios hechos por otros procesos se ven al
+    caducar la entrada (`ttl`). Los usuarios que no existen no se guardan.
+    """
+
+    def __init__(self, db, maxsize=10000, ttl=300):
+        self.db = db
+        self.ttl = ttl
+        self.memoria = LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self._invalidaciones = 0
+        self._contadores = {"hits": 0, "misses": 0, "invalidaciones": 0}
+
+    def get(self, chat_id, refrescar=False):
+        """Devuelve {"usuario_id", "es_premium", "recordatorios_activos"} o None si el usuario no existe"""
+        clave = str(chat_id)
+        if not refrescar:
+            datos = self.memoria.get(clave)
+            if datos is not None:
+                self._contar("hits")
+                return datos
+
+        self._contar("misses")
+        with self._lock:
+            version = self._invalidaciones
+        fila = self.db.get_datos_usuario(chat_id)
+        if fila is None:
+            return None
+        datos = {
+            "usuario_id": fila["usuario_id"],
+            "es_premium": bool(fila["es_premium"]),
+            "recordatorios_activos": fila["recordatorios_activos"],
+        }
+        self._guardar(clave, datos, version)
+        return datos
+
+    def registrar(self, chat_id, nombre=None, telefono=None):
+        """Da de alta al usuario si este proceso no lo conoce ya y devuelve su usuario_id"""
+        datos = self.get(chat_id)
+        if datos is not None:
+            return datos["usuario_id"]
+
+        with self._lock:
+            version = self._invalidaciones
+        usuario_id = self.db.add_usuario(chat_id, nombre, telefono)
+        # Un usuario recién creado no es premium ni tiene recordatorios: no hace falta leerlo
+        self._guardar(str(chat_id), {"usuario_id": usuario_id, "es_premium": False, "recordatorios_activos": 0}, version)
+        return usuario_id
+
+    def invalidar(self, chat_id):
+        """Olvida los datos del chat; la siguiente consulta los vuelve a leer"""
+        with self._lock:
+            self._invalidaciones += 1
+            self._contadores["invalidaciones"] += 1
+            self.memoria.delete(str(chat_id))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._contadores)
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / total if total else 0.0
+        stats["entradas"] = len(self.memoria)
+        return stats
+
+    def _guardar(self, clave, datos, version):
+        with self._lock:
+            # Si hubo una invalidación durante la lectura, lo leído puede ser anterior a ella
+            if version == self._invalidaciones:
+                self.memoria.set(clave, datos, self.ttl)
+
+    def _contar(self, clave):
+        with self._lock:
+            self._contadores[clave] += 1